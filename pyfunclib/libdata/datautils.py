@@ -115,4 +115,69 @@ def padarray(arraylist,padval=np.nan):
     # lengths can also be gotten this way:
     # lengths = [eachlength for eachlength in map(len, arraylist)]
 
-    
\ No newline at end of file
+    
+#------------------------------------------------------------------------------
+# ragged arrays
+#------------------------------------------------------------------------------
+
+# a ragged array is stored as an (indptr, values) pair, same as the rows of a scipy.sparse.csr_matrix: the values of row i are values[indptr[i]:indptr[i+1]]. this avoids padding every row to the length of the longest one
+
+def list2ragged(arraylist,dtype=None):
+    """
+    convert a list of lists (or arrays) to a ragged (indptr, values) pair
+    """
+    lengths = np.fromiter(map(len, arraylist), dtype=np.int64, count=len(arraylist))
+    indptr = np.concatenate(([0], np.cumsum(lengths)))
+    # skip empty lists so they don't promote int values to float
+    arraylist = [np.asarray(eachlist) for eachlist in arraylist if len(eachlist)]
+    if len(arraylist) == 0:
+        values = np.empty(0, dtype=np.float64 if dtype is None else dtype)
+    else:
+        values = np.concatenate(arraylist)
+        if dtype is not None:
+            values = values.astype(dtype)
+    return indptr,values
+
+#------------------------------------------------------------------------------
+def ragged2list(indptr,values):
+    """
+    convert a ragged (indptr, values) pair to a list of arrays (views on values)
+    """
+    return np.split(values, indptr[1:-1])
+
+#------------------------------------------------------------------------------
+def ragged2padded(indptr,values,padval=np.nan):
+    """
+    convert a ragged (indptr, values) pair to a uniform-sized array padded with padval, same as padarray on the equivalent list of lists
+    """
+    lengths = np.diff(indptr)
+    maxlen = lengths.max() if len(lengths) else 0
+    mask = lengths[:,None] > np.arange(maxlen)
+    paddedarray = np.full(mask.shape, padval, dtype=np.result_type(values.dtype, np.asarray(padval).dtype))
+    paddedarray[mask] = values[indptr[0]:indptr[-1]]
+    return paddedarray
+
+#------------------------------------------------------------------------------
+def sortragged(indptr,values):
+    """
+    sort the values within each row of a ragged (indptr, values) pair
+    """
+    irow = np.repeat(np.arange(len(indptr) - 1), np.diff(indptr))
+    return values[indptr[0]:indptr[-1]][np.lexsort((values[indptr[0]:indptr[-1]], irow))]
+
+#------------------------------------------------------------------------------
+def ragged2csr(indptr,indices,ncols):
+    """
+    convert a ragged (indptr, indices) pair of column indices to a boolean scipy.sparse.csr_matrix with shape (len(indptr)-1, ncols)
+    """
+    from scipy.sparse import csr_matrix
+    data = np.ones(len(indices), dtype=bool)
+    return csr_matrix((data, indices, indptr), shape=(len(indptr) - 1, ncols))
+
+#------------------------------------------------------------------------------
+def csr2padded(matrix,padval=np.nan,colvalues=None):
+    """
+    convert the column indices of the nonzeros in each row of a scipy.sparse.csr_matrix to a uniform-sized padded array. if colvalues is given, the column indices are first mapped through it (e.g. colvalues = cell IDs)
+    """
+    values = matrix.indices if colvalues is None else np.asarray(colvalues)[matrix.indices]
+    return ragged2padded(matrix.indptr, values, padval)
@@ -1,9 +1,17 @@
 # https://gist.github.com/bshishov/5dc237f59f019b26145648e2124ca1c9
 
+from functools import cached_property, partial
+
 import numpy as np
 
 EPSILON = 1e-10
 
+# number of values (time x members) evaluated at a time by evaluate(..., axis=...)
+BLOCKSIZE = 2**17
+
+# number of values (time x replicates x members) resampled at a time by evaluate(..., bootstrap=...)
+BOOTSTRAPSIZE = 2**22
+
 
 def _error(actual: np.ndarray, predicted: np.ndarray):
     """ Simple error """
@@ -70,50 +78,50 @@ def _geometric_mean(a, axis=0, dtype=None):
     return np.exp(log_a.mean(axis=axis))
 
 
-def mse(actual: np.ndarray, predicted: np.ndarray):
+def mse(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """ Mean Squared Error """
-    return np.mean(np.square(_error(actual, predicted)))
+    return _metric('mse', actual, predicted, axis=axis, mask=mask, skipna=skipna)
 
 
-def rmse(actual: np.ndarray, predicted: np.ndarray):
+def rmse(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """ Root Mean Squared Error """
-    return np.sqrt(mse(actual, predicted))
+    return _metric('rmse', actual, predicted, axis=axis, mask=mask, skipna=skipna)
 
 
-def nrmse(actual: np.ndarray, predicted: np.ndarray):
+def nrmse(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """ Normalized Root Mean Squared Error """
-    return rmse(actual, predicted) / (actual.max() - actual.min())
+    return _metric('nrmse', actual, predicted, axis=axis, mask=mask, skipna=skipna)
 
 
-def me(actual: np.ndarray, predicted: np.ndarray):
+def me(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """ Mean Error """
-    return np.mean(_error(actual, predicted))
+    return _metric('me', actual, predicted, axis=axis, mask=mask, skipna=skipna)
 
 
-def mae(actual: np.ndarray, predicted: np.ndarray):
+def mae(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """ Mean Absolute Error """
-    return np.mean(np.abs(_error(actual, predicted)))
+    return _metric('mae', actual, predicted, axis=axis, mask=mask, skipna=skipna)
 
 
 mad = mae  # Mean Absolute Deviation (it is the same as MAE)
 
 
-def gmae(actual: np.ndarray, predicted: np.ndarray):
+def gmae(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """ Geometric Mean Absolute Error """
-    return _geometric_mean(np.abs(_error(actual, predicted)))
+    return _metric('gmae', actual, predicted, axis=axis, mask=mask, skipna=skipna)
 
 
-def mdae(actual: np.ndarray, predicted: np.ndarray):
+def mdae(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """ Median Absolute Error """
-    return np.median(np.abs(_error(actual, predicted)))
+    return _metric('mdae', actual, predicted, axis=axis, mask=mask, skipna=skipna)
 
 
-def mpe(actual: np.ndarray, predicted: np.ndarray):
+def mpe(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """ Mean Percentage Error """
-    return np.mean(_percentage_error(actual, predicted))
+    return _metric('mpe', actual, predicted, axis=axis, mask=mask, skipna=skipna)
 
 
-def mape(actual: np.ndarray, predicted: np.ndarray):
+def mape(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """
     Mean Absolute Percentage Error
 
@@ -125,139 +133,183 @@ def mape(actual: np.ndarray, predicted: np.ndarray):
 
     Note: result is NOT multiplied by 100
     """
-    return np.mean(np.abs(_percentage_error(actual, predicted)))
+    return _metric('mape', actual, predicted, axis=axis, mask=mask, skipna=skipna)
 
 
-def mdape(actual: np.ndarray, predicted: np.ndarray):
+def mdape(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """
     Median Absolute Percentage Error
 
     Note: result is NOT multiplied by 100
     """
-    return np.median(np.abs(_percentage_error(actual, predicted)))
+    return _metric('mdape', actual, predicted, axis=axis, mask=mask, skipna=skipna)
 
 
-def smape(actual: np.ndarray, predicted: np.ndarray):
+def smape(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """
     Symmetric Mean Absolute Percentage Error
 
     Note: result is NOT multiplied by 100
     """
-    return np.mean(2.0 * np.abs(actual - predicted) / ((np.abs(actual) + np.abs(predicted)) + EPSILON))
+    return _metric('smape', actual, predicted, axis=axis, mask=mask, skipna=skipna)
 
 
-def smdape(actual: np.ndarray, predicted: np.ndarray):
+def smdape(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """
     Symmetric Median Absolute Percentage Error
 
     Note: result is NOT multiplied by 100
     """
-    return np.median(2.0 * np.abs(actual - predicted) / ((np.abs(actual) + np.abs(predicted)) + EPSILON))
+    return _metric('smdape', actual, predicted, axis=axis, mask=mask, skipna=skipna)
 
 
-def maape(actual: np.ndarray, predicted: np.ndarray):
+def maape(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """
     Mean Arctangent Absolute Percentage Error
 
     Note: result is NOT multiplied by 100
     """
-    return np.mean(np.arctan(np.abs((actual - predicted) / (actual + EPSILON))))
+    return _metric('maape', actual, predicted, axis=axis, mask=mask, skipna=skipna)
 
 
-def mase(actual: np.ndarray, predicted: np.ndarray, seasonality: int = 1):
+def mase(actual: np.ndarray, predicted: np.ndarray, seasonality: int = 1, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """
     Mean Absolute Scaled Error
 
     Baseline (benchmark) is computed with naive forecasting (shifted by @seasonality)
     """
-    return mae(actual, predicted) / mae(actual[seasonality:], _naive_forecasting(actual, seasonality))
+    return _metric('mase', actual, predicted, seasonality=seasonality, axis=axis, mask=mask, skipna=skipna)
 
 
-def std_ae(actual: np.ndarray, predicted: np.ndarray):
+def std_ae(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """ Normalized Absolute Error """
-    __mae = mae(actual, predicted)
-    return np.sqrt(np.sum(np.square(_error(actual, predicted) - __mae))/(len(actual) - 1))
+    return _metric('std_ae', actual, predicted, axis=axis, mask=mask, skipna=skipna)
 
 
-def std_ape(actual: np.ndarray, predicted: np.ndarray):
+def std_ape(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """ Normalized Absolute Percentage Error """
-    __mape = mape(actual, predicted)
-    return np.sqrt(np.sum(np.square(_percentage_error(actual, predicted) - __mape))/(len(actual) - 1))
+    return _metric('std_ape', actual, predicted, axis=axis, mask=mask, skipna=skipna)
 
 
-def rmspe(actual: np.ndarray, predicted: np.ndarray):
+def rmspe(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """
     Root Mean Squared Percentage Error
 
     Note: result is NOT multiplied by 100
     """
-    return np.sqrt(np.mean(np.square(_percentage_error(actual, predicted))))
+    return _metric('rmspe', actual, predicted, axis=axis, mask=mask, skipna=skipna)
 
 
-def rmdspe(actual: np.ndarray, predicted: np.ndarray):
+def rmdspe(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """
     Root Median Squared Percentage Error
 
     Note: result is NOT multiplied by 100
     """
-    return np.sqrt(np.median(np.square(_percentage_error(actual, predicted))))
+    return _metric('rmdspe', actual, predicted, axis=axis, mask=mask, skipna=skipna)
 
 
-def rmsse(actual: np.ndarray, predicted: np.ndarray, seasonality: int = 1):
+def rmsse(actual: np.ndarray, predicted: np.ndarray, seasonality: int = 1, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """ Root Mean Squared Scaled Error """
-    q = np.abs(_error(actual, predicted)) / mae(actual[seasonality:], _naive_forecasting(actual, seasonality))
-    return np.sqrt(np.mean(np.square(q)))
+    return _metric('rmsse', actual, predicted, seasonality=seasonality, axis=axis, mask=mask, skipna=skipna)
 
 
-def inrse(actual: np.ndarray, predicted: np.ndarray):
+def inrse(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """ Integral Normalized Root Squared Error """
-    return np.sqrt(np.sum(np.square(_error(actual, predicted))) / np.sum(np.square(actual - np.mean(actual))))
+    return _metric('inrse', actual, predicted, axis=axis, mask=mask, skipna=skipna)
 
 
-def rrse(actual: np.ndarray, predicted: np.ndarray):
+def rrse(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """ Root Relative Squared Error """
-    return np.sqrt(np.sum(np.square(actual - predicted)) / np.sum(np.square(actual - np.mean(actual))))
+    return _metric('rrse', actual, predicted, axis=axis, mask=mask, skipna=skipna)
 
 
-def mre(actual: np.ndarray, predicted: np.ndarray, benchmark: np.ndarray = None):
+def mre(actual: np.ndarray, predicted: np.ndarray, benchmark: np.ndarray = None, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """ Mean Relative Error """
-    return np.mean(_relative_error(actual, predicted, benchmark))
+    return _metric('mre', actual, predicted, benchmark=benchmark, axis=axis, mask=mask, skipna=skipna)
 
 
-def rae(actual: np.ndarray, predicted: np.ndarray):
+def rae(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """ Relative Absolute Error (aka Approximation Error) """
-    return np.sum(np.abs(actual - predicted)) / (np.sum(np.abs(actual - np.mean(actual))) + EPSILON)
+    return _metric('rae', actual, predicted, axis=axis, mask=mask, skipna=skipna)
 
 
-def mrae(actual: np.ndarray, predicted: np.ndarray, benchmark: np.ndarray = None):
+def mrae(actual: np.ndarray, predicted: np.ndarray, benchmark: np.ndarray = None, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """ Mean Relative Absolute Error """
-    return np.mean(np.abs(_relative_error(actual, predicted, benchmark)))
+    return _metric('mrae', actual, predicted, benchmark=benchmark, axis=axis, mask=mask, skipna=skipna)
 
 
-def mdrae(actual: np.ndarray, predicted: np.ndarray, benchmark: np.ndarray = None):
+def mdrae(actual: np.ndarray, predicted: np.ndarray, benchmark: np.ndarray = None, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """ Median Relative Absolute Error """
-    return np.median(np.abs(_relative_error(actual, predicted, benchmark)))
+    return _metric('mdrae', actual, predicted, benchmark=benchmark, axis=axis, mask=mask, skipna=skipna)
 
 
-def gmrae(actual: np.ndarray, predicted: np.ndarray, benchmark: np.ndarray = None):
+def gmrae(actual: np.ndarray, predicted: np.ndarray, benchmark: np.ndarray = None, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """ Geometric Mean Relative Absolute Error """
-    return _geometric_mean(np.abs(_relative_error(actual, predicted, benchmark)))
+    return _metric('gmrae', actual, predicted, benchmark=benchmark, axis=axis, mask=mask, skipna=skipna)
 
 
-def mbrae(actual: np.ndarray, predicted: np.ndarray, benchmark: np.ndarray = None):
+def mbrae(actual: np.ndarray, predicted: np.ndarray, benchmark: np.ndarray = None, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """ Mean Bounded Relative Absolute Error """
-    return np.mean(_bounded_relative_error(actual, predicted, benchmark))
+    return _metric('mbrae', actual, predicted, benchmark=benchmark, axis=axis, mask=mask, skipna=skipna)
 
 
-def umbrae(actual: np.ndarray, predicted: np.ndarray, benchmark: np.ndarray = None):
+def umbrae(actual: np.ndarray, predicted: np.ndarray, benchmark: np.ndarray = None, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """ Unscaled Mean Bounded Relative Absolute Error """
-    __mbrae = mbrae(actual, predicted, benchmark)
-    return __mbrae / (1 - __mbrae)
+    return _metric('umbrae', actual, predicted, benchmark=benchmark, axis=axis, mask=mask, skipna=skipna)
 
 
-def mda(actual: np.ndarray, predicted: np.ndarray):
+def mda(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
     """ Mean Directional Accuracy """
-    return np.mean((np.sign(actual[1:] - actual[:-1]) == np.sign(predicted[1:] - predicted[:-1])).astype(int))
+    return _metric('mda', actual, predicted, axis=axis, mask=mask, skipna=skipna)
+
+
+def nse(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
+    """ Nash-Sutcliffe Efficiency """
+    return _metric('nse', actual, predicted, axis=axis, mask=mask, skipna=skipna)
+
+
+def log_nse(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
+    """
+    Nash-Sutcliffe Efficiency of log(actual + c) and log(predicted + c)
+
+    Note: c is 1% of the mean of actual, so zero flows do not dominate
+    """
+    return _metric('log_nse', actual, predicted, axis=axis, mask=mask, skipna=skipna)
+
+
+def kge(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
+    """ Kling-Gupta Efficiency (Gupta et al., 2009) """
+    return _metric('kge', actual, predicted, axis=axis, mask=mask, skipna=skipna)
+
+
+def kge_r(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
+    """ KGE correlation component: Pearson correlation of actual and predicted """
+    return _metric('kge_r', actual, predicted, axis=axis, mask=mask, skipna=skipna)
+
+
+def kge_alpha(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
+    """ KGE variability component: std(predicted) / std(actual) """
+    return _metric('kge_alpha', actual, predicted, axis=axis, mask=mask, skipna=skipna)
+
+
+def kge_beta(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
+    """ KGE bias component: mean(predicted) / mean(actual) """
+    return _metric('kge_beta', actual, predicted, axis=axis, mask=mask, skipna=skipna)
+
+
+def kge_prime(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
+    """ Modified Kling-Gupta Efficiency KGE' (Kling et al., 2012), with the ratio of coefficients of variation """
+    return _metric('kge_prime', actual, predicted, axis=axis, mask=mask, skipna=skipna)
+
+
+def pbias(actual: np.ndarray, predicted: np.ndarray, axis: int = None, mask: np.ndarray = None, skipna: bool = False):
+    """
+    Percent Bias: 100 * sum(predicted - actual) / sum(actual)
+
+    Note: positive when predicted overestimates
+    """
+    return _metric('pbias', actual, predicted, axis=axis, mask=mask, skipna=skipna)
 
 
 METRICS = {
@@ -291,19 +343,658 @@ METRICS = {
     'mbrae': mbrae,
     'umbrae': umbrae,
     'mda': mda,
+    'nse': nse,
+    'log_nse': log_nse,
+    'kge': kge,
+    'kge_r': kge_r,
+    'kge_alpha': kge_alpha,
+    'kge_beta': kge_beta,
+    'kge_prime': kge_prime,
+    'pbias': pbias,
 }
 
 
-def evaluate(actual: np.ndarray, predicted: np.ndarray, metrics=('mae', 'mse', 'smape', 'umbrae')):
-    results = {}
+class _Intermediates:
+    """
+    Intermediate arrays shared by the metrics, each computed once on first use
+
+    The kernels in _KERNELS derive every metric from these instead of calling the
+    metric functions, so evaluating many metrics makes one pass per intermediate.
+
+    With axis=None every array is reduced to a scalar. Otherwise the time axis of
+    predicted is moved to the front and the metrics are reduced over it only, and a
+    1D actual (time,) is broadcast against predicted (time, members, ...), so the
+    terms that depend on actual alone (naive forecast, mean, range) are computed
+    once for all members.
+
+    With skipna, NaN in actual or predicted mark missing values, and mask (True for
+    the values to use, broadcast against predicted) marks more. Masked values are set
+    to NaN rather than dropped, so the arrays keep their time alignment: every
+    intermediate is NaN where any of its inputs is missing, and the reductions skip
+    NaN. The naive forecast and direction terms only use pairs of time steps that are
+    both valid, as they would be in the complete series.
+
+    INPUTS declares the intermediates each intermediate is computed from, so evaluate
+    can tell when an intermediate is no longer needed (see _release).
+    """
+
+    INPUTS = {
+        'error': (),
+        'abs_error': ('error',),
+        'squared_error': ('error',),
+        'percentage_error': ('error',),
+        'abs_percentage_error': ('percentage_error',),
+        'symmetric_percentage_error': ('abs_error',),
+        'naive_error': (),
+        'benchmark_error': ('error', 'naive_error'),
+        'relative_error': ('benchmark_error',),
+        'abs_relative_error': ('relative_error',),
+        'bounded_relative_error': ('benchmark_error',),
+        'directional_accuracy': (),
+        'mse': ('squared_error',),
+        'mae': ('abs_error',),
+        'mape': ('abs_percentage_error',),
+        'naive_mae': ('naive_error',),
+        'mbrae': ('bounded_relative_error',),
+        'paired_actual': ('error',),
+        'actual_mean': ('paired_actual',),
+        'actual_squared_deviation': ('paired_actual', 'actual_mean'),
+        'ndof': ('error',),
+        'paired_predicted': ('error',),
+        'predicted_mean': ('paired_predicted',),
+        'predicted_squared_deviation': ('paired_predicted', 'predicted_mean'),
+        'codeviation': ('paired_actual', 'paired_predicted', 'actual_mean', 'predicted_mean'),
+        'kge_r': ('codeviation', 'actual_squared_deviation', 'predicted_squared_deviation'),
+        'kge_alpha': ('actual_squared_deviation', 'predicted_squared_deviation'),
+        'kge_beta': ('actual_mean', 'predicted_mean'),
+        'log_offset': ('paired_actual',),
+        'log_actual': ('paired_actual', 'log_offset'),
+        'log_predicted': ('paired_predicted', 'log_offset'),
+        'log_actual_squared_deviation': ('log_actual',),
+    }
+
+    def __init__(self, actual: np.ndarray, predicted: np.ndarray, seasonality: int = 1, benchmark: np.ndarray = None, axis: int = None,
+                 mask: np.ndarray = None, skipna: bool = False):
+        if isinstance(benchmark, int):
+            # _relative_error convention: an int benchmark is the seasonality of the naive forecast
+            seasonality,benchmark = benchmark,None
+        if axis is not None:
+            if mask is not None:
+                mask = _align(mask, predicted, None, axis)[0]
+            actual,predicted,benchmark = _align(actual, predicted, benchmark, axis)
+        if mask is not None:
+            # one masked copy of actual (per member if the mask is), which every intermediate inherits
+            actual = np.where(mask, actual, np.nan)
+            skipna = True
+        self.actual = actual
+        self.predicted = predicted
+        self.seasonality = seasonality
+        self.benchmark = benchmark
+        self.axis = None if axis is None else 0
+        self.skipna = skipna
+
+    # reductions, so the kernels do not depend on how the arrays are reduced
+    def mean(self, x):
+        return (np.nanmean if self.skipna else np.mean)(x, axis=self.axis)
+
+    def median(self, x):
+        return (np.nanmedian if self.skipna else np.median)(x, axis=self.axis)
+
+    def sum(self, x):
+        return (np.nansum if self.skipna else np.sum)(x, axis=self.axis)
+
+    def max(self, x):
+        return (np.nanmax if self.skipna else np.max)(x, axis=self.axis)
+
+    def min(self, x):
+        return (np.nanmin if self.skipna else np.min)(x, axis=self.axis)
+
+    @cached_property
+    def error(self):
+        return _error(self.actual, self.predicted)
+
+    @cached_property
+    def abs_error(self):
+        return np.abs(self.error)
+
+    @cached_property
+    def squared_error(self):
+        return np.square(self.error)
+
+    @cached_property
+    def percentage_error(self):
+        return self.error / (self.actual + EPSILON)
+
+    @cached_property
+    def abs_percentage_error(self):
+        return np.abs(self.percentage_error)
+
+    @cached_property
+    def symmetric_percentage_error(self):
+        return 2.0 * self.abs_error / ((np.abs(self.actual) + np.abs(self.predicted)) + EPSILON)
+
+    @cached_property
+    def naive_error(self):
+        """ error of the naive forecast, from actual[seasonality:] """
+        return _error(self.actual[self.seasonality:], _naive_forecasting(self.actual, self.seasonality))
+
+    @cached_property
+    def benchmark_error(self):
+        """ error and benchmark error for the relative errors (naive forecast unless a benchmark is given) """
+        if self.benchmark is None:
+            return self.error[self.seasonality:], self.naive_error
+        return self.error, _error(self.actual, self.benchmark)
+
+    @cached_property
+    def relative_error(self):
+        error,benchmark_error = self.benchmark_error
+        return error / (benchmark_error + EPSILON)
+
+    @cached_property
+    def abs_relative_error(self):
+        return np.abs(self.relative_error)
+
+    @cached_property
+    def bounded_relative_error(self):
+        error,benchmark_error = self.benchmark_error
+        abs_err = np.abs(error)
+        return abs_err / (abs_err + np.abs(benchmark_error) + EPSILON)
+
+    @cached_property
+    def directional_accuracy(self):
+        actual,predicted = np.diff(self.actual, axis=0),np.diff(self.predicted, axis=0)
+        accuracy = (np.sign(actual) == np.sign(predicted)).astype(int)
+        if self.skipna:
+            accuracy = np.where(np.isnan(actual) | np.isnan(predicted), np.nan, accuracy)
+        return accuracy
+
+    @cached_property
+    def mse(self):
+        return self.mean(self.squared_error)
+
+    @cached_property
+    def mae(self):
+        return self.mean(self.abs_error)
+
+    @cached_property
+    def mape(self):
+        return self.mean(self.abs_percentage_error)
+
+    @cached_property
+    def naive_mae(self):
+        return self.mean(np.abs(self.naive_error))
+
+    @cached_property
+    def mbrae(self):
+        return self.mean(self.bounded_relative_error)
+
+    @cached_property
+    def paired_actual(self):
+        """ actual where predicted is also valid, for the terms of actual alone (mean, range) """
+        if not self.skipna:
+            return self.actual
+        return np.where(np.isnan(self.error), np.nan, self.actual)
+
+    @cached_property
+    def actual_mean(self):
+        return self.mean(self.paired_actual)
+
+    def codeviate(self, x, y, xmean, ymean):
+        """ sum of the products of the deviations of x and y from their means """
+        return self.sum((x - xmean) * (y - ymean))
+
+    @cached_property
+    def actual_squared_deviation(self):
+        """ sum of squared deviations of actual from its mean """
+        return self.codeviate(self.paired_actual, self.paired_actual, self.actual_mean, self.actual_mean)
+
+    @cached_property
+    def ndof(self):
+        """ len(actual) - 1, the degrees of freedom of std_ae and std_ape """
+        if self.skipna:
+            return np.sum(~np.isnan(self.error), axis=self.axis) - 1
+        return len(self.actual) - 1
+
+    # moments of predicted and the KGE components, shared by nse, kge, kge_prime and pbias
+    @cached_property
+    def paired_predicted(self):
+        """ predicted where actual is also valid """
+        if not self.skipna:
+            return self.predicted
+        return np.where(np.isnan(self.error), np.nan, self.predicted)
+
+    @cached_property
+    def predicted_mean(self):
+        return self.mean(self.paired_predicted)
+
+    @cached_property
+    def predicted_squared_deviation(self):
+        return self.codeviate(self.paired_predicted, self.paired_predicted, self.predicted_mean, self.predicted_mean)
+
+    @cached_property
+    def codeviation(self):
+        """ sum of the products of the deviations of actual and predicted from their means """
+        return self.codeviate(self.paired_actual, self.paired_predicted, self.actual_mean, self.predicted_mean)
+
+    @cached_property
+    def kge_r(self):
+        return self.codeviation / np.sqrt(self.actual_squared_deviation * self.predicted_squared_deviation)
+
+    @cached_property
+    def kge_alpha(self):
+        return np.sqrt(self.predicted_squared_deviation / self.actual_squared_deviation)
+
+    @cached_property
+    def kge_beta(self):
+        return self.predicted_mean / self.actual_mean
+
+    @cached_property
+    def log_offset(self):
+        """ 1% of the mean of actual over the whole series, added before taking logs """
+        return np.nanmean(self.paired_actual, axis=self.axis) / 100
+
+    @cached_property
+    def log_actual(self):
+        return np.log(self.paired_actual + self.log_offset)
+
+    @cached_property
+    def log_predicted(self):
+        return np.log(self.paired_predicted + self.log_offset)
+
+    @cached_property
+    def log_actual_squared_deviation(self):
+        log_actual_mean = self.mean(self.log_actual)
+        return self.codeviate(self.log_actual, self.log_actual, log_actual_mean, log_actual_mean)
+
+
+def _align(actual, predicted, benchmark, axis):
+    # move the time axis to the front, and give a 1D actual (or benchmark) trailing axes to broadcast against the members
+    predicted = np.moveaxis(np.asarray(predicted), axis, 0)
+    aligned = []
+    for a in (actual, benchmark):
+        if a is not None:
+            a = np.asarray(a)
+            if a.ndim == predicted.ndim:
+                a = np.moveaxis(a, axis, 0)
+            else:
+                a = a.reshape(a.shape + (1,) * (predicted.ndim - a.ndim))
+        aligned.append(a)
+    return aligned[0],predicted,aligned[1]
+
+
+def _metric(name, actual, predicted, **options):
+    return _KERNELS[name](_Intermediates(actual, predicted, **options))
+
+
+def register(name: str, kernel, inputs=(), function=None):
+    """
+    Add a metric to METRICS and to evaluate
+
+    kernel(s) computes the metric from an _Intermediates s, using only the intermediates
+    named in inputs (attributes of s, see _Intermediates.INPUTS), e.g.
+    register('rmse', lambda s: np.sqrt(s.mse), inputs=('mse',)). evaluate then shares
+    them with the other metrics. function is the metric function added to METRICS
+    (default: the kernel applied to the intermediates of its arguments).
+    """
+    unknown = [x for x in inputs if x not in _Intermediates.INPUTS]
+    if unknown:
+        raise ValueError(f'unknown intermediates {unknown}, see _Intermediates.INPUTS')
+    _KERNELS[name] = kernel
+    _INPUTS[name] = tuple(inputs)
+    METRICS[name] = function if function is not None else partial(_metric, name)
+
+
+def _release(metrics):
+    """
+    intermediates to drop after each metric: {i: names} for those last used by metrics[i]
+
+    The dependency graph of the metrics (_INPUTS) and intermediates
+    (_Intermediates.INPUTS) tells which intermediates each metric needs directly or
+    through other intermediates.
+    """
+    last = {}
+    for i,name in enumerate(metrics):
+        stack = list(_INPUTS.get(name, ()))
+        seen = set()
+        while stack:
+            x = stack.pop()
+            if x not in seen:
+                seen.add(x)
+                last[x] = i
+                stack.extend(_Intermediates.INPUTS.get(x, ()))
+    release = {}
+    for x,i in last.items():
+        release.setdefault(i, []).append(x)
+    return release
+
+
+# each metric in terms of the shared intermediates
+_KERNELS = {
+    'mse': lambda s: s.mse,
+    'rmse': lambda s: np.sqrt(s.mse),
+    'nrmse': lambda s: np.sqrt(s.mse) / (s.max(s.paired_actual) - s.min(s.paired_actual)),
+    'me': lambda s: s.mean(s.error),
+    'mae': lambda s: s.mae,
+    'mad': lambda s: s.mae,
+    'gmae': lambda s: np.exp(s.mean(np.log(s.abs_error))),
+    'mdae': lambda s: s.median(s.abs_error),
+    'mpe': lambda s: s.mean(s.percentage_error),
+    'mape': lambda s: s.mape,
+    'mdape': lambda s: s.median(s.abs_percentage_error),
+    'smape': lambda s: s.mean(s.symmetric_percentage_error),
+    'smdape': lambda s: s.median(s.symmetric_percentage_error),
+    'maape': lambda s: s.mean(np.arctan(s.abs_percentage_error)),
+    'mase': lambda s: s.mae / s.naive_mae,
+    'std_ae': lambda s: np.sqrt(s.sum(np.square(s.error - s.mae)) / s.ndof),
+    'std_ape': lambda s: np.sqrt(s.sum(np.square(s.percentage_error - s.mape)) / s.ndof),
+    'rmspe': lambda s: np.sqrt(s.mean(np.square(s.percentage_error))),
+    'rmdspe': lambda s: np.sqrt(s.median(np.square(s.percentage_error))),
+    'rmsse': lambda s: np.sqrt(s.mse) / s.naive_mae,
+    'inrse': lambda s: np.sqrt(s.sum(s.squared_error) / s.actual_squared_deviation),
+    'rrse': lambda s: np.sqrt(s.sum(s.squared_error) / s.actual_squared_deviation),
+    'mre': lambda s: s.mean(s.relative_error),
+    'rae': lambda s: s.sum(s.abs_error) / (s.sum(np.abs(s.paired_actual - s.actual_mean)) + EPSILON),
+    'mrae': lambda s: s.mean(s.abs_relative_error),
+    'mdrae': lambda s: s.median(s.abs_relative_error),
+    'gmrae': lambda s: np.exp(s.mean(np.log(s.abs_relative_error))),
+    'mbrae': lambda s: s.mbrae,
+    'umbrae': lambda s: s.mbrae / (1 - s.mbrae),
+    'mda': lambda s: s.mean(s.directional_accuracy),
+    'nse': lambda s: 1 - s.sum(s.squared_error) / s.actual_squared_deviation,
+    'log_nse': lambda s: 1 - s.sum(np.square(s.log_actual - s.log_predicted)) / s.log_actual_squared_deviation,
+    'kge': lambda s: 1 - np.sqrt(np.square(s.kge_r - 1) + np.square(s.kge_alpha - 1) + np.square(s.kge_beta - 1)),
+    'kge_r': lambda s: s.kge_r,
+    'kge_alpha': lambda s: s.kge_alpha,
+    'kge_beta': lambda s: s.kge_beta,
+    # the ratio of coefficients of variation is alpha / beta
+    'kge_prime': lambda s: 1 - np.sqrt(np.square(s.kge_r - 1) + np.square(s.kge_alpha / s.kge_beta - 1) + np.square(s.kge_beta - 1)),
+    'pbias': lambda s: -100 * s.sum(s.error) / s.sum(s.paired_actual),
+}
+
+# the intermediates each kernel uses
+_INPUTS = {
+    'mse': ('mse',),
+    'rmse': ('mse',),
+    'nrmse': ('mse', 'paired_actual'),
+    'me': ('error',),
+    'mae': ('mae',),
+    'mad': ('mae',),
+    'gmae': ('abs_error',),
+    'mdae': ('abs_error',),
+    'mpe': ('percentage_error',),
+    'mape': ('mape',),
+    'mdape': ('abs_percentage_error',),
+    'smape': ('symmetric_percentage_error',),
+    'smdape': ('symmetric_percentage_error',),
+    'maape': ('abs_percentage_error',),
+    'mase': ('mae', 'naive_mae'),
+    'std_ae': ('error', 'mae', 'ndof'),
+    'std_ape': ('percentage_error', 'mape', 'ndof'),
+    'rmspe': ('percentage_error',),
+    'rmdspe': ('percentage_error',),
+    'rmsse': ('mse', 'naive_mae'),
+    'inrse': ('squared_error', 'actual_squared_deviation'),
+    'rrse': ('squared_error', 'actual_squared_deviation'),
+    'mre': ('relative_error',),
+    'rae': ('abs_error', 'paired_actual', 'actual_mean'),
+    'mrae': ('abs_relative_error',),
+    'mdrae': ('abs_relative_error',),
+    'gmrae': ('abs_relative_error',),
+    'mbrae': ('mbrae',),
+    'umbrae': ('mbrae',),
+    'mda': ('directional_accuracy',),
+    'nse': ('squared_error', 'actual_squared_deviation'),
+    'log_nse': ('log_actual', 'log_predicted', 'log_actual_squared_deviation'),
+    'kge': ('kge_r', 'kge_alpha', 'kge_beta'),
+    'kge_r': ('kge_r',),
+    'kge_alpha': ('kge_alpha',),
+    'kge_beta': ('kge_beta',),
+    'kge_prime': ('kge_r', 'kge_alpha', 'kge_beta'),
+    'pbias': ('error', 'paired_actual'),
+}
+
+
+def evaluate(actual: np.ndarray, predicted: np.ndarray, metrics=('mae', 'mse', 'smape', 'umbrae'), axis: int = None, asframe: bool = False,
+             mask: np.ndarray = None, skipna: bool = False, bootstrap: int = None, block_length: int = 1, ci: float = 0.95, seed: int = None,
+             cache: dict = None):
+    """
+    Evaluate several metrics at once
+
+    The intermediates shared by the metrics (error, absolute error, percentage error,
+    naive forecast error, ...) are computed once for all metrics, and each is dropped
+    after the last metric that needs it (see register and _release). Metrics added to
+    METRICS without a kernel in _KERNELS are computed with their own function.
+
+    cache is a dict in which the intermediates are kept for later calls on the same
+    arrays (the same objects, not modified in between) with the same axis, mask and
+    skipna, e.g. to add metrics without computing the errors again. The dict holds on
+    to the arrays and their intermediates until it is cleared.
+
+    With axis set, the metrics are computed along that (time) axis of predicted for
+    all other (member) axes at once, e.g. actual (time,) and predicted (time, members)
+    with axis=0 gives one value per member. asframe returns a DataFrame with one row
+    per member and one column per metric instead of a dict.
+
+    skipna ignores NaN in actual and predicted, and mask (True for the values to use,
+    same shape as predicted or broadcastable to it) ignores more, without copying the
+    valid values out; see _Intermediates.
+
+    bootstrap=B adds percentile confidence intervals (ci, default 95%) of each metric
+    from B moving-block bootstrap replicates of the time steps, as name_low and
+    name_high. Blocks of block_length consecutive steps (1: the ordinary bootstrap)
+    keep the autocorrelation of the series; the naive forecast and mda pair steps
+    across the joins of the blocks, so block_length should be well above seasonality.
+    The time steps are resampled together for actual, predicted and all members. The
+    block starts of all replicates are drawn once (seed), and the replicates are
+    evaluated as members of batches of about BOOTSTRAPSIZE values.
+    """
+    errors = {}
+    store = None
+    if cache is not None:
+        store = cache.setdefault((id(actual), id(predicted), id(mask), axis, skipna), {'arrays': (actual, predicted, mask)})
+    if axis is None and bootstrap is None:
+        results = _evaluate(actual, predicted, metrics, None, errors, mask, skipna, store=store)
+    else:
+        if axis is None:
+            if np.ndim(predicted) != 1:
+                raise ValueError('bootstrap needs a 1D series or a time axis')
+            axis = 0
+        # (time, members) views, the members of all other axes flattened
+        if mask is not None:
+            mask = _align(mask, predicted, None, axis)[0]
+            mask = mask.reshape(len(mask), -1)
+        actual,predicted,_ = _align(actual, predicted, None, axis)
+        shape = predicted.shape[1:]
+        predicted = predicted.reshape(len(predicted), -1)
+        actual = actual.reshape(len(actual), -1)
+        results = _evaluate_blocks(actual, predicted, metrics, errors, mask, skipna, store=store)
+        if bootstrap is not None:
+            results.update(_bootstrap(actual, predicted, metrics, errors, mask, skipna, bootstrap, block_length, ci, seed))
+        results = {name: value.reshape(shape)[()] for name,value in results.items()}
+
+    for name,err in errors.items():
+        print('Unable to compute metric {0}: {1}'.format(name, err))
+    if asframe:
+        return _asframe(results)
+    return results
+
+
+def _evaluate_blocks(actual, predicted, metrics, errors, mask=None, skipna=False, store=None):
+    # actual, predicted and mask are (time, members) or (time, 1). evaluate the members in blocks small
+    # enough for the intermediates to stay in cache
+    nblock = max(1, BLOCKSIZE // max(len(predicted), 1))
+    release = _release(metrics) if store is None else {}
+    blocks = []
+    for i in range(0, predicted.shape[1], nblock):
+        block = predicted[:, i:i + nblock]
+        blockmask = mask if mask is None or mask.shape[1] == 1 else mask[:, i:i + nblock]
+        results = _evaluate(actual if actual.shape[1] == 1 else actual[:, i:i + nblock], block, metrics, 0, errors, blockmask, skipna,
+                            release, store, i)
+        blocks.append({name: np.broadcast_to(value, block.shape[1:]) for name,value in results.items()})
+    return {name: np.concatenate([block[name] for block in blocks]) for name in metrics}
+
+
+def _bootstrap(actual, predicted, metrics, errors, mask, skipna, nreplicates, block_length, ci, seed):
+    # percentile intervals of the metrics of (time, members) arrays over moving-block bootstrap replicates
+    ntime,nmembers = predicted.shape
+    block_length = min(max(1, block_length), ntime)
+    nblocks = -(-ntime // block_length)
+    rng = np.random.default_rng(seed)
+    starts = rng.integers(0, ntime - block_length + 1, size=(nblocks, nreplicates), dtype=np.int32 if ntime < 2**31 else np.int64)
+    offsets = np.arange(block_length)[None, :, None]
+
+    # each replicate is a set of members of one batch: (time, replicates, members) flattened to (time, replicates * members)
+    nbatch = max(1, BOOTSTRAPSIZE // max(ntime * nmembers, 1))
+    replicates = {name: [] for name in metrics}
+    for i in range(0, nreplicates, nbatch):
+        index = (starts[:, None, i:i + nbatch] + offsets).reshape(nblocks * block_length, -1)[:ntime]
+        shape = (ntime, index.shape[1], nmembers)
+        sample = [None if a is None else np.broadcast_to(a[index], shape).reshape(ntime, -1) for a in (actual, predicted, mask)]
+        results = _evaluate_blocks(sample[0], sample[1], metrics, errors, sample[2], skipna)
+        for name in metrics:
+            replicates[name].append(results[name].reshape(-1, nmembers))
+
+    alpha = (1 - ci) / 2
+    intervals = {}
     for name in metrics:
+        low,high = np.nanquantile(np.concatenate(replicates[name]), [alpha, 1 - alpha], axis=0)
+        intervals[name + '_low'] = low
+        intervals[name + '_high'] = high
+    return intervals
+
+
+def _evaluate(actual, predicted, metrics, axis, errors, mask=None, skipna=False, release=None, store=None, block=None):
+    # intermediates from the cache, or new ones that are dropped after their last use
+    intermediates = None if store is None else store.get(block)
+    if intermediates is None:
+        intermediates = _Intermediates(actual, predicted, axis=axis, mask=mask, skipna=skipna)
+        if store is not None:
+            store[block] = intermediates
+    if store is not None:
+        release = {}
+    elif release is None:
+        release = _release(metrics)
+    # metrics without a kernel only get the options that were asked for
+    options = {key: value for key,value in (('axis', axis), ('mask', mask), ('skipna', skipna)) if value is not None and value is not False}
+    results = {}
+    for i,name in enumerate(metrics):
         try:
-            results[name] = METRICS[name](actual, predicted)
+            if name in _KERNELS:
+                results[name] = _KERNELS[name](intermediates)
+            else:
+                results[name] = METRICS[name](actual, predicted, **options)
         except Exception as err:
             results[name] = np.nan
-            print('Unable to compute metric {0}: {1}'.format(name, err))
+            errors[name] = err
+        for x in release.get(i, ()):
+            intermediates.__dict__.pop(x, None)
+    return results
+
+
+def evaluate_all(actual: np.ndarray, predicted: np.ndarray, axis: int = None, asframe: bool = False,
+                 mask: np.ndarray = None, skipna: bool = False):
+    return evaluate(actual, predicted, metrics=list(METRICS), axis=axis, asframe=asframe, mask=mask, skipna=skipna)
+
+
+def evaluate_many(actual: np.ndarray, predicted: np.ndarray, metrics=None, nworkers: int = None, nblock: int = None, asframe: bool = True,
+                  mask: np.ndarray = None, skipna: bool = False):
+    """
+    Evaluate metrics for many series (stations, ensemble members) in a process pool
+
+    actual is (time,) or (time, series) and predicted is (time, series). Both are
+    copied once into shared memory, and each worker evaluates blocks of nblock series
+    with evaluate(..., axis=0) on views of it, so no array is pickled. The results are
+    gathered into one DataFrame (one row per series) or dict of arrays.
+
+    nworkers=1 evaluates serially in this process. metrics defaults to all of METRICS.
+    mask ((time,) or (time, series)) and skipna are as in evaluate; the mask is shared too.
+    """
+    import os
+    from concurrent.futures import ProcessPoolExecutor
+    from multiprocessing import shared_memory
+
+    metrics = list(METRICS) if metrics is None else list(metrics)
+    actual = np.asarray(actual, dtype=np.float64)
+    predicted = np.asarray(predicted, dtype=np.float64)
+    nseries = predicted.shape[1]
+    nworkers = os.cpu_count() if nworkers is None else nworkers
+    if nworkers == 1:
+        return evaluate(actual, predicted, metrics, axis=0, asframe=asframe, mask=mask, skipna=skipna)
+    nblock = max(1, -(-nseries // (4 * nworkers))) if nblock is None else nblock
+
+    blocks = []
+    arrays = {}
+    try:
+        shared = [('actual', actual), ('predicted', predicted)]
+        if mask is not None:
+            shared.append(('mask', np.asarray(mask, dtype=bool)))
+        for name,a in shared:
+            blocks.append(shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1)))
+            np.ndarray(a.shape, dtype=a.dtype, buffer=blocks[-1].buf)[...] = a
+            arrays[name] = (blocks[-1].name, a.shape, a.dtype.str)
+        with ProcessPoolExecutor(max_workers=nworkers, initializer=_attach, initargs=(arrays,)) as pool:
+            starts = range(0, nseries, nblock)
+            parts = list(pool.map(_evaluate_block, starts, [nblock] * len(starts), [metrics] * len(starts), [skipna] * len(starts)))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    results = {name: np.concatenate([part[name] for part in parts]) for name in metrics}
+    if asframe:
+        return _asframe(results)
+    return results
+
+
+# shared arrays of evaluate_many, attached once in each worker
+_SHARED = {}
+
+
+def _attach(arrays):
+    # the workers share the parent's resource tracker, and the parent unlinks the blocks
+    from multiprocessing import shared_memory
+    for name,(shmname,shape,dtype) in arrays.items():
+        block = shared_memory.SharedMemory(name=shmname)
+        _SHARED[name] = (block, np.ndarray(shape, dtype=dtype, buffer=block.buf))
+
+
+def _evaluate_block(start, nblock, metrics, skipna=False):
+    actual,predicted = _SHARED['actual'][1],_SHARED['predicted'][1]
+    mask = _SHARED['mask'][1] if 'mask' in _SHARED else None
+    if actual.ndim > 1:
+        actual = actual[:, start:start + nblock]
+    if mask is not None and mask.ndim > 1:
+        mask = mask[:, start:start + nblock]
+    predicted = predicted[:, start:start + nblock]
+    results = evaluate(actual, predicted, metrics, axis=0, mask=mask, skipna=skipna)
+    return {name: np.broadcast_to(value, predicted.shape[1:]).copy() for name,value in results.items()}
+
+
+def benchmark_many(ntime: int = 3650, nseries=(1000, 10000, 50000), nworkers: int = None, seed: int = 0):
+    """
+    Time evaluate_many against the serial evaluate(..., axis=0) on random series
+
+    Returns a list of dicts with ntime, nseries, nworkers, serial and parallel (seconds).
+    """
+    import os
+    import time
+    nworkers = os.cpu_count() if nworkers is None else nworkers
+    rng = np.random.default_rng(seed)
+    results = []
+    for n in nseries:
+        actual = rng.gamma(2.0, size=ntime) + 0.1
+        predicted = actual[:, None] * (1 + 0.3 * rng.standard_normal((ntime, n)))
+        t0 = time.perf_counter()
+        evaluate_many(actual, predicted, nworkers=1, asframe=False)
+        t1 = time.perf_counter()
+        evaluate_many(actual, predicted, nworkers=nworkers, asframe=False)
+        t2 = time.perf_counter()
+        results.append(dict(ntime=ntime, nseries=n, nworkers=nworkers, serial=t1 - t0, parallel=t2 - t1))
     return results
 
 
-def evaluate_all(actual: np.ndarray, predicted: np.ndarray):
-    return evaluate(actual, predicted, metrics=set(METRICS.keys()))
\ No newline at end of file
+def _asframe(results):
+    # one row per member (all non-time axes flattened), one column per metric
+    import pandas as pd
+    shape = np.broadcast_shapes(*(np.shape(value) for value in results.values()))
+    return pd.DataFrame({name: np.broadcast_to(value, shape).reshape(-1) for name,value in results.items()})
@@ -0,0 +1,186 @@
+"""
+gofgrouped.py
+Desc: gof metrics per group (station, month, water year, ...) by segment reductions
+
+evaluate_grouped(actual, predicted, groups) computes the metrics of every group of time steps at once, instead of a pandas groupby calling gof.evaluate per group. The time steps are sorted by group once (stably, so each group keeps its time order), then every sum, mean, maximum and minimum is a np.add/np.maximum/np.minimum.reduceat over the contiguous segments, and the medians are read from one sort of the values within the segments. The cost is one pass (or one sort, for the medians) over the data whatever the number of groups.
+
+The metrics use the kernels of gof.evaluate with segment reductions, so every metric in gof._KERNELS is supported, with mask and skipna as in gof.evaluate. Terms that pair a time step with an earlier one (the naive forecast of mase, rmsse, mre, mrae, gmrae, mdrae, mbrae, umbrae, and mda) only use pairs within a group: with groups that are not contiguous in time (e.g. month of all years) the pairs are taken between consecutive time steps of the group as given, so mind the seasonality.
+
+log_nse adds the offset of gof.log_nse (1% of the mean of actual) per group, so it equals gof.log_nse on the group alone.
+
+Example
+-------
+frame = evaluate_grouped(observed, simulated, {'month': month, 'wateryear': wateryear}, metrics=('rmse', 'me', 'mae'))
+"""
+
+from functools import cached_property
+
+import numpy as np
+
+from pyfunclib.libdata import gof
+
+
+def evaluate_grouped(actual: np.ndarray, predicted: np.ndarray, groups, metrics=('mae', 'mse', 'smape', 'umbrae'), axis: int = 0,
+                     seasonality: int = 1, mask: np.ndarray = None, skipna: bool = False):
+    """
+    Evaluate metrics for every group of time steps
+
+    groups is one array of group labels per time step, or a dict of such arrays (e.g.
+    station, month and water year) whose combinations form the groups. predicted may be
+    (time, members) with the time axis `axis`, as in gof.evaluate. metrics=None
+    computes every metric of gof.METRICS.
+
+    Returns a tidy DataFrame with one row per group (and member): the group labels
+    (column 'group' for a single array), 'member' for ensembles, and one column per
+    metric. Groups are in sorted order of their labels.
+    """
+    import pandas as pd
+
+    metrics = list(gof.METRICS) if metrics is None else list(metrics)
+    unknown = [name for name in metrics if name not in gof._KERNELS]
+    if unknown:
+        raise ValueError(f'metrics without a grouped kernel: {unknown}')
+    keys = dict(groups) if isinstance(groups, dict) else {'group': groups}
+    ntime = np.shape(predicted)[axis]
+    for name,key in keys.items():
+        if len(key) != ntime:
+            raise ValueError(f'groups {name} has {len(key)} labels for {ntime} time steps')
+
+    # one code per combination of labels, then the time steps sorted by code
+    labels,codes = [],[]
+    for key in keys.values():
+        label,code = np.unique(np.asarray(key), return_inverse=True)
+        labels.append(label)
+        codes.append(code.reshape(-1))
+    if len(codes) == 1:
+        unique,segments = np.arange(len(labels[0])),codes[0]
+    else:
+        unique,segments = np.unique(np.ravel_multi_index(codes, [len(label) for label in labels]), return_inverse=True)
+        segments = segments.reshape(-1)
+    order = np.argsort(segments, kind='stable')
+
+    intermediates = _GroupedIntermediates(actual, predicted, segments[order], order, len(unique), seasonality=seasonality,
+                                          axis=axis, mask=mask, skipna=skipna)
+    members = intermediates.predicted.shape[1:]
+    release = gof._release(metrics)
+    results = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for i,name in enumerate(metrics):
+            try:
+                results[name] = np.broadcast_to(_OVERRIDES.get(name, gof._KERNELS[name])(intermediates), (len(unique),) + members).reshape(-1)
+            except Exception as err:
+                print('Unable to compute metric {0}: {1}'.format(name, err))
+                results[name] = np.full(len(unique) * int(np.prod(members)), np.nan)
+            for x in release.get(i, ()):
+                intermediates.__dict__.pop(x, None)
+
+    nmembers = int(np.prod(members))
+    frame = {name: np.repeat(label[code], nmembers)
+             for name,label,code in zip(keys, labels, np.unravel_index(unique, [len(label) for label in labels]))}
+    if members:
+        frame['member'] = np.tile(np.arange(nmembers), len(unique))
+    frame.update(results)
+    return pd.DataFrame(frame)
+
+
+class _GroupedIntermediates(gof._Intermediates):
+
+    """
+    gof._Intermediates of time steps sorted by group, with reductions over each group
+
+    segments is the (sorted) group of each time step. Every reduction returns one value
+    per group. A term that starts k steps late (k = seasonality for the naive forecast,
+    1 for the directions) pairs time step t with t - k, and only pairs within a group
+    are included.
+    """
+
+    def __init__(self, actual, predicted, segments, order, ngroups, axis=0, mask=None, **options):
+        if mask is not None:
+            mask = gof._align(mask, predicted, None, axis)[0][order]
+        actual,predicted,_ = gof._align(actual, predicted, None, axis)
+        super().__init__(actual[order], predicted[order], axis=0, mask=mask, **options)
+        self.segments = segments
+        self.ngroups = ngroups
+        self.starts = np.searchsorted(segments, np.arange(ngroups))
+
+    def _included(self, x):
+        # x padded at the front to one row per time step, and which rows are included in the reductions
+        k = len(self.segments) - len(x)
+        included = np.ones(len(self.segments), dtype=bool)
+        if k > 0:
+            x = np.concatenate((np.zeros((k,) + np.shape(x)[1:]), x))
+            included[:k] = False
+            included[k:] = self.segments[k:] == self.segments[:-k]
+        included = included.reshape((-1,) + (1,) * (np.ndim(x) - 1))
+        if self.skipna:
+            included = included & ~np.isnan(x)
+        return np.asarray(x, dtype=np.float64),included
+
+    def _reduceat(self, ufunc, x):
+        if len(x) == 0:
+            return np.zeros((self.ngroups,) + x.shape[1:])
+        return ufunc.reduceat(x, self.starts, axis=0)
+
+    def count(self, x):
+        """ number of values in each group (of valid values with skipna) """
+        x,included = self._included(x)
+        return self._reduceat(np.add, np.broadcast_to(included, x.shape).astype(np.float64))
+
+    def sum(self, x):
+        x,included = self._included(x)
+        return self._reduceat(np.add, np.where(included, x, 0.0))
+
+    def mean(self, x):
+        return self.sum(x) / self.count(x)
+
+    def max(self, x):
+        x,included = self._included(x)
+        count = self._reduceat(np.add, np.broadcast_to(included, x.shape).astype(np.float64))
+        return np.where(count > 0, self._reduceat(np.maximum, np.where(included, x, -np.inf)), np.nan)
+
+    def min(self, x):
+        x,included = self._included(x)
+        count = self._reduceat(np.add, np.broadcast_to(included, x.shape).astype(np.float64))
+        return np.where(count > 0, self._reduceat(np.minimum, np.where(included, x, np.inf)), np.nan)
+
+    def median(self, x):
+        x,included = self._included(x)
+        shape = x.shape[1:]
+        # without skipna, a NaN in a group makes its median NaN, as in np.median
+        missing = self._reduceat(np.add, (np.isnan(x) & included).astype(np.float64)) > 0
+        x = np.where(included, x, np.nan).reshape(len(x), -1)
+        # sort the values, then stably by group: each group in ascending order, with the excluded (NaN) values last
+        order = np.argsort(x, axis=0)
+        order = np.take_along_axis(order, np.argsort(self.segments[order], axis=0, kind='stable'), axis=0)
+        x = np.take_along_axis(x, order, axis=0)
+        count = self._reduceat(np.add, (~np.isnan(x)).astype(np.int64))
+        lower = self.starts[:, None] + np.maximum(count - 1, 0) // 2
+        upper = self.starts[:, None] + count // 2
+        columns = np.arange(x.shape[1])
+        median = np.where(count > 0, (x[lower, columns] + x[upper, columns]) / 2, np.nan)
+        median = np.where(missing.reshape(median.shape), np.nan, median)
+        return median.reshape((self.ngroups,) + shape)
+
+    def expand(self, values):
+        """ per-group values repeated for each time step of the group """
+        return values[self.segments]
+
+    def codeviate(self, x, y, xmean, ymean):
+        return self.sum((x - self.expand(xmean)) * (y - self.expand(ymean)))
+
+    @cached_property
+    def ndof(self):
+        return self.count(self.error) - 1
+
+    @cached_property
+    def log_offset(self):
+        """ 1% of the mean of actual in each group """
+        return self.expand(self.actual_mean) / 100
+
+
+# kernels that reduce deviations from a per-group center, in place of those of gof._KERNELS
+_OVERRIDES = dict(
+    std_ae=lambda s: np.sqrt(s.sum(np.square(s.error - s.expand(s.mae))) / s.ndof),
+    std_ape=lambda s: np.sqrt(s.sum(np.square(s.percentage_error - s.expand(s.mape))) / s.ndof),
+    rae=lambda s: s.sum(s.abs_error) / (s.sum(np.abs(s.paired_actual - s.expand(s.actual_mean))) + gof.EPSILON),
+)
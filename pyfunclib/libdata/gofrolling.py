@@ -0,0 +1,210 @@
+"""
+gofrolling.py
+Desc: rolling (moving window) gof metrics, for tracking model drift
+
+rolling(actual, predicted, window) returns, for each time step t, the metrics of the window of `window` time steps ending at t, e.g. 365-day RMSE, bias and MAE. The first window-1 steps are NaN. predicted may be time x members, with actual (time,) or time x members, as in gof.evaluate(..., axis=0).
+
+The metrics use the kernels of gof.evaluate with rolling reductions, so every metric in gof._KERNELS is supported and its definition is not repeated here. Sums and means are differences of cumulative sums along time, O(n) whatever the window. Maxima and minima (nrmse) are built by doubling, O(n log(window)). Medians (mdae, mdape, smdape, rmdspe, mdrae) and the mean absolute deviation of rae have no running form: they are computed on sliding window views in blocks of windows, O(n window) but without Python loops over the time steps.
+
+Terms that pair a time step with an earlier one (the naive forecast of mase, rmsse, mre, mrae, gmrae, mdrae, mbrae, umbrae, and mda) only use the pairs inside the window, i.e. window-seasonality naive errors and window-1 directions.
+
+Cumulative sums lose precision over long series in proportion to the total of the summed values, so a window sum of a small term after a large one is less accurate than np.sum on the window (about n * eps relative to the largest values, e.g. 1e-11 for 1e5 steps).
+
+log_nse adds the offset of gof.log_nse (1% of the mean of actual) per window, so its logs differ between windows and are taken on sliding window views, O(n window) like the medians.
+
+Example
+-------
+results = rolling(observed, simulated, 365, metrics=('rmse', 'me', 'mae'))
+"""
+
+from functools import cached_property
+
+import numpy as np
+
+from pyfunclib.libdata import gof
+
+# number of values (windows x members x window length) of the sliding window views reduced at a time
+BLOCKSIZE = 2**22
+
+
+def rolling(actual: np.ndarray, predicted: np.ndarray, window: int, metrics=('rmse', 'me', 'mae'), axis: int = 0,
+            seasonality: int = 1, benchmark: np.ndarray = None, mask: np.ndarray = None, skipna: bool = False):
+    """
+    Rolling metrics over windows of `window` time steps
+
+    actual, predicted, seasonality, benchmark, mask and skipna are as in gof.evaluate
+    with the time axis `axis`. metrics=None computes every metric of gof.METRICS.
+    Returns a dict of arrays the shape of predicted, the value at time t being the
+    metric of the window ending at t (NaN for t < window - 1). With skipna, the means
+    are over the valid values in each window.
+    """
+    metrics = list(gof.METRICS) if metrics is None else list(metrics)
+    unknown = [name for name in metrics if name not in gof._KERNELS]
+    if unknown:
+        raise ValueError(f'metrics without a rolling kernel: {unknown}')
+    ntime = np.shape(predicted)[axis]
+    if not 1 <= window <= ntime:
+        raise ValueError(f'window must be between 1 and the length of the series ({ntime}), got {window}')
+
+    intermediates = _RollingIntermediates(actual, predicted, window, seasonality=seasonality, benchmark=benchmark,
+                                          axis=axis, mask=mask, skipna=skipna)
+    shape = intermediates.predicted.shape
+    release = gof._release(metrics)
+    results = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for i,name in enumerate(metrics):
+            values = np.full(shape, np.nan)
+            values[window - 1:] = _OVERRIDES.get(name, gof._KERNELS[name])(intermediates)
+            results[name] = np.moveaxis(values, 0, axis)
+            for x in release.get(i, ()):
+                intermediates.__dict__.pop(x, None)
+    return results
+
+
+class _RollingIntermediates(gof._Intermediates):
+
+    """
+    gof._Intermediates with rolling reductions along time (axis 0)
+
+    Every reduction returns one value per window, ntime - window + 1 in all. A term
+    that starts k steps late (k = seasonality for the naive forecast, 1 for the
+    directions) is reduced over the window - k values inside each window.
+    """
+
+    def __init__(self, actual, predicted, window, **options):
+        super().__init__(actual, predicted, **options)
+        self.window = window
+        self.ntime = len(self.predicted)
+
+    def _length(self, x):
+        # window length of a term that starts ntime - len(x) steps late
+        return self.window - (self.ntime - len(x))
+
+    def count(self, x):
+        """ number of values in each window (of valid values with skipna) """
+        length = self._length(x)
+        if not self.skipna:
+            return np.full((self.ntime - self.window + 1,) + np.shape(x)[1:], float(max(length, 0)))
+        return _window_sum((~np.isnan(x)).astype(np.float64), length)
+
+    def sum(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        if self.skipna:
+            x = np.where(np.isnan(x), 0.0, x)
+        return _window_sum(x, self._length(x))
+
+    def mean(self, x):
+        return self.sum(x) / self.count(x)
+
+    def max(self, x):
+        return _window_extreme(np.asarray(x, dtype=np.float64), self._length(x), np.fmax if self.skipna else np.maximum)
+
+    def min(self, x):
+        return _window_extreme(np.asarray(x, dtype=np.float64), self._length(x), np.fmin if self.skipna else np.minimum)
+
+    def median(self, x):
+        return _window_reduce(np.asarray(x, dtype=np.float64), self._length(x),
+                              lambda windows: (np.nanmedian if self.skipna else np.median)(windows, axis=-1))
+
+    def deviation(self, x, center):
+        """ sum of squared deviations of x from one center per window """
+        return self.sum(np.square(x)) - 2 * center * self.sum(x) + self.count(x) * np.square(center)
+
+    def codeviate(self, x, y, xmean, ymean):
+        # x and y are shifted by their overall means, so the cumulative sums of products do not cancel
+        xshift,yshift = np.nanmean(x, axis=0),np.nanmean(y, axis=0)
+        x,y,xmean,ymean = x - xshift,y - yshift,xmean - xshift,ymean - yshift
+        return self.sum(x * y) - xmean * self.sum(y) - ymean * self.sum(x) + self.count(x * y) * xmean * ymean
+
+    @cached_property
+    def ndof(self):
+        return self.count(self.error) - 1
+
+
+def _window_sum(x, length):
+    """ sums of x over the windows of `length` values ending at each of its last len(x) - length + 1 values """
+    nwindows = len(x) - length + 1
+    if length <= 0:
+        return np.full((nwindows,) + x.shape[1:], np.nan)
+    finite = np.isfinite(x)
+    if finite.all():
+        return _window_diff(np.cumsum(x, axis=0), length)
+    # inf and NaN would spoil every later cumulative sum, so count them separately
+    total = _window_diff(np.cumsum(np.where(finite, x, 0.0), axis=0), length)
+    nposinf = _window_diff(np.cumsum(x == np.inf, axis=0), length)
+    nneginf = _window_diff(np.cumsum(x == -np.inf, axis=0), length)
+    nnan = _window_diff(np.cumsum(np.isnan(x), axis=0), length)
+    total = np.where(nposinf > 0, np.inf, total)
+    total = np.where(nneginf > 0, -np.inf, total)
+    return np.where((nnan > 0) | ((nposinf > 0) & (nneginf > 0)), np.nan, total)
+
+
+def _window_diff(cumsum, length):
+    # window sums from a cumulative sum; the first window has nothing to subtract
+    sums = cumsum[length - 1:].copy()
+    sums[1:] -= cumsum[:len(cumsum) - length]
+    return sums
+
+
+def _window_extreme(x, length, function):
+    """ maximum (function=np.maximum) or minimum of x over the windows of `length` values, by doubling """
+    nwindows = len(x) - length + 1
+    if length <= 0:
+        return np.full((nwindows,) + x.shape[1:], np.nan)
+    # extreme[i] is the extreme of x[i:i + span]
+    extreme = x
+    span = 1
+    while 2 * span <= length:
+        extreme = function(extreme[:-span], extreme[span:])
+        span *= 2
+    # two overlapping spans cover each window
+    return function(extreme[:nwindows], extreme[length - span:length - span + nwindows])
+
+
+def _window_reduce(x, length, function):
+    """ function(windows) on sliding window views of x (windows along the last axis), in blocks of windows """
+    nwindows = len(x) - length + 1
+    if length <= 0:
+        return np.full((nwindows,) + x.shape[1:], np.nan)
+    windows = np.lib.stride_tricks.sliding_window_view(x, length, axis=0)
+    nblock = max(1, BLOCKSIZE // max(windows[0].size, 1))
+    return np.concatenate([function(windows[i:i + nblock]) for i in range(0, nwindows, nblock)])
+
+
+# kernels that reduce deviations from a per-window center, in place of those of gof._KERNELS
+_OVERRIDES = dict(
+    std_ae=lambda s: np.sqrt(s.deviation(s.error, s.mae) / s.ndof),
+    std_ape=lambda s: np.sqrt(s.deviation(s.percentage_error, s.mape) / s.ndof),
+    rae=lambda s: s.sum(s.abs_error) / (_rae_denominator(s) + gof.EPSILON),
+    log_nse=lambda s: _log_nse(s),
+)
+
+
+def _rae_denominator(s):
+    # sum of absolute deviations of actual from the mean of each window, on sliding window views
+    total = np.nansum if s.skipna else np.sum
+    windows = np.lib.stride_tricks.sliding_window_view(s.paired_actual, s.window, axis=0)
+    mean = s.actual_mean
+    nblock = max(1, BLOCKSIZE // max(windows[0].size, 1))
+    return np.concatenate([total(np.abs(windows[i:i + nblock] - mean[i:i + nblock, ..., None]), axis=-1)
+                           for i in range(0, len(windows), nblock)])
+
+
+def _log_nse(s):
+    # log_nse with the offset of each window, on sliding window views
+    total = np.nansum if s.skipna else np.sum
+    predicted = s.paired_predicted
+    actual = np.broadcast_to(s.paired_actual, predicted.shape)
+    offset = np.broadcast_to(s.actual_mean, (len(predicted) - s.window + 1,) + predicted.shape[1:]) / 100
+    actual = np.lib.stride_tricks.sliding_window_view(actual, s.window, axis=0)
+    predicted = np.lib.stride_tricks.sliding_window_view(predicted, s.window, axis=0)
+    nblock = max(1, BLOCKSIZE // max(actual[0].size, 1))
+    values = []
+    for i in range(0, len(actual), nblock):
+        log_actual = np.log(actual[i:i + nblock] + offset[i:i + nblock, ..., None])
+        log_predicted = np.log(predicted[i:i + nblock] + offset[i:i + nblock, ..., None])
+        count = np.sum(~np.isnan(log_actual), axis=-1, keepdims=True) if s.skipna else s.window
+        log_actual_mean = total(log_actual, axis=-1, keepdims=True) / count
+        values.append(1 - total(np.square(log_actual - log_predicted), axis=-1)
+                      / total(np.square(log_actual - log_actual_mean), axis=-1))
+    return np.concatenate(values)
@@ -0,0 +1,362 @@
+"""
+gofstream.py
+Desc: streaming, mergeable accumulators for the gof metrics
+
+A GofAccumulator is updated with consecutive chunks of a series (or of an ensemble, time x members) and keeps only running sums, so series that do not fit in memory can be read from disk chunk by chunk, and chunks evaluated in parallel workers can be merged afterwards. Sums are compensated (Kahan-Neumaier) and moments are merged with Welford/Chan updates, so the merged results match gof.evaluate on the whole series to rounding, whatever the chunking.
+
+The naive forecast (mase, rmsse, mre, mrae, gmrae, mbrae, umbrae) and mda pair each time step with an earlier one. Each accumulator keeps its first and last `seasonality` time steps, so the pairs that straddle two chunks are counted when the chunks are merged. For that reason merge is not commutative: other must be the piece that directly follows self in time.
+
+The median metrics (mdae, mdape, smdape, rmdspe, mdrae) cannot be computed from running sums. They use a QuantileSketch, a logarithmic histogram like DDSketch: every value is counted in a bucket [gamma**(k-1), gamma**k) with gamma = (1 + alpha) / (1 - alpha), so any quantile is returned within a relative error alpha (relative_accuracy, default 1%) of a value at that rank, and sketches merge exactly by adding counts. The median is the value at rank (n-1)/2, not the mean of the two middle values as in np.median. Values below min_value count as zero.
+
+rae (which needs the mean of the whole series before the first pass) and relative errors against an explicit benchmark series are not supported.
+
+Example
+-------
+acc = GofAccumulator()
+for actual,predicted in chunks:        # consecutive chunks, predicted may be time x members
+    acc.update(actual,predicted)
+results = acc.result()
+
+# or in parallel, one accumulator per consecutive block of the series
+accs = pool.map(evaluate_block, blocks)
+acc = functools.reduce(GofAccumulator.merge, accs)
+"""
+
+import copy
+import numpy as np
+
+from pyfunclib.libdata import gof
+from pyfunclib.libdata.gof import EPSILON
+
+# metrics available from running sums
+MOMENT_METRICS = ('mse', 'rmse', 'nrmse', 'me', 'mae', 'mad', 'gmae', 'mpe', 'mape', 'smape', 'maape',
+    'mase', 'std_ae', 'std_ape', 'rmspe', 'rmsse', 'inrse', 'rrse', 'mre', 'mrae', 'gmrae', 'mbrae',
+    'umbrae', 'mda')
+
+# metrics available from quantile sketches (approximate)
+QUANTILE_METRICS = ('mdae', 'mdape', 'smdape', 'rmdspe', 'mdrae')
+
+
+class KahanSum:
+
+    """
+    compensated (Kahan-Neumaier) running sum of arrays
+    """
+
+    def __init__(self, shape=()):
+        self.sum = np.zeros(shape)
+        self.compensation = np.zeros(shape)
+
+    def add(self, value):
+        value = np.asarray(value, dtype=np.float64)
+        total = self.sum + value
+        self.compensation += np.where(np.abs(self.sum) >= np.abs(value),
+            (self.sum - total) + value, (value - total) + self.sum)
+        self.sum = total
+
+    def merge(self, other):
+        self.add(other.sum)
+        self.add(other.compensation)
+
+    @property
+    def value(self):
+        return self.sum + self.compensation
+
+
+class Moments:
+
+    """
+    running count, mean and sum of squared deviations (M2) of arrays along their first axis (Welford/Chan)
+    """
+
+    def __init__(self, shape=()):
+        self.n = np.zeros(shape)
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def update(self, x):
+        x = np.asarray(x, dtype=np.float64)
+        other = Moments(x.shape[1:])
+        if len(x):
+            other.n = np.full(x.shape[1:], float(len(x)))
+            other.mean = np.mean(x, axis=0)
+            other.m2 = np.sum(np.square(x - other.mean), axis=0)
+        self.merge(other)
+
+    def merge(self, other):
+        n = self.n + other.n
+        delta = other.mean - self.mean
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weight = np.where(n > 0, other.n / n, 0.0)
+        self.m2 = self.m2 + other.m2 + np.square(delta) * self.n * weight
+        self.mean = self.mean + delta * weight
+        self.n = n
+
+    @property
+    def sumsq(self):
+        """ sum of squares of the values """
+        return self.m2 + self.n * np.square(self.mean)
+
+
+class QuantileSketch:
+
+    """
+    mergeable logarithmic histogram of non-negative values, for approximate quantiles (see the module docstring)
+
+    Parameters
+    ----------
+    shape : tuple
+        shape of the members (one sketch per member). default: ()
+    relative_accuracy : float (scalar)
+        relative error of the returned quantiles. default: 0.01
+    min_value : float (scalar)
+        values below this count as zero. default: 1e-12
+    """
+
+    def __init__(self, shape=(), relative_accuracy=0.01, min_value=1e-12):
+        self.shape = tuple(shape)
+        self.relative_accuracy = relative_accuracy
+        self.min_value = min_value
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.offset = 0
+        self.counts = np.zeros((0,) + self.shape, dtype=np.int64)
+        self.zeros = np.zeros(self.shape, dtype=np.int64)
+
+    def update(self, x):
+        """ add values x, with shape (n,) + shape """
+        nmembers = int(np.prod(self.shape))
+        x = np.broadcast_to(np.asarray(x, dtype=np.float64), x.shape[:1] + self.shape).reshape(len(x), nmembers)
+        small = ~(x >= self.min_value)
+        self.zeros += small.sum(axis=0).reshape(self.shape)
+        irow,imember = np.nonzero(~small)
+        if len(irow) == 0:
+            return
+        keys = np.ceil(np.log(x[irow, imember]) / np.log(self.gamma)).astype(np.int64)
+        self._extend(keys.min(), keys.max())
+        counts = np.bincount((keys - self.offset) * nmembers + imember, minlength=len(self.counts) * nmembers)
+        self.counts += counts.reshape(self.counts.shape)
+
+    def merge(self, other):
+        """ add the counts of another sketch with the same shape and accuracy """
+        if other.gamma != self.gamma or other.shape != self.shape:
+            raise ValueError('sketches must have the same shape and relative accuracy')
+        self.zeros += other.zeros
+        if len(other.counts):
+            self._extend(other.offset, other.offset + len(other.counts) - 1)
+            i = other.offset - self.offset
+            self.counts[i:i + len(other.counts)] += other.counts
+
+    @property
+    def count(self):
+        return self.zeros + self.counts.sum(axis=0)
+
+    def quantile(self, q):
+        """ value at rank q * (count - 1) of each member, within relative_accuracy. nan for empty sketches """
+        rank = q * (self.count - 1)
+        cumulative = self.zeros + np.cumsum(self.counts, axis=0)
+        ikey = np.argmax(cumulative > rank, axis=0) if len(self.counts) else np.zeros(self.shape, dtype=np.int64)
+        value = 2 * self.gamma ** (ikey + self.offset) / (self.gamma + 1)
+        value = np.where(rank < self.zeros, 0.0, value)
+        return np.where(self.count > 0, value, np.nan)
+
+    def _extend(self, kmin, kmax):
+        # grow the dense key range to cover kmin..kmax
+        if len(self.counts) == 0:
+            self.offset = kmin
+            self.counts = np.zeros((kmax - kmin + 1,) + self.shape, dtype=np.int64)
+            return
+        lo = min(kmin, self.offset)
+        hi = max(kmax, self.offset + len(self.counts) - 1)
+        if lo == self.offset and hi == self.offset + len(self.counts) - 1:
+            return
+        counts = np.zeros((hi - lo + 1,) + self.shape, dtype=np.int64)
+        counts[self.offset - lo:self.offset - lo + len(self.counts)] = self.counts
+        self.offset,self.counts = lo,counts
+
+
+class GofAccumulator:
+
+    """
+    streaming, mergeable goodness-of-fit accumulator (see the module docstring)
+
+    Parameters
+    ----------
+    seasonality : int (scalar)
+        shift of the naive forecast (mase, rmsse and the relative errors). default: 1
+    quantiles : bool
+        keep quantile sketches for the median metrics. each sketch holds about log(max/min)/(2*relative_accuracy) counts per member. default: True
+    relative_accuracy : float (scalar)
+        relative accuracy of the median metrics. default: 0.01
+    """
+
+    _SUMS = ('ae', 'log_ae', 'ape', 'spe', 'atan_ape', 'naive_ae', 'naive_count',
+             're', 'abs_re', 'log_abs_re', 'bre', 'direction', 'direction_count')
+
+    def __init__(self, seasonality=1, quantiles=True, relative_accuracy=0.01):
+        self.seasonality = seasonality
+        self.quantiles = quantiles
+        self.relative_accuracy = relative_accuracy
+        self.shape = None
+
+    def update(self, actual, predicted):
+        """
+        add the next chunk of the series: actual (time,) or (time, members...), predicted (time, members...), time along the first axis
+        """
+        if self.shape is None:
+            self._fromchunk(actual, predicted)
+            return self
+        chunk = GofAccumulator(self.seasonality, self.quantiles, self.relative_accuracy)
+        chunk._fromchunk(actual, predicted)
+        return self.merge(chunk)
+
+    def merge(self, other):
+        """ merge an accumulator of the piece of the series that directly follows this one. returns self """
+        if other.shape is None:
+            return self
+        if self.shape is None:
+            self.__dict__.update(copy.deepcopy(other.__dict__))
+            return self
+        if other.seasonality != self.seasonality or other.shape != self.shape:
+            raise ValueError('accumulators must have the same seasonality and member shape')
+
+        # pairs with the earlier time step in self and the later one in other
+        nself = len(self.tail_actual)
+        actual = np.concatenate((self.tail_actual, other.head_actual))
+        predicted = np.concatenate((self.tail_predicted, other.head_predicted))
+        self._pairs(actual, predicted, nself, len(actual))
+
+        for name in self._SUMS:
+            self.sums[name].merge(other.sums[name])
+        for name in self.moments:
+            self.moments[name].merge(other.moments[name])
+        for name in self.sketches:
+            self.sketches[name].merge(other.sketches[name])
+        self.actual_max = np.maximum(self.actual_max, other.actual_max)
+        self.actual_min = np.minimum(self.actual_min, other.actual_min)
+
+        nkeep = max(self.seasonality, 1)
+        self.head_actual = np.concatenate((self.head_actual, other.head_actual))[:nkeep]
+        self.head_predicted = np.concatenate((self.head_predicted, other.head_predicted))[:nkeep]
+        self.tail_actual = np.concatenate((self.tail_actual, other.tail_actual))[-nkeep:]
+        self.tail_predicted = np.concatenate((self.tail_predicted, other.tail_predicted))[-nkeep:]
+        return self
+
+    def result(self, metrics=None):
+        """
+        metrics of everything added so far, as a dict like gof.evaluate. default: all of MOMENT_METRICS, and QUANTILE_METRICS if quantiles is True
+        """
+        if metrics is None:
+            metrics = MOMENT_METRICS + (QUANTILE_METRICS if self.quantiles else ())
+        unknown = [name for name in metrics if name not in MOMENT_METRICS + QUANTILE_METRICS]
+        if unknown:
+            raise ValueError(f'metrics not available from a GofAccumulator: {unknown}')
+        if self.shape is None:
+            return {name: np.nan for name in metrics}
+
+        sums = {name: total.value for name,total in self.sums.items()}
+        error,perror = self.moments['error'],self.moments['percentage_error']
+        n = error.n
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mse = error.sumsq / n
+            mae = sums['ae'] / n
+            mape = sums['ape'] / n
+            naive_mae = sums['naive_ae'] / sums['naive_count']
+            mbrae = sums['bre'] / sums['naive_count']
+            values = {
+                'mse': lambda: mse,
+                'rmse': lambda: np.sqrt(mse),
+                'nrmse': lambda: np.sqrt(mse) / (self.actual_max - self.actual_min),
+                'me': lambda: error.mean,
+                'mae': lambda: mae,
+                'mad': lambda: mae,
+                'gmae': lambda: np.exp(sums['log_ae'] / n),
+                'mpe': lambda: perror.mean,
+                'mape': lambda: mape,
+                'smape': lambda: sums['spe'] / n,
+                'maape': lambda: sums['atan_ape'] / n,
+                'mase': lambda: mae / naive_mae,
+                'std_ae': lambda: np.sqrt((error.m2 + n * np.square(error.mean - mae)) / (n - 1)),
+                'std_ape': lambda: np.sqrt((perror.m2 + n * np.square(perror.mean - mape)) / (n - 1)),
+                'rmspe': lambda: np.sqrt(perror.sumsq / n),
+                'rmsse': lambda: np.sqrt(mse) / naive_mae,
+                'inrse': lambda: np.sqrt(error.sumsq / self.moments['actual'].m2),
+                'rrse': lambda: np.sqrt(error.sumsq / self.moments['actual'].m2),
+                'mre': lambda: sums['re'] / sums['naive_count'],
+                'mrae': lambda: sums['abs_re'] / sums['naive_count'],
+                'gmrae': lambda: np.exp(sums['log_abs_re'] / sums['naive_count']),
+                'mbrae': lambda: mbrae,
+                'umbrae': lambda: mbrae / (1 - mbrae),
+                'mda': lambda: sums['direction'] / sums['direction_count'],
+                'mdae': lambda: self.sketches['ae'].quantile(0.5),
+                'mdape': lambda: self.sketches['ape'].quantile(0.5),
+                'smdape': lambda: self.sketches['spe'].quantile(0.5),
+                'rmdspe': lambda: self.sketches['ape'].quantile(0.5),
+                'mdrae': lambda: self.sketches['abs_re'].quantile(0.5),
+            }
+            results = {}
+            for name in metrics:
+                if name in QUANTILE_METRICS and not self.quantiles:
+                    raise ValueError(f'{name} needs quantiles=True')
+                results[name] = np.broadcast_to(values[name](), self.shape)[()]
+        return results
+
+    def _fromchunk(self, actual, predicted):
+        actual,predicted,_ = gof._align(actual, predicted, None, 0)
+        self.shape = np.broadcast_shapes(actual.shape[1:], predicted.shape[1:])
+        predicted = np.broadcast_to(predicted, predicted.shape[:1] + self.shape).astype(np.float64, copy=False)
+        actual = actual.astype(np.float64, copy=False)
+        self.sums = {name: KahanSum(self.shape) for name in self._SUMS}
+        self.moments = {'error': Moments(self.shape), 'percentage_error': Moments(self.shape),
+                        'actual': Moments(actual.shape[1:])}
+        self.sketches = {}
+        if self.quantiles:
+            self.sketches = {name: QuantileSketch(self.shape, self.relative_accuracy) for name in ('ae', 'ape', 'spe', 'abs_re')}
+
+        error = actual - predicted
+        abs_error = np.abs(error)
+        perror = error / (actual + EPSILON)
+        abs_perror = np.abs(perror)
+        sperror = 2.0 * abs_error / ((np.abs(actual) + np.abs(predicted)) + EPSILON)
+        self.moments['error'].update(error)
+        self.moments['percentage_error'].update(perror)
+        self.moments['actual'].update(actual)
+        with np.errstate(divide='ignore'):
+            log_abs_error = np.log(abs_error)
+        for name,value in (('ae', abs_error), ('log_ae', log_abs_error), ('ape', abs_perror),
+                           ('spe', sperror), ('atan_ape', np.arctan(abs_perror))):
+            self.sums[name].add(np.sum(value, axis=0))
+        for name,value in (('ae', abs_error), ('ape', abs_perror), ('spe', sperror)):
+            if name in self.sketches:
+                self.sketches[name].update(value)
+        self.actual_max = np.max(actual, axis=0) if len(actual) else np.full(actual.shape[1:], -np.inf)
+        self.actual_min = np.min(actual, axis=0) if len(actual) else np.full(actual.shape[1:], np.inf)
+
+        # pairs within the chunk
+        self._pairs(actual, predicted, 0, len(actual))
+
+        nkeep = max(self.seasonality, 1)
+        self.head_actual,self.head_predicted = actual[:nkeep],predicted[:nkeep]
+        self.tail_actual,self.tail_predicted = actual[-nkeep:],predicted[-nkeep:]
+
+    def _pairs(self, actual, predicted, start, stop):
+        # add the naive forecast and direction terms of the time steps j in [start, stop) whose earlier partner (j - lag) is in actual. steps j >= start + lag pair inside a later piece and are counted there
+        s = self.seasonality
+        j = np.arange(max(start, s), min(stop, start + s) if start > 0 else stop)
+        error = actual[j] - predicted[j]
+        naive_error = actual[j] - actual[j - s]
+        abs_error,abs_naive = np.abs(error),np.abs(naive_error)
+        relative = error / (naive_error + EPSILON)
+        abs_relative = np.abs(relative)
+        with np.errstate(divide='ignore'):
+            log_abs_relative = np.log(abs_relative)
+        for name,value in (('naive_ae', abs_naive), ('naive_count', np.ones_like(abs_error)), ('re', relative),
+                           ('abs_re', abs_relative), ('log_abs_re', log_abs_relative),
+                           ('bre', abs_error / (abs_error + abs_naive + EPSILON))):
+            self.sums[name].add(np.sum(np.broadcast_to(value, (len(j),) + self.shape), axis=0))
+        if 'abs_re' in self.sketches:
+            self.sketches['abs_re'].update(np.broadcast_to(abs_relative, (len(j),) + self.shape))
+
+        j = np.arange(max(start, 1), min(stop, start + 1) if start > 0 else stop)
+        agree = np.sign(actual[j] - actual[j - 1]) == np.sign(predicted[j] - predicted[j - 1])
+        self.sums['direction'].add(np.sum(agree, axis=0))
+        self.sums['direction_count'].add(np.full(self.shape, float(len(j))))
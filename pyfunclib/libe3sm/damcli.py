@@ -0,0 +1,240 @@
+"""
+damcli.py
+Desc: batch dam dependency and downstream analysis across many basins in parallel (pyfunclib-dams)
+
+Usage
+-----
+python -m pyfunclib.libe3sm.damcli manifest.yaml [--workers 8] [--max-memory 16] [--overwrite]
+
+The manifest (YAML) sets the output directory, defaults for the makeDamDependency options, and one entry per basin. Any option can be set per basin to override the default:
+
+output: /path/to/results
+searchradius: 5000
+useflowline: false
+geographic: false
+cachedir: null              # see meshcache
+globalid: ID                # mesh column with the global cell IDs
+damid: null                 # dam column with the dam IDs. default: the row index
+basins:
+  - name: susquehanna
+    mesh: susquehanna_mesh.shp      # any file geopandas can read, with ID, dnID and Elevation columns
+    dams: susquehanna_dams.shp
+    mask: susquehanna_boundary.shp
+    flowline: susquehanna_flowline.shp      # optional
+    searchradius: 3000
+
+Each basin runs in its own worker process. For each finished basin the global IDs (globalid column) of the dependent and downstream cells are written to <output>/<name>.npz (see damio.readDamDependency) together with a <name>.done marker, so an interrupted run only repeats the unfinished basins. The time, dam and cell counts and peak memory of every basin are written to <output>/timing.csv.
+"""
+
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import resource
+import traceback
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+# manifest defaults, overridden by the top level of the manifest and then by each basin
+DEFAULTS = {
+    'searchradius': None,
+    'useflowline': False,
+    'geographic': False,
+    'cachedir': None,
+    'flowline': None,
+    'globalid': 'ID',
+    'damid': None,
+}
+
+TIMINGFIELDS = ['name', 'status', 'seconds', 'ndams', 'ncells', 'maxrss_mb', 'error']
+
+
+def loadManifest(manifestfile):
+
+    """
+    read a basin manifest and resolve the options of each basin
+
+    Parameters
+    ----------
+    manifestfile : str
+        YAML manifest, see the module docstring
+
+    Returns
+    -------
+    output : str
+        output directory
+    basins : dict (list)
+        options of each basin. relative file paths are taken relative to the manifest
+    """
+
+    from pyfunclib.libhydro.modeltools import load_yaml_file
+
+    manifest = load_yaml_file(manifestfile)
+    if manifest is None:
+        raise ValueError(f'could not read manifest {manifestfile}')
+    if 'output' not in manifest or not manifest.get('basins'):
+        raise ValueError(f'manifest {manifestfile} needs an output directory and a list of basins')
+
+    root = os.path.dirname(os.path.abspath(manifestfile))
+    defaults = dict(DEFAULTS, **{key: value for key,value in manifest.items() if key in DEFAULTS})
+
+    basins = []
+    for basin in manifest['basins']:
+        basin = dict(defaults, **basin)
+        missing = [key for key in ('name', 'mesh', 'dams', 'mask', 'searchradius') if basin.get(key) is None]
+        if missing:
+            raise ValueError(f'basin {basin.get("name")} in {manifestfile} is missing {missing}')
+        for key in ('mesh', 'dams', 'mask', 'flowline'):
+            if basin[key] is not None:
+                basin[key] = os.path.join(root, basin[key])
+        basins.append(basin)
+
+    names = [basin['name'] for basin in basins]
+    if len(set(names)) != len(names):
+        raise ValueError(f'basin names in {manifestfile} are not unique')
+    return os.path.join(root, manifest['output']),basins
+
+
+def runBasin(basin,output):
+
+    """
+    run makeDamDependency for one basin and write the results (see damio.writeDamDependency)
+
+    Parameters
+    ----------
+    basin : dict
+        options of the basin, see loadManifest
+    output : str
+        output directory
+
+    Returns
+    -------
+    timing : dict
+        name, seconds, ndams and ncells of the basin, and peak memory (MB) of the worker
+    """
+
+    import geopandas as gpd
+    from pyfunclib.libdata import datautils as du
+    from pyfunclib.libe3sm import damio
+    from pyfunclib.libe3sm.meshutils import makeDamDependency
+
+    t0 = time.perf_counter()
+    Mesh = gpd.read_file(basin['mesh'])
+    Dams = gpd.read_file(basin['dams'])
+    Mask = gpd.read_file(basin['mask'])
+    FlowLine = None if basin['flowline'] is None else gpd.read_file(basin['flowline'])
+
+    damID = np.asarray(Dams.index if basin['damid'] is None else Dams[basin['damid']])
+    globalID = np.asarray(Mesh[basin['globalid']])
+
+    dependent = makeDamDependency(Dams,Mesh,basin['searchradius'],globalID,Mask,FlowLine,
+        output='ragged',useflowline=basin['useflowline'],cachedir=basin['cachedir'],geographic=basin['geographic'])
+    # the cells below each dam down to the outlet, as global IDs like the dependent cells
+    indptr,i_downstream = du.list2ragged(Dams['i_DownstreamCells'],dtype=np.int64)
+    downstream = (indptr,globalID[i_downstream].astype(dependent[1].dtype))
+
+    # write under a temporary name first, so a killed worker never leaves a partial result behind
+    filename = os.path.join(output, basin['name'] + '.npz')
+    tmpfile = os.path.join(output, '.' + basin['name'] + '.tmp.npz')
+    damio.writeDamDependency(tmpfile,damID,dependent,downstream)
+    os.replace(tmpfile, filename)
+
+    timing = dict(name=basin['name'], seconds=time.perf_counter() - t0, ndams=len(Dams), ncells=len(Mesh),
+        maxrss_mb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024)
+    with open(_donefile(output, basin['name']), 'w') as f:
+        json.dump(timing, f)
+    return timing
+
+
+def runBasins(manifestfile,workers=None,maxmemory=None,overwrite=False):
+
+    """
+    run every basin in a manifest in a process pool, skipping basins that already finished
+
+    Parameters
+    ----------
+    manifestfile : str
+        YAML manifest, see the module docstring
+    workers : int (scalar)
+        number of worker processes. default: None (number of CPUs)
+    maxmemory : float (scalar)
+        address space limit of each worker in GB. a basin that exceeds it fails with a MemoryError instead of taking down the machine. default: None (no limit)
+    overwrite : bool
+        rerun basins that already finished. default: False
+
+    Returns
+    -------
+    timings : dict (list)
+        status (done, skipped or failed), time and size of each basin, also written to <output>/timing.csv
+    """
+
+    output,basins = loadManifest(manifestfile)
+    os.makedirs(output, exist_ok=True)
+
+    timings = {}
+    todo = []
+    for basin in basins:
+        if not overwrite and os.path.exists(_donefile(output, basin['name'])):
+            with open(_donefile(output, basin['name'])) as f:
+                timings[basin['name']] = dict(json.load(f), status='skipped')
+        else:
+            # a rerun that fails must not leave the marker of an earlier run behind
+            if os.path.exists(_donefile(output, basin['name'])):
+                os.remove(_donefile(output, basin['name']))
+            todo.append(basin)
+
+    # each worker runs one basin and is then replaced, so memory held by one basin is never carried into the next
+    limit = None if maxmemory is None else int(maxmemory * 2**30)
+    with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1,
+                             initializer=_limitmemory, initargs=(limit,)) as pool:
+        futures = {pool.submit(runBasin, basin, output): basin['name'] for basin in todo}
+        for future in as_completed(futures):
+            name = futures[future]
+            try:
+                timings[name] = dict(future.result(), status='done')
+            except Exception as err:
+                error = ''.join(traceback.format_exception_only(type(err), err)).strip()
+                timings[name] = dict(name=name, status='failed', error=error)
+            print(f"{name}: {timings[name]['status']}", file=sys.stderr)
+
+    timings = [timings[basin['name']] for basin in basins]
+    with open(os.path.join(output, 'timing.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=TIMINGFIELDS)
+        writer.writeheader()
+        for timing in timings:
+            writer.writerow({key: timing.get(key, '') for key in TIMINGFIELDS})
+    return timings
+
+
+def main(argv=None):
+
+    """ command line entry point (pyfunclib-dams) """
+
+    parser = argparse.ArgumentParser(prog='pyfunclib-dams',
+        description='dam dependency and downstream analysis for the basins in a manifest')
+    parser.add_argument('manifest', help='YAML manifest of mesh, dam, mask and flowline files')
+    parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: number of CPUs)')
+    parser.add_argument('--max-memory', type=float, default=None, help='address space limit of each worker, in GB')
+    parser.add_argument('--overwrite', action='store_true', help='rerun basins that already finished')
+    args = parser.parse_args(argv)
+
+    timings = runBasins(args.manifest,args.workers,args.max_memory,args.overwrite)
+    nfailed = sum(timing['status'] == 'failed' for timing in timings)
+    if nfailed:
+        print(f'{nfailed} of {len(timings)} basins failed, see timing.csv', file=sys.stderr)
+    return 1 if nfailed else 0
+
+
+def _donefile(output,name):
+    return os.path.join(output, name + '.done')
+
+
+def _limitmemory(limit):
+    if limit is not None:
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
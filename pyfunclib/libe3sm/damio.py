@@ -0,0 +1,157 @@
+"""
+damio.py
+Desc: columnar binary files for dam dependency and downstream results, for E3SM preprocessing
+
+The results are stored as typed arrays: the dam IDs, and each ragged result (dependent cells, downstream cells) as a CSR-style (indptr, ids) pair, where the ids of dam i are ids[indptr[i]:indptr[i+1]]. Files ending in .nc are written with netCDF4 (optional dependency). All other files are uncompressed .npz archives, written in chunks and memory-mapped on read, so neither side holds a second copy of the large arrays.
+"""
+
+import zipfile
+import numpy as np
+
+# bump this if the variables or their layout change
+FORMAT_VERSION = 1
+
+# default number of array elements written at a time
+CHUNKSIZE = 2**22
+
+
+def writeDamDependency(filename,damID,dependent,downstream=None,chunksize=CHUNKSIZE):
+
+    """
+    write dam dependency (and downstream) results to a columnar binary file
+
+    Parameters
+    ----------
+    filename : str
+        output file. '.nc' writes netCDF4, anything else an uncompressed .npz archive
+    damID : int (array)
+        ID of each dam
+    dependent : (int (array), int (array))
+        ragged (indptr, ids) pair of the dependent cells of each dam, e.g. makeDamDependency(..., output='ragged')
+    downstream : (int (array), int (array))
+        ragged (indptr, ids) pair of the downstream cells of each dam, e.g. from FlowNetwork.downstream. default: None
+    chunksize : int (scalar)
+        number of array elements written at a time
+
+    Returns
+    -------
+    None
+    """
+
+    variables = {'damID': np.asarray(damID)}
+    for name,ragged in (('dependent', dependent), ('downstream', downstream)):
+        if ragged is None:
+            continue
+        indptr,ids = ragged
+        if len(indptr) != len(variables['damID']) + 1:
+            raise ValueError(f'{name} indptr must have length ndams+1')
+        variables[name + '_indptr'] = np.asarray(indptr, dtype=np.int64)
+        variables[name + '_ids'] = np.asarray(ids)
+
+    if str(filename).endswith('.nc'):
+        _writenc(filename,variables,chunksize)
+    else:
+        variables['format_version'] = np.array(FORMAT_VERSION)
+        _writenpz(filename,variables,chunksize)
+
+
+def readDamDependency(filename,mmap=True):
+
+    """
+    read a file written by writeDamDependency
+
+    Parameters
+    ----------
+    filename : str
+        input file
+    mmap : bool
+        memory-map the arrays of .npz files instead of reading them. netCDF4 files are read into memory. default: True
+
+    Returns
+    -------
+    results : dict
+        'damID' array, and 'dependent' and (if written) 'downstream' as ragged (indptr, ids) pairs
+    """
+
+    if str(filename).endswith('.nc'):
+        variables = _readnc(filename)
+    else:
+        variables = _readnpz(filename,mmap)
+    # .item() also reads the shape (1,) version of files written before it was stored as a scalar
+    version = int(np.asarray(variables.pop('format_version', FORMAT_VERSION)).item())
+    if version > FORMAT_VERSION:
+        raise ValueError(f'{filename} has format version {version}, this reader supports up to {FORMAT_VERSION}')
+
+    results = {'damID': variables['damID']}
+    for name in ('dependent', 'downstream'):
+        if name + '_indptr' in variables:
+            results[name] = (variables[name + '_indptr'], variables[name + '_ids'])
+    return results
+
+
+def _writenpz(filename,variables,chunksize):
+    # same layout as np.savez, but each array is streamed to the archive in chunks
+    with zipfile.ZipFile(filename, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+        for name,a in variables.items():
+            # not np.ascontiguousarray, which makes the scalar format_version 1d
+            a = np.asarray(a, order='C')
+            header = {'descr': np.lib.format.dtype_to_descr(a.dtype), 'fortran_order': False, 'shape': a.shape}
+            with zf.open(name + '.npy', 'w', force_zip64=True) as f:
+                np.lib.format.write_array_header_2_0(f, header)
+                flat = a.reshape(-1)
+                for i in range(0, flat.size, chunksize):
+                    f.write(flat[i:i + chunksize].tobytes())
+
+
+def _readnpz(filename,mmap):
+    if not mmap:
+        with np.load(filename) as npz:
+            return {name: npz[name] for name in npz.files}
+
+    # each member is stored uncompressed, so its array data can be mapped directly from the archive
+    variables = {}
+    with zipfile.ZipFile(filename) as zf, open(filename, 'rb') as f:
+        for info in zf.infolist():
+            name = info.filename[:-len('.npy')]
+            if info.compress_type != zipfile.ZIP_STORED:
+                variables[name] = np.load(zf.open(info))
+                continue
+            # skip the local file header to the .npy member, then its array header
+            f.seek(info.header_offset + 26)
+            namelen,extralen = np.frombuffer(f.read(4), dtype='<u2')
+            f.seek(info.header_offset + 30 + int(namelen) + int(extralen))
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape,fortran_order,dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape,fortran_order,dtype = np.lib.format.read_array_header_2_0(f)
+            if np.prod(shape) == 0:
+                variables[name] = np.empty(shape, dtype=dtype)
+            else:
+                variables[name] = np.memmap(filename, dtype=dtype, mode='r', offset=f.tell(),
+                    shape=shape, order='F' if fortran_order else 'C')
+    return variables
+
+
+def _writenc(filename,variables,chunksize):
+    import netCDF4
+
+    with netCDF4.Dataset(filename, 'w', format='NETCDF4') as nc:
+        nc.format_version = FORMAT_VERSION
+        for name,a in variables.items():
+            dim = 'n' + name
+            nc.createDimension(dim, len(a))
+            var = nc.createVariable(name, a.dtype, (dim,),
+                chunksizes=(max(1, min(chunksize, len(a))),) if len(a) else None)
+            for i in range(0, len(a), chunksize):
+                var[i:i + chunksize] = a[i:i + chunksize]
+
+
+def _readnc(filename):
+    import netCDF4
+
+    with netCDF4.Dataset(filename) as nc:
+        nc.set_auto_mask(False)
+        variables = {name: var[:] for name,var in nc.variables.items()}
+        variables['format_version'] = getattr(nc, 'format_version', FORMAT_VERSION)
+        return variables
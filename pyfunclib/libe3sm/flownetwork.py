@@ -0,0 +1,332 @@
+"""
+flownetwork.py
+Desc: cell connectivity of a mesh river network, built once from ID/dnID
+"""
+
+import numpy as np
+
+# outlet value of dnID for each ID->dnID type
+OUTLETS = {'mosart': -9999, 'hexwatershed': -1}
+
+
+class FlowNetwork:
+
+    """
+    ID->dnID river network stored as an index of the downstream cell of each cell
+
+    Parameters
+    ----------
+    ID : int (list)
+        list of cell IDs
+    dnID : int (list)
+        list of downstream cell IDs for each element of ID
+    IDtype : str
+        specifies which cell ID->dnID type. use 'hexwatershed' if ID/dnID are the lCellID and lCellID_downslope fields from the hexwatershed json file. use 'mosart' if ID/dnID are the ID and dnID fields in the mosart parameter file. default: 'mosart'
+
+    Attributes
+    ----------
+    idown : int (array)
+        index of the downstream cell of each cell, -1 for outlets. cells whose dnID is not in ID are also treated as outlets
+    """
+
+    def __init__(self,ID,dnID,IDtype='mosart'):
+
+        self.ID = np.asarray(ID)
+        self.dnID = np.asarray(dnID)
+        self.IDtype = IDtype
+        self.ncells = len(self.ID)
+
+        # map each dnID to the index of that ID, once, instead of searching ID at every step of the downstream walk
+        isort = np.argsort(self.ID, kind='stable')
+        ipos = np.searchsorted(self.ID, self.dnID, sorter=isort)
+        ipos = np.minimum(ipos, self.ncells - 1)
+        found = (self.ID[isort[ipos]] == self.dnID) & (self.dnID != OUTLETS[IDtype])
+        self.idown = np.where(found, isort[ipos], -1)
+
+    @property
+    def ioutlet(self):
+        """ indices of the outlet cells """
+        return np.flatnonzero(self.idown < 0)
+
+    @property
+    def levels(self):
+
+        """
+        topological level of each cell: 0 for headwater cells, and one more than the highest level upstream for all other cells. every cell is at a higher level than all of its upstream cells, so cells at the same level can be updated together
+        """
+
+        if not hasattr(self, '_levels'):
+            self._toposort()
+        return self._levels
+
+    @property
+    def order(self):
+        """ cell indices sorted by level (upstream to downstream), and the pointer to the start of each level in it """
+        if not hasattr(self, '_levels'):
+            self._toposort()
+        return self._order,self._levelptr
+
+    @property
+    def basins(self):
+        """ index of the outlet cell that each cell drains to. cells with different outlets are in independent sub-basins """
+        if not hasattr(self, '_basins'):
+            order,levelptr = self.order
+            basins = np.arange(self.ncells)
+            # walk the levels from the top down, so the downstream cell's outlet is always known
+            for i1,i2 in zip(levelptr[-2::-1], levelptr[:0:-1]):
+                icells = order[i1:i2]
+                icells = icells[self.idown[icells] >= 0]
+                basins[icells] = basins[self.idown[icells]]
+            self._basins = basins
+        return self._basins
+
+    def accumulate(self,field,method='levels'):
+
+        """
+        accumulate a cell field down the network, e.g. runoff, sediment or area
+
+        The accumulated value of each cell is its own value plus the values of all cells upstream of it.
+
+        Parameters
+        ----------
+        field : float (array)
+            field to accumulate, with cells on the last axis, e.g. (ncells,) or (ntime, ncells) for a time series or (nmembers, ntime, ncells) for an ensemble
+        method : str
+            'levels' processes the cells level by level in topological order, updating all cells of a level (and all time steps) together. 'sparse' solves the lower-triangular system (I - D) acc = field, where D is the sparse adjacency matrix built once in topological order and reused. default: 'levels'
+
+        Returns
+        -------
+        acc : float (array)
+            accumulated field, same shape as field
+        """
+
+        field = np.asarray(field)
+        if field.shape[-1] != self.ncells:
+            raise ValueError(f'field must have ncells={self.ncells} on the last axis, got shape {field.shape}')
+
+        # put cells on the first axis so each cell's time series is contiguous
+        shape = field.shape
+        acc = np.array(np.moveaxis(field, -1, 0).reshape(self.ncells, -1),
+            dtype=np.result_type(field.dtype, np.float64))
+
+        if method == 'levels':
+            for isrc,idst,istart in self.levelroutes():
+                acc[idst] += np.add.reduceat(acc[isrc], istart, axis=0)
+        elif method == 'sparse':
+            from scipy.sparse.linalg import spsolve_triangular
+            order = self.order[0]
+            acc[order] = spsolve_triangular(self._routingmatrix(), acc[order], lower=True).reshape(acc[order].shape)
+        else:
+            raise ValueError(f"method must be 'levels' or 'sparse', got '{method}'")
+
+        return np.moveaxis(acc.reshape((self.ncells,) + shape[:-1]), 0, -1)
+
+    def _toposort(self):
+        # level-synchronous topological sort (Kahn's algorithm). each pass removes the cells with no remaining upstream cells
+        hasdown = self.idown >= 0
+        nup = np.bincount(self.idown[hasdown], minlength=self.ncells)
+        levels = np.full(self.ncells, -1, dtype=np.int64)
+
+        frontier = np.flatnonzero(nup == 0)
+        level = 0
+        while len(frontier):
+            levels[frontier] = level
+            idn = self.idown[frontier]
+            idn = idn[idn >= 0]
+            idn,count = np.unique(idn, return_counts=True)
+            nup[idn] -= count
+            frontier = idn[nup[idn] == 0]
+            level += 1
+
+        if np.any(levels < 0):
+            raise ValueError('flow network has cycles')
+
+        self._levels = levels
+        self._order = np.argsort(levels, kind='stable')
+        self._levelptr = np.searchsorted(levels[self._order], np.arange(level + 1))
+
+    def levelroutes(self):
+
+        """
+        routing schedule of the network, one step per level from upstream to downstream
+
+        Each step moves values from the cells of one level to their downstream cells with a segment reduction, e.g. acc[idst] += np.add.reduceat(acc[isrc], istart). The schedule is built once and cached.
+
+        Returns
+        -------
+        routes : tuple (list)
+            (isrc, idst, istart) of each level with cells that drain to another cell. isrc (int array) is the cells of the level that have a downstream cell, sorted by that cell; idst (int array) is the unique downstream cells; istart (int array) is the start of each downstream cell's segment in isrc
+        """
+
+        if not hasattr(self, '_routes'):
+            order,levelptr = self.order
+            self._routes = []
+            for i1,i2 in zip(levelptr[:-1], levelptr[1:]):
+                isrc = order[i1:i2]
+                isrc = isrc[self.idown[isrc] >= 0]
+                if len(isrc) == 0:
+                    continue
+                isrc = isrc[np.argsort(self.idown[isrc], kind='stable')]
+                idst,istart = np.unique(self.idown[isrc], return_index=True)
+                self._routes.append((isrc,idst,istart))
+        return self._routes
+
+    def _routingmatrix(self):
+        # (I - D) in topological order, where D[i,j] = 1 if cell j drains to cell i. downstream cells come after their upstream cells, so the matrix is lower triangular
+        if not hasattr(self, '_routing'):
+            from scipy.sparse import csr_matrix, identity
+            order = self.order[0]
+            rank = np.empty(self.ncells, dtype=np.int64)
+            rank[order] = np.arange(self.ncells)
+            isrc = np.flatnonzero(self.idown >= 0)
+            D = csr_matrix((np.ones(len(isrc)), (rank[self.idown[isrc]], rank[isrc])),
+                shape=(self.ncells, self.ncells))
+            self._routing = (identity(self.ncells, format='csr') - D).tocsr()
+        return self._routing
+
+    def downstream(self,ipoints):
+
+        """
+        find the indices of all cells downstream of each point, walking all points together one step at a time
+
+        Parameters
+        ----------
+        ipoints : int (list) | logical (list)
+            indices of the points of interest, or a boolean array that is true for them
+
+        Returns
+        -------
+        indptr : int (array)
+            row pointer into i_downstream, length npoints+1
+        i_downstream : int (array)
+            indices of the cells downstream of each point, in flow order, where the cells below point i are i_downstream[indptr[i]:indptr[i+1]]. the outlet is included, the point itself is not
+        """
+
+        ipoints = self._asindex(ipoints)
+
+        # count the path lengths first so the output can be filled in place
+        npath = np.zeros(len(ipoints), dtype=np.int64)
+        idn = self.idown[ipoints]
+        active = np.flatnonzero(idn >= 0)
+        while len(active):
+            npath[active] += 1
+            idn[active] = self.idown[idn[active]]
+            active = active[idn[active] >= 0]
+
+        indptr = np.concatenate(([0], np.cumsum(npath)))
+        i_downstream = np.empty(indptr[-1], dtype=self.idown.dtype)
+
+        idn = self.idown[ipoints]
+        active = np.flatnonzero(idn >= 0)
+        step = 0
+        while len(active):
+            i_downstream[indptr[active] + step] = idn[active]
+            idn[active] = self.idown[idn[active]]
+            active = active[idn[active] >= 0]
+            step += 1
+
+        return indptr,i_downstream
+
+    def upstream(self,ipoints):
+
+        """
+        find the indices of all cells upstream of each point, searching all points together one level of tributaries at a time
+
+        Parameters
+        ----------
+        ipoints : int (list) | logical (list)
+            indices of the points of interest, or a boolean array that is true for them
+
+        Returns
+        -------
+        indptr : int (array)
+            row pointer into i_upstream, length npoints+1
+        i_upstream : int (array)
+            indices of the cells upstream of each point (sorted), where the cells above point i are i_upstream[indptr[i]:indptr[i+1]]. the point itself is not included
+        """
+
+        ipoints = self._asindex(ipoints)
+        upptr,iup = self._upstreamcells()
+
+        # (point, cell) pairs on the current search front, starting with the points themselves
+        ipoint = np.arange(len(ipoints))
+        icell = ipoints
+        found_point = []
+        found_cell = []
+        while len(icell):
+            # replace each front cell by the cells that drain directly to it
+            nup = upptr[icell + 1] - upptr[icell]
+            ipoint = np.repeat(ipoint, nup)
+            icell = iup[np.repeat(upptr[icell] - np.cumsum(nup) + nup, nup) + np.arange(nup.sum())]
+            found_point.append(ipoint)
+            found_cell.append(icell)
+
+        ipoint = np.concatenate(found_point) if found_point else np.empty(0, dtype=np.int64)
+        icell = np.concatenate(found_cell) if found_cell else np.empty(0, dtype=np.int64)
+        isort = np.lexsort((icell, ipoint))
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(ipoint, minlength=len(ipoints)))))
+        return indptr,icell[isort]
+
+    def _upstreamcells(self):
+        # ragged (indptr, indices) of the cells that drain directly to each cell
+        if not hasattr(self, '_upstream'):
+            isrc = np.flatnonzero(self.idown >= 0)
+            isrc = isrc[np.argsort(self.idown[isrc], kind='stable')]
+            upptr = np.concatenate(([0], np.cumsum(np.bincount(self.idown[isrc], minlength=self.ncells))))
+            self._upstream = (upptr,isrc)
+        return self._upstream
+
+    def _asindex(self,ipoints):
+        ipoints = np.asarray(ipoints)
+        if ipoints.dtype == bool:
+            return np.flatnonzero(ipoints)
+        return ipoints.astype(np.int64).ravel()
+
+
+def syntheticNetwork(ncells,noutlets=1,window=None,seed=None):
+
+    """
+    random tree ID/dnID network for testing and benchmarks
+
+    Each cell drains to a random cell among the `window` cells created before it, so the longest flow path grows like ncells/window. The default window of sqrt(ncells) gives paths of order sqrt(ncells) cells, like a river network on a 2d mesh. The cells are returned in random order, like a hexwatershed mesh.
+
+    Parameters
+    ----------
+    ncells : int (scalar)
+        number of cells
+    noutlets : int (scalar)
+        number of independent basins (outlets). default: 1
+    window : int (scalar)
+        see above. default: sqrt(ncells)
+    seed : int (scalar)
+        random seed. default: None
+
+    Returns
+    -------
+    ID : int (array)
+        cell ID from 1->ncells
+    dnID : int (array)
+        downstream cell ID for each ID, -9999 for outlets (IDtype='mosart')
+    """
+
+    rng = np.random.default_rng(seed)
+    window = max(1, int(np.sqrt(ncells))) if window is None else window
+
+    # cell i drains to cell i - k, 1 <= k <= window. cells that would drain past a basin's first cell become that basin's outlet
+    ibasin = np.sort(rng.integers(0, noutlets, ncells))
+    ifirst = np.searchsorted(ibasin, ibasin)
+    cell = np.arange(ncells)
+    idown = cell - rng.integers(1, window + 1, ncells)
+    idown = np.where(idown < ifirst, ifirst, idown)
+    idown[cell == ifirst] = -1
+
+    # shuffle the cell order
+    perm = rng.permutation(ncells)
+    rank = np.empty(ncells, dtype=np.int64)
+    rank[perm] = cell
+    idown = idown[perm]
+    idown = np.where(idown >= 0, rank[np.maximum(idown, 0)], -1)
+
+    ID = cell + 1
+    dnID = np.where(idown >= 0, idown + 1, OUTLETS['mosart'])
+    return ID,dnID
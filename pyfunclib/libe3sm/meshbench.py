@@ -0,0 +1,245 @@
+"""
+meshbench.py
+Desc: synthetic hexagonal river meshes, and a scaling benchmark of the meshutils entry points on them
+
+The synthetic meshes stand in for hexwatershed meshes: hexagonal cells on a rectangular patch, a random-tree river network that drains every cell to one outlet on the boundary, elevations that increase upstream, random dams and a basin boundary. They need nothing but numpy, shapely and geopandas, so performance can be measured without real mesh files.
+
+Usage
+-----
+python -m pyfunclib.libe3sm.meshbench --ncells 1000 10000 100000 --output results.json
+
+The default sizes stop at 10**6 cells. A synthetic mesh takes about 1.2 GB per 10**6 cells (mostly the shapely hexagons), so 10**7 cells needs about 12 GB and is only run when asked for (--ncells 10000000).
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+import numpy as np
+
+from pyfunclib.libe3sm.flownetwork import OUTLETS
+
+
+def syntheticHexMesh(ncells,ndams=100,size=1.0,seed=None):
+
+    """
+    synthetic hexagonal mesh with a random-tree river network
+
+    The cells are pointy-top hexagons in offset rows on a near-square patch. The network is grown breadth first from an outlet cell on the bottom edge, each cell draining to a random neighbour one step closer to the outlet, so the flow paths follow the mesh like a river network. The elevation of each cell is its flow distance to the outlet plus noise (elevations always increase upstream). The cells are returned in random order, like a hexwatershed mesh.
+
+    Parameters
+    ----------
+    ncells : int (scalar)
+        approximate number of cells (rounded to whole rows)
+    ndams : int (scalar)
+        number of dams, placed at random cells. default: 100
+    size : float (scalar)
+        hexagon circumradius (centre to vertex). default: 1.0
+    seed : int (scalar)
+        random seed. default: None
+
+    Returns
+    -------
+    Mesh : GeoDataFrame
+        hexagon Polygons with ID (1->ncells), dnID (-9999 for the outlet) and Elevation
+    Dams : GeoDataFrame
+        dam Points, each within its cell, with the index of that cell (iMesh)
+    Mask : GeoDataFrame
+        basin boundary LineString, a rectangle around the inner 90% of the mesh
+    globalID : int (array)
+        global cell ID of each cell (not equal to ID)
+    """
+
+    import shapely
+    import geopandas as gpd
+
+    rng = np.random.default_rng(seed)
+    ncols = max(2, int(round(np.sqrt(ncells))))
+    nrows = max(2, int(round(ncells / ncols)))
+    n = nrows * ncols
+    row,col = np.divmod(np.arange(n), ncols)
+
+    # hexagon centres, odd rows shifted half a cell to the right
+    width = np.sqrt(3) * size
+    x = (col + 0.5 * (row % 2)) * width
+    y = row * 1.5 * size
+
+    # the six neighbours of each cell, -1 off the mesh
+    odd = row % 2
+    nbrow = row[:,None] + np.array([0, 0, -1, -1, 1, 1])
+    nbcol = col[:,None] + np.column_stack((-np.ones(n, dtype=int), np.ones(n, dtype=int),
+        odd - 1, odd, odd - 1, odd))
+    onmesh = (nbrow >= 0) & (nbrow < nrows) & (nbcol >= 0) & (nbcol < ncols)
+    neighbours = np.where(onmesh, nbrow * ncols + nbcol, -1)
+
+    # grow the network breadth first from the outlet. each new cell picks a random neighbour on the frontier as its downstream cell
+    idown = np.full(n, -2)
+    distance = np.zeros(n)
+    outlet = ncols // 2
+    idown[outlet] = -1
+    frontier = np.array([outlet])
+    step = 0
+    while len(frontier):
+        step += 1
+        isrc = np.repeat(frontier, 6)
+        idst = neighbours[frontier].reshape(-1)
+        new = idst >= 0
+        new[new] = idown[idst[new]] == -2
+        isrc,idst = isrc[new],idst[new]
+        # random order, then keep the first appearance of each new cell
+        shuffle = rng.permutation(len(idst))
+        idst,ifirst = np.unique(idst[shuffle], return_index=True)
+        idown[idst] = isrc[shuffle][ifirst]
+        distance[idst] = step
+        frontier = idst
+    elevation = distance * size + rng.random(n) * 0.5 * size
+
+    # shuffle the cell order
+    perm = rng.permutation(n)
+    rank = np.empty(n, dtype=np.int64)
+    rank[perm] = np.arange(n)
+    idown = idown[perm]
+    ID = np.arange(n) + 1
+    dnID = np.where(idown >= 0, rank[np.maximum(idown, 0)] + 1, OUTLETS['mosart'])
+    x,y,elevation = x[perm],y[perm],elevation[perm]
+
+    angles = np.pi / 6 + np.arange(7) * np.pi / 3
+    vertices = np.stack((x[:,None] + size * np.cos(angles), y[:,None] + size * np.sin(angles)), axis=-1)
+    Mesh = gpd.GeoDataFrame({'ID': ID, 'dnID': dnID, 'Elevation': elevation}, geometry=shapely.polygons(vertices))
+
+    idams = rng.choice(n, min(ndams, n), replace=False)
+    offset = (rng.random((len(idams), 2)) - 0.5) * 0.5 * size
+    Dams = gpd.GeoDataFrame({'iMesh': idams}, geometry=shapely.points(x[idams] + offset[:,0], y[idams] + offset[:,1]))
+
+    xmin,xmax,ymin,ymax = x.min(),x.max(),y.min(),y.max()
+    dx,dy = 0.05 * (xmax - xmin),0.05 * (ymax - ymin)
+    Mask = gpd.GeoDataFrame(geometry=[shapely.LineString(shapely.box(xmin + dx, ymin + dy, xmax - dx, ymax - dy).exterior.coords)])
+
+    globalID = ID * 10 + 3
+    return Mesh,Dams,Mask,globalID
+
+
+def writeMeshJSON(filename,ID,dnID):
+
+    """
+    write an ID/dnID network as a minimal hexwatershed json file (lCellID and lCellID_downslope of each cell), for meshjson_dnID
+    """
+
+    # hexwatershed cell IDs are not 1->ncells, so offset them
+    lCellID = np.asarray(ID) + 100
+    lCellID_downslope = np.where(np.asarray(dnID) == OUTLETS['mosart'], OUTLETS['hexwatershed'], np.asarray(dnID) + 100)
+    with open(filename, 'w') as f:
+        json.dump([{'lCellID': int(i), 'lCellID_downslope': int(j)} for i,j in zip(lCellID, lCellID_downslope)], f)
+
+
+def benchmark(ncells=(10**3,10**4,10**5,10**6),ndams=100,searchradius=3.0,maxcells=None,memory=True,seed=0,tmpdir=None):
+
+    """
+    time meshjson_dnID, findDownstreamCells and makeDamDependency on synthetic meshes of increasing size
+
+    Each entry point is timed on its own, then (if memory is True) run again under tracemalloc to record its peak memory, so the tracing does not slow down the timed run.
+
+    Parameters
+    ----------
+    ncells : int (list)
+        mesh sizes
+    ndams : int (scalar)
+        number of dams. default: 100
+    searchradius : float (scalar)
+        dependent cell search radius, in cell circumradii. default: 3.0
+    maxcells : dict
+        optional cap on the mesh size of some entry points, e.g. {'makeDamDependency': 10**6}. larger meshes skip them. default: None (run every entry point at every size)
+    memory : bool
+        record peak memory. default: True
+    seed : int (scalar)
+        random seed. default: 0
+    tmpdir : str
+        directory for the hexwatershed json file read by meshjson_dnID. default: None (system temporary directory)
+
+    Returns
+    -------
+    results : dict (list)
+        one dict per mesh size and entry point with ncells, ndams, function, seconds, peak_mb (None if memory is False) and error (None unless the entry point raised)
+    """
+
+    import tempfile
+    from pyfunclib.libe3sm import meshutils
+
+    results = []
+    for n in ncells:
+        Mesh,Dams,Mask,globalID = syntheticHexMesh(n,ndams,seed=seed)
+        ID,dnID = np.array(Mesh['ID']),np.array(Mesh['dnID'])
+        idams = np.array(Dams['iMesh'])
+
+        with tempfile.TemporaryDirectory(dir=tmpdir) as tmp:
+            jsonfile = os.path.join(tmp, 'hexwatershed.json')
+            functions = {
+                'meshjson_dnID': lambda: meshutils.meshjson_dnID(jsonfile),
+                'findDownstreamCells': lambda: meshutils.findDownstreamCells(ID,dnID,idams),
+                'makeDamDependency': lambda: meshutils.makeDamDependency(Dams.copy(),Mesh.copy(),searchradius,globalID,Mask),
+            }
+            if maxcells is not None:
+                functions = {name: function for name,function in functions.items() if len(Mesh) <= maxcells.get(name, np.inf)}
+            if 'meshjson_dnID' in functions:
+                writeMeshJSON(jsonfile,ID,dnID)
+
+            for name,function in functions.items():
+                results.append(dict(ncells=len(Mesh), ndams=len(Dams), function=name, **_measure(function,memory)))
+    return results
+
+
+def writeResults(results,filename):
+
+    """
+    write benchmark results to a .json or .csv file
+    """
+
+    if str(filename).endswith('.csv'):
+        import csv
+        with open(filename, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=list(results[0]))
+            writer.writeheader()
+            writer.writerows(results)
+    else:
+        with open(filename, 'w') as f:
+            json.dump(results, f, indent=1)
+
+
+def _measure(function,memory):
+    try:
+        t0 = time.perf_counter()
+        function()
+        seconds = time.perf_counter() - t0
+        peak = None
+        if memory:
+            tracemalloc.start()
+            try:
+                function()
+                peak = tracemalloc.get_traced_memory()[1] / 2**20
+            finally:
+                tracemalloc.stop()
+    except Exception as err:
+        return dict(seconds=None, peak_mb=None, error=f'{type(err).__name__}: {err}')
+    return dict(seconds=seconds, peak_mb=peak, error=None)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='scaling benchmark of the meshutils entry points on synthetic hexagonal meshes')
+    parser.add_argument('--ncells', type=int, nargs='+', default=[10**3, 10**4, 10**5, 10**6], help='mesh sizes')
+    parser.add_argument('--ndams', type=int, default=100, help='number of dams')
+    parser.add_argument('--no-memory', action='store_true', help='do not record peak memory')
+    parser.add_argument('--output', default=None, help='.json or .csv results file (default: print the results)')
+    args = parser.parse_args(argv)
+
+    results = benchmark(args.ncells,args.ndams,memory=not args.no_memory)
+    if args.output is None:
+        for result in results:
+            print(result)
+    else:
+        writeResults(results,args.output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,98 @@
+"""
+meshcache.py
+Desc: on-disk cache of the mesh centroids, kdtree and basin-mask membership used by the meshutils dam dependency functions
+"""
+
+import os
+import pickle
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+# bump this if the cached content or its layout changes
+CACHE_VERSION = 1
+
+DEFAULT_CACHEDIR = os.path.join(os.path.expanduser('~'), '.cache', 'pyfunclib', 'meshcache')
+
+
+def meshIndexKey(Mesh,xymask,geographic=False):
+
+    """
+    content hash of the mesh geometry and the basin boundary
+
+    Parameters
+    ----------
+    Mesh : GeoDataFrame
+        Polygons representing mesh created by pyhexwatershed.
+    xymask : float (array)
+        coordinates of the basin boundary
+    geographic : bool
+        whether the kdtree is built on unit-sphere coordinates, which changes what is cached
+
+    Returns
+    -------
+    key : str
+        hex digest that changes if any mesh or boundary vertex changes
+    """
+
+    import shapely
+
+    # hash the vertices (and which polygon they belong to) rather than the centroids, so the key is cheaper than what it caches
+    xy,ipoly = shapely.get_coordinates(np.asarray(Mesh.geometry), return_index=True)
+
+    sha = hashlib.sha1()
+    sha.update(f'{CACHE_VERSION} {bool(geographic)}'.encode())
+    for a in (xy, ipoly, np.asarray(xymask, dtype=np.float64)):
+        a = np.ascontiguousarray(a)
+        sha.update(str(a.shape).encode())
+        sha.update(a.tobytes())
+    return sha.hexdigest()
+
+
+def loadMeshIndex(key,cachedir=DEFAULT_CACHEDIR):
+
+    """
+    load the cached mesh centroids, kdtree and mask membership for key
+
+    Returns
+    -------
+    xymesh, meshTree, inmask, or None if key is not in the cache
+    """
+
+    path = os.path.join(cachedir, key)
+    try:
+        xymesh = np.load(os.path.join(path, 'xymesh.npy'))
+        inmask = np.load(os.path.join(path, 'inmask.npy'))
+        with open(os.path.join(path, 'meshtree.pkl'), 'rb') as f:
+            meshTree = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        return None
+    return xymesh,meshTree,inmask
+
+
+def saveMeshIndex(key,xymesh,meshTree,inmask,cachedir=DEFAULT_CACHEDIR):
+
+    """
+    save the mesh centroids, kdtree and mask membership under key
+
+    The files are written to a temporary directory which is then renamed, so concurrent runs never read a partial entry.
+    """
+
+    os.makedirs(cachedir, exist_ok=True)
+    path = os.path.join(cachedir, key)
+    tmppath = tempfile.mkdtemp(dir=cachedir, prefix='.' + key)
+    try:
+        np.save(os.path.join(tmppath, 'xymesh.npy'), xymesh)
+        np.save(os.path.join(tmppath, 'inmask.npy'), inmask)
+        with open(os.path.join(tmppath, 'meshtree.pkl'), 'wb') as f:
+            pickle.dump(meshTree, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.rename(tmppath, path)
+    except OSError:
+        # another run saved the same key first
+        shutil.rmtree(tmppath, ignore_errors=True)
+
+
+def clearMeshCache(cachedir=DEFAULT_CACHEDIR):
+    """ delete all cached mesh indexes """
+    shutil.rmtree(cachedir, ignore_errors=True)
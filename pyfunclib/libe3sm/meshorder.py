@@ -0,0 +1,201 @@
+"""
+meshorder.py
+Desc: space-filling-curve (Hilbert or Morton) ordering of mesh cells
+
+The cell order in hexwatershed json files and mesh GeoDataFrames is arbitrary, so gathers like zmesh[inearby] or Mesh.iloc[iquery] and kdtree leaf accesses jump randomly through memory. Sorting the cells along a space-filling curve puts nearby cells next to each other in memory.
+"""
+
+import time
+import numpy as np
+
+from pyfunclib.libe3sm.flownetwork import OUTLETS
+
+
+def hilbertIndex(xy,bits=16):
+
+    """
+    position of each point along a 2d Hilbert curve
+
+    Parameters
+    ----------
+    xy : float (array)
+        npoints x 2 array of coordinates
+    bits : int (scalar)
+        resolution of the curve, 2**bits cells per axis over the bounding box of xy. default: 16
+
+    Returns
+    -------
+    d : int (array)
+        Hilbert index of each point
+    """
+
+    x,y = _quantize(xy,bits)
+    n = np.int64(1) << bits
+    d = np.zeros(len(x), dtype=np.int64)
+    s = n >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        d += s * s * ((3 * rx.astype(np.int64)) ^ ry.astype(np.int64))
+        # rotate the quadrant so the curve is continuous
+        flip = ~ry & rx
+        x = np.where(flip, n - 1 - x, x)
+        y = np.where(flip, n - 1 - y, y)
+        x,y = np.where(ry, x, y),np.where(ry, y, x)
+        s >>= 1
+    return d
+
+
+def mortonIndex(xy,bits=16):
+
+    """
+    position of each point along a 2d Morton (z-order) curve, see hilbertIndex
+    """
+
+    x,y = _quantize(xy,bits)
+    return _spread(x) | (_spread(y) << 1)
+
+
+class MeshOrder:
+
+    """
+    permutation of mesh cells with its reverse map
+
+    Parameters
+    ----------
+    perm : int (array)
+        perm[i] is the original index of the cell at position i in the new order
+
+    Example
+    -------
+    order = MeshOrder.hilbert(xymesh)
+    Mesh = order.mesh(Mesh)                 # reordered rows, ID/dnID renumbered
+    globalID = order.apply(globalID)
+    ... run the analysis on the reordered mesh ...
+    zout = order.restore(zout)              # back to the original cell order
+    iorig = order.original(i_DependentCells)
+    """
+
+    def __init__(self,perm):
+        self.perm = np.asarray(perm, dtype=np.int64)
+        self.inverse = np.empty_like(self.perm)
+        self.inverse[self.perm] = np.arange(len(self.perm))
+
+    @classmethod
+    def hilbert(cls,xy,bits=16):
+        """ order the cells along a Hilbert curve through their centroids """
+        return cls(np.argsort(hilbertIndex(xy,bits), kind='stable'))
+
+    @classmethod
+    def morton(cls,xy,bits=16):
+        """ order the cells along a Morton curve through their centroids """
+        return cls(np.argsort(mortonIndex(xy,bits), kind='stable'))
+
+    def apply(self,a,axis=0):
+        """ reorder an array aligned with the original cells """
+        return np.take(np.asarray(a), self.perm, axis=axis)
+
+    def restore(self,a,axis=0):
+        """ put an array aligned with the reordered cells back in the original order """
+        return np.take(np.asarray(a), self.inverse, axis=axis)
+
+    def reordered(self,i):
+        """ map original cell indices to indices in the new order """
+        return self.inverse[np.asarray(i)]
+
+    def original(self,i):
+        """ map cell indices in the new order back to original indices """
+        return self.perm[np.asarray(i)]
+
+    def network(self,ID,dnID,IDtype='mosart'):
+
+        """
+        reorder an ID/dnID network and renumber it so ID runs from 1->ncells in the new order
+
+        Returns
+        -------
+        ID : int (array)
+            new cell IDs, 1->ncells
+        dnID : int (array)
+            downstream cell ID for each new ID. outlets (and dnIDs not in ID) keep the outlet value for IDtype
+        """
+
+        from pyfunclib.libe3sm.flownetwork import FlowNetwork
+        idown = FlowNetwork(ID,dnID,IDtype).idown[self.perm]
+        outlet = OUTLETS[IDtype]
+        newID = np.arange(len(self.perm)) + 1
+        newdnID = np.where(idown >= 0, self.inverse[np.maximum(idown, 0)] + 1, outlet)
+        return newID,newdnID
+
+    def mesh(self,Mesh,IDtype='mosart'):
+        """ reorder the rows of a mesh GeoDataFrame, and renumber its ID/dnID columns if it has them """
+        Mesh = Mesh.iloc[self.perm].reset_index(drop=True)
+        if 'ID' in Mesh and 'dnID' in Mesh:
+            Mesh['ID'],Mesh['dnID'] = self.network(np.array(Mesh['ID']),np.array(Mesh['dnID']),IDtype)
+        return Mesh
+
+
+def _quantize(xy,bits):
+    xy = np.asarray(xy, dtype=np.float64)
+    lo = xy.min(axis=0)
+    span = np.maximum(xy.max(axis=0) - lo, np.finfo(np.float64).tiny)
+    ixy = ((xy - lo) / span * ((1 << bits) - 1)).astype(np.int64)
+    return ixy[:,0],ixy[:,1]
+
+
+def _spread(v):
+    # spread the low 32 bits of v to the even bits of a 64 bit integer
+    v = v.astype(np.uint64) & np.uint64(0xFFFFFFFF)
+    for shift,mask in ((16, 0x0000FFFF0000FFFF), (8, 0x00FF00FF00FF00FF),
+                       (4, 0x0F0F0F0F0F0F0F0F), (2, 0x3333333333333333), (1, 0x5555555555555555)):
+        v = (v | (v << np.uint64(shift))) & np.uint64(mask)
+    return v.astype(np.int64)
+
+
+def benchmark(ncells=(10**5,10**6),nquery=20000,searchradius=None,seed=0):
+
+    """
+    compare kdtree neighbour searches and gathers on randomly ordered cells against Hilbert and Morton ordered cells
+
+    The cells are random points in the unit square. For each order, the benchmark times the kdtree build, a batched query_ball_point over nquery cells, and the gather of a cell field at all neighbours (like zmesh[inearby] in findDependentCells). It also reports the mean index distance between neighbouring cells, a direct measure of locality.
+
+    Returns
+    -------
+    results : dict (list)
+        one dict per size and order with ncells, order, build, query, gather (seconds) and index_distance
+    """
+
+    from scipy.spatial import KDTree
+
+    rng = np.random.default_rng(seed)
+    results = []
+    for n in ncells:
+        xy = rng.random((n, 2))
+        z = rng.random(n)
+        r = 3.0 / np.sqrt(n) if searchradius is None else searchradius
+        iquery = rng.choice(n, min(nquery, n), replace=False)
+        orders = {'random': MeshOrder(np.arange(n)), 'hilbert': MeshOrder.hilbert(xy), 'morton': MeshOrder.morton(xy)}
+        for name,order in orders.items():
+            xyo,zo = order.apply(xy),order.apply(z)
+            # query the same cells in each order, visited in the new memory order
+            iq = np.sort(order.reordered(iquery))
+
+            t0 = time.perf_counter()
+            tree = KDTree(xyo)
+            t1 = time.perf_counter()
+            inearby = tree.query_ball_point(xyo[iq], r, workers=-1)
+            t2 = time.perf_counter()
+            nnearby = np.fromiter(map(len, inearby), dtype=np.int64, count=len(inearby))
+            inearby = np.concatenate(inearby).astype(np.int64)
+            t3 = time.perf_counter()
+            zo[inearby].sum()
+            t4 = time.perf_counter()
+
+            results.append(dict(ncells=n, order=name, build=t1 - t0, query=t2 - t1, gather=t4 - t3,
+                index_distance=float(np.mean(np.abs(inearby - np.repeat(iq, nnearby))))))
+    return results
+
+
+if __name__ == '__main__':
+    for result in benchmark():
+        print(result)
@@ -0,0 +1,235 @@
+"""
+meshserver.py
+Desc: long-lived local server that keeps a loaded mesh network in memory, and a client to query it
+
+Loading and indexing a continental mesh takes minutes, but the queries take seconds. The server loads the mesh, kdtree and flow network once (as a DamDependencyIndex) and answers batched downstream, upstream and dependency queries from many processes over a Unix socket or localhost TCP.
+
+Messages are an 8-byte little-endian header length, a JSON header, and the raw bytes of the arrays described in the header, so array payloads are never pickled or converted to text.
+
+Example
+-------
+# server process
+index = meshutils.DamDependencyIndex(Mesh,searchradius,globalID,Mask)
+meshserver.runServer(index,path='/tmp/mesh.sock')
+
+# any number of client processes
+with meshserver.MeshClient(path='/tmp/mesh.sock') as client:
+    indptr,i_downstream = client.downstream(ipoints)
+    indptr,ID_DependentCells = client.dependency(xydams)
+"""
+
+import json
+import socket
+import struct
+import asyncio
+import numpy as np
+
+_LENGTH = struct.Struct('<Q')
+
+
+# -----------------------------------------------------
+# message encoding
+# -----------------------------------------------------
+def _pack(header,arrays=()):
+    # header JSON with the dtype and shape of each array, followed by the array bytes
+    arrays = [np.ascontiguousarray(a) for a in arrays]
+    header = dict(header, arrays=[{'dtype': a.dtype.str, 'shape': a.shape} for a in arrays])
+    header = json.dumps(header).encode()
+    # byte views of the flattened arrays; memoryview.cast cannot cast arrays with a zero in their shape
+    return [_LENGTH.pack(len(header)), header] + [a.reshape(-1).view(np.uint8) for a in arrays]
+
+
+def _unpackarrays(header,payload):
+    arrays = []
+    offset = 0
+    for spec in header['arrays']:
+        dtype = np.dtype(spec['dtype'])
+        count = int(np.prod(spec['shape']))
+        arrays.append(np.frombuffer(payload, dtype=dtype, count=count, offset=offset).reshape(spec['shape']))
+        offset += count * dtype.itemsize
+    return arrays
+
+
+def _payloadsize(header):
+    return sum(int(np.prod(spec['shape'])) * np.dtype(spec['dtype']).itemsize for spec in header['arrays'])
+
+
+# -----------------------------------------------------
+# server
+# -----------------------------------------------------
+class MeshServer:
+
+    """
+    answer downstream, upstream and dependency queries against one DamDependencyIndex
+
+    Parameters
+    ----------
+    index : DamDependencyIndex
+        loaded mesh index (see meshutils.DamDependencyIndex)
+    """
+
+    def __init__(self,index):
+        self.index = index
+        self.ops = {
+            'ping': self.ping,
+            'downstream': self.downstream,
+            'upstream': self.upstream,
+            'dependency': self.dependency,
+        }
+
+    def ping(self):
+        return {'ncells': int(len(self.index.xymesh))},[]
+
+    def downstream(self,ipoints):
+        return {},list(self.index.network.downstream(ipoints))
+
+    def upstream(self,ipoints):
+        return {},list(self.index.network.upstream(ipoints))
+
+    def dependency(self,xydams,output='ragged'):
+        from pyfunclib.libe3sm.meshutils import _dependencyOutput
+        imeshdams,downstream,(indptr,i_dependent) = self.index.query(xydams)
+        if output == 'indices':
+            return {},[imeshdams,indptr,i_dependent]
+        indptr,ID_DependentCells = _dependencyOutput(indptr,i_dependent,
+            self.index.globalID,len(self.index.xymesh),'ragged')
+        return {},[imeshdams,indptr,ID_DependentCells]
+
+    async def handle(self,reader,writer):
+        # one connection, any number of requests. queries run in a worker thread so the event loop keeps serving other clients
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                try:
+                    nheader = _LENGTH.unpack(await reader.readexactly(_LENGTH.size))[0]
+                except asyncio.IncompleteReadError:
+                    break
+                header = json.loads(await reader.readexactly(nheader))
+                arrays = _unpackarrays(header, await reader.readexactly(_payloadsize(header)))
+                try:
+                    op = self.ops[header['op']]
+                    result,outarrays = await loop.run_in_executor(None,
+                        lambda: op(*arrays, **header.get('kwargs', {})))
+                    response = _pack(dict(result, ok=True), outarrays)
+                except Exception as err:
+                    response = _pack({'ok': False, 'error': f'{type(err).__name__}: {err}'})
+                writer.writelines(response)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    async def serve(self,path=None,host='127.0.0.1',port=0):
+        """ serve forever on a Unix socket at path, or on host:port if path is None """
+        if path is not None:
+            server = await asyncio.start_unix_server(self.handle, path=path)
+        else:
+            server = await asyncio.start_server(self.handle, host=host, port=port)
+        async with server:
+            await server.serve_forever()
+
+
+def runServer(index,path=None,host='127.0.0.1',port=0):
+
+    """
+    serve a loaded DamDependencyIndex until interrupted (blocking)
+
+    Parameters
+    ----------
+    index : DamDependencyIndex
+        loaded mesh index
+    path : str
+        Unix socket path. default: None (use TCP)
+    host : str
+        TCP host, only used if path is None. default: '127.0.0.1'
+    port : int (scalar)
+        TCP port, only used if path is None. default: 0 (any free port)
+    """
+
+    asyncio.run(MeshServer(index).serve(path,host,port))
+
+
+# -----------------------------------------------------
+# client
+# -----------------------------------------------------
+class MeshClient:
+
+    """
+    blocking client for a MeshServer
+
+    Parameters
+    ----------
+    path : str
+        Unix socket path of the server. default: None (use TCP)
+    host : str
+        TCP host, only used if path is None. default: '127.0.0.1'
+    port : int (scalar)
+        TCP port, only used if path is None
+    """
+
+    def __init__(self,path=None,host='127.0.0.1',port=None):
+        if path is not None:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(path)
+        else:
+            self.sock = socket.create_connection((host, port))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+    def close(self):
+        self.sock.close()
+
+    def ping(self):
+        """ number of mesh cells on the server """
+        return self._request('ping')[0]['ncells']
+
+    def downstream(self,ipoints):
+        """ ragged (indptr, indices) of the cells downstream of each point, see FlowNetwork.downstream """
+        return tuple(self._request('downstream', np.asarray(ipoints, dtype=np.int64))[1])
+
+    def upstream(self,ipoints):
+        """ ragged (indptr, indices) of the cells upstream of each point, see FlowNetwork.upstream """
+        return tuple(self._request('upstream', np.asarray(ipoints, dtype=np.int64))[1])
+
+    def dependency(self,xydams,output='ragged',return_imesh=False):
+
+        """
+        dependent cells of dams at the given locations
+
+        Parameters
+        ----------
+        xydams : float (array)
+            ndams x 2 array of dam coordinates
+        output : str
+            'ragged' returns (indptr, ID) with sorted cell IDs per dam, as makeDamDependency. 'indices' returns (indptr, indices) of mesh cell indices. default: 'ragged'
+        return_imesh : bool
+            also return the index of the mesh cell that contains each dam. default: False
+        """
+
+        xydams = np.asarray(xydams, dtype=np.float64).reshape(-1, 2)
+        imeshdams,indptr,dependent = self._request('dependency', xydams, output=output)[1]
+        if return_imesh:
+            return imeshdams,(indptr,dependent)
+        return indptr,dependent
+
+    def _request(self,op,*arrays,**kwargs):
+        self.sock.sendall(b''.join(bytes(part) for part in _pack({'op': op, 'kwargs': kwargs}, arrays)))
+        nheader = _LENGTH.unpack(self._recv(_LENGTH.size))[0]
+        header = json.loads(self._recv(nheader))
+        payload = self._recv(_payloadsize(header))
+        if not header['ok']:
+            raise RuntimeError(f"mesh server: {header['error']}")
+        return header,_unpackarrays(header,payload)
+
+    def _recv(self,nbytes):
+        buffer = bytearray(nbytes)
+        view = memoryview(buffer)
+        while len(view):
+            n = self.sock.recv_into(view)
+            if n == 0:
+                raise ConnectionError('mesh server closed the connection')
+            view = view[n:]
+        return buffer
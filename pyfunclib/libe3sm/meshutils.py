@@ -1,7 +1,10 @@
 import os
 import json
+import itertools
 import numpy as np
 
+from pyfunclib.libe3sm.flownetwork import FlowNetwork
+
 # try:
 #     from osgeo import ogr, osr
 # except:
@@ -13,6 +16,51 @@ import numpy as np
 # function definitions
 intvector = np.vectorize(np.int_)
 
+def _inttype(n):
+    # int32 for cell indices and IDs up to n, unless they need int64
+    return np.int32 if n < 2**31 else np.int64
+
+# mean earth radius (m)
+EARTH_RADIUS = 6371008.8
+
+# -----------------------------------------------------
+# -----------------------------------------------------
+def lonlat2xyz(lonlat):
+
+    """
+    convert lon/lat (degrees) to 3d coordinates on the unit sphere
+
+    The straight-line (chord) distance between two points on the unit sphere increases with their great-circle distance, so a kdtree built on these coordinates gives exact great-circle neighbour searches at all latitudes (see distance2chord).
+
+    Parameters
+    ----------
+    lonlat : float (array)
+        npoints x 2 array of longitude, latitude in degrees
+
+    Returns
+    -------
+    xyz : float (array)
+        npoints x 3 array of unit-sphere coordinates
+    """
+
+    lon,lat = np.radians(np.asarray(lonlat, dtype=np.float64)).T
+    coslat = np.cos(lat)
+    return np.column_stack((coslat * np.cos(lon), coslat * np.sin(lon), np.sin(lat)))
+
+
+def distance2chord(distance,radius=EARTH_RADIUS):
+
+    """
+    convert a great-circle distance (m) to the chord length between the two points on the unit sphere
+    """
+
+    return 2.0 * np.sin(np.minimum(np.asarray(distance) / radius, np.pi) / 2.0)
+
+
+def _treecoords(xy,geographic):
+    # coordinates that the mesh kdtree is built on
+    return lonlat2xyz(xy) if geographic else np.asarray(xy, dtype=np.float64)
+
 # -----------------------------------------------------
 # -----------------------------------------------------
 def meshjson_dnID(MeshJSONfile):
@@ -41,7 +89,6 @@ def meshjson_dnID(MeshJSONfile):
     # init lists
     ncell = len(Mesh)
     ID = np.arange(ncell) + 1 # start ID at 1 not 0
-    dnID = list()
     cellID = list()
     cellID_downslope = list()
 
@@ -51,18 +98,19 @@ def meshjson_dnID(MeshJSONfile):
         cellID_downslope.append(int(pcell['lCellID_downslope']))
 
     #convert to numpy array
-    ncell = len(cellID)
     cellID = np.array(cellID)
     cellID_downslope=np.array(cellID_downslope)
-    
-    for n in range(ncell):
-        if cellID_downslope[n] == -1:
-            dnID.append(-9999)
-        else:
-            index = int(np.where(cellID == cellID_downslope[n])[0])
-            dnID.append(index + 1)
-        
-    dnID = np.array(dnID)
+
+    # position of each downslope cell in the file, by one sorted lookup (as in FlowNetwork)
+    outlet = cellID_downslope == -1
+    isort = np.argsort(cellID, kind='stable')
+    index = np.searchsorted(cellID, cellID_downslope, sorter=isort)
+    index = isort[np.minimum(index, ncell - 1)]
+    missing = ~outlet & (cellID[index] != cellID_downslope)
+    if np.any(missing):
+        raise ValueError(f'lCellID_downslope {cellID_downslope[missing][:5]} not found in lCellID')
+
+    dnID = np.where(outlet, -9999, index + 1)
     return ID,dnID
 
 # started to make one that works with the Mesh geodataframe, but it isnt' needed for now
@@ -100,44 +148,17 @@ def findDownstreamCells(ID,dnID,ipoints,IDtype='mosart'):
     """
 
 
-    ncells = len(ipoints)
-
-    # locate the outlet cell from the global dn_ID
-    if IDtype == 'mosart':
-        ioutlet = intvector(np.where(dnID==-9999)[0])
-        # ioutlet = int(np.where(dnID==-9999)[0])
-    elif IDtype == 'hexwatershed':
-        ioutlet = intvector(np.where(dnID==-1)[0])
-        # ioutlet = int(np.where(dnID==-1)[0])
-
-    # init the outputs
-    ID_downstream = []
-    i_downstream = []
-
-    # loop over all points and find all downstream cells
-    for n in range(ncells):
-        # idn = ipoints[n] is the cell index that contains this point. ioutlet is the cell index of the outlet. trace down stream from each point until we hit the outlet, collecting the downstream IDs along the way
-        idn = ipoints[n]
-        dnID_n = []
-        dnidx_n = []
-        # while idn != ioutlet:
-        while idn not in ioutlet:
-            idn = int(np.where(ID==dnID[idn])[0])
-            dnID_n.append(int(dnID[idn]))
-            dnidx_n.append(idn)
-
-            # note: if ID goes from 0->ncells-1, then use this in place of the assignment above:
-            # idn = int(np.where(ID==dnID[idn])[0]) - 1 
-
-        # append these downstream cells to the list for this dam 
-        ID_downstream.append(dnID_n)
-        i_downstream.append(dnidx_n)
+    # walk all points down the network together. see FlowNetwork.downstream
+    network = FlowNetwork(ID,dnID,IDtype)
+    indptr,idx = network.downstream(ipoints)
+    i_downstream = [eachlist.tolist() for eachlist in np.split(idx, indptr[1:-1])]
+    ID_downstream = [eachlist.tolist() for eachlist in np.split(network.dnID[idx], indptr[1:-1])]
 
     return i_downstream,ID_downstream
 
 
 
-def makeDamDependency(Dams,Mesh,searchradius,globalID,Mask,FlowLine):
+def makeDamDependency(Dams,Mesh,searchradius,globalID,Mask,FlowLine=None,output='padded',useflowline=False,cachedir=None,geographic=False):
 
     """
     find dependent cell IDs for each dam (downstream mesh cells that depend on each dam)
@@ -149,18 +170,26 @@ def makeDamDependency(Dams,Mesh,searchradius,globalID,Mask,FlowLine):
     Mesh : GeoDataFrame
         Polygons representing mesh created by pyhexwatershed.
     searchradius : int (scalar)
-        horizontal search radius for KDTree algorithm (distance from flowline for dependent cell search)
+        horizontal search radius for KDTree algorithm (distance from flowline for dependent cell search), in the units of the mesh coordinates, or in metres if geographic is True
     globalID : int (list)
         list of cell IDs (assumes they begin at 1, not 0)
     Mask: GeoDataFrame
         LineString (should work if Polygon) representing basin boundary, used to omit mesh cells from dependent cell search
     FlowLine : GeoDataFrame
-        Vector flowline. Not required for the algorithm, need to make optional.
+        Vector flowline. Only used if useflowline is True. default: None
+    output : str
+        format of the returned dependent cells. 'padded' returns a uniform-sized float array padded with nan (one row per dam). 'ragged' returns an (indptr, ID) pair, an int64 row pointer and int32 IDs (int64 if the global IDs need it), where the IDs of dam i are ID[indptr[i]:indptr[i+1]]. 'csr' returns a boolean scipy.sparse.csr_matrix with shape (ndams, ncells) that is true for the dependent cells (columns are mesh cell indices, not IDs). use du.ragged2padded or du.csr2padded to convert 'ragged' or 'csr' to the padded form. default: 'padded'
+    useflowline : bool
+        if True, each dam is placed in the nearest mesh cell that contains a FlowLine vertex (see findCellsOnVectorFlowline) rather than the nearest mesh cell. default: False
+    cachedir : str
+        if given, the mesh centroids, kdtree and in-mask cells are loaded from (or saved to) a cache in this directory, keyed by a hash of the mesh and mask geometry. repeat runs on the same mesh and mask skip straight to the dam-specific work. use meshcache.DEFAULT_CACHEDIR for the default location. default: None (no cache)
+    geographic : bool
+        set True for lat/lon meshes. the kdtree is built on 3d unit-sphere coordinates (see lonlat2xyz) and searchradius (m) is converted to a chord length, so the search radius does not distort with latitude. default: False
 
     Returns
     -------
-    ID_DependentCells : int (list)
-        list of integers (sublists) representing the cell IDs of all downstream dependent cells for each dam in Dams
+    ID_DependentCells : float (array) | (int (array), int (array)) | csr_matrix
+        the cell IDs of all downstream dependent cells for each dam in Dams, in the format set by output. the IDs of each dam are sorted
     
     TODO: 
     IDtype : str
@@ -175,132 +204,406 @@ def makeDamDependency(Dams,Mesh,searchradius,globalID,Mask,FlowLine):
     Author: Matt Cooper (matt.cooper@pnnl.gov), 2023
     """
 
-    import inpoly.inpoly2 as inpoly
     from scipy.spatial import KDTree
-    from pyfunclib.libspatial import geoutils as gu
-    from pyfunclib.libdata import datautils as du
-
-    # Part 1: build the kdtree
-    # ------------------------
 
-    # add x/y centroid values to Mesh, for the kdtree
-    Mesh['X'] = Mesh.centroid.x
-    Mesh['Y'] = Mesh.centroid.y
-    Dams['X'] = Dams.geometry.x
-    Dams['Y'] = Dams.geometry.y
-
-    # build a kdtree for the mesh
-    meshTree = KDTree(Mesh[['X','Y']])
-
-    # Part 2: find mesh cells in the basin boundary
-    # ---------------------------------------------
-    xymesh = np.array(Mesh[['X','Y']]) # mesh cell centroids
-    xymask = gu.gdfcoordinatelist(Mask,flatten=False)[0] # boundary
-    inmask = np.where(inpoly(xymesh,xymask)[0])[0] # indices
-    # inmask = list(inpoly.inpoly2(xymesh,xymask)[0]) # boolean
+    # Part 1: build the kdtree and find mesh cells in the basin boundary
+    # ------------------------------------------------------------------
 
-    # convert to global ID:
-    inmask = np.array(globalID.iloc[inmask])
+    # both depend only on the mesh and the mask, see _meshIndex
+    xymesh,meshTree,inmask = _meshIndex(Mesh,Mask,cachedir,geographic)
 
-    # Part 3: find mesh cells that contain dams
+    # Part 2: find mesh cells that contain dams
     # -----------------------------------------
 
+    # add x/y values to Dams
+    Dams['X'] = Dams.geometry.x
+    Dams['Y'] = Dams.geometry.y
+    xydams = _treecoords(Dams[['X','Y']],geographic)
+
     # find the mesh cells that contain a dam by finding the Mesh (or MeshLine) cells nearest each dam. these are the starting points for the downstream walk to find the dependent cells for each dam
-    useflowline = False
     if useflowline is True:
-        MeshLine = findCellsOnVectorFlowline(FlowLine,Mesh,meshTree)
-        iflowlinedams = KDTree(MeshLine[['X','Y']]).query(Dams[['X','Y']])[1]
+        iLine,iMeshLine = findCellsOnVectorFlowline(FlowLine,meshTree,geographic=geographic)
+        iflowlinedams = KDTree(meshTree.data[iMeshLine]).query(xydams)[1]
         # transform iflowlinedams to the global mesh indices:
-        imeshdams = np.array(MeshLine['ID'].iloc[iflowlinedams])
+        imeshdams = iMeshLine[iflowlinedams]
     else:
-        imeshdams = meshTree.query(Dams[['X','Y']])[1]
+        imeshdams = meshTree.query(xydams)[1]
 
     # add the mesh cell info to the Dams gdf
     Dams['iMesh'] = imeshdams
 
-    # Part 4: find cells downstream of each dam
+    # Part 3: find cells downstream of each dam
     # -----------------------------------------
 
     Dams['i_DownstreamCells'],Dams['ID_DownstreamCells'] = findDownstreamCells(
         np.array(Mesh['ID']),np.array(Mesh['dnID']),imeshdams
         )
 
-    # Part 5: final prep for dependent cell search
+    # Part 4: final prep for dependent cell search
     # --------------------------------------------
 
     # get the mesh cell and dam elevations
     zdams = np.array(Mesh['Elevation'].iloc[imeshdams])
     zmesh = np.array(Mesh[['Elevation']]).flatten()
 
-    # Initialize the DependentCells. Two options: 
-    # 1) add an empty ID_DependentCells field to the Dams gdf, or 
-    # 2) store in a list (add to gdf outside this algo if necessary)
-
-    # Add to the gdf:
-    # Dams['ID_DependentCells'] = np.nan
-    # Dams['ID_DependentCells'] = Dams['ID_DependentCells'].astype(object)
-    
-    # Store in a list:
-    ID_DependentCells = []
-
     # -----------------
     # run the algorithm
     # -----------------
 
-    # starting at each dam, query the tree to find all mesh cells within rxy distance of the flowline below the dam
-    for idam,thisdam in Dams.iterrows():
+    # starting at each dam, query the tree to find all mesh cells within rxy distance of the flowline below the dam. the search is batched over all dams, see findDependentCells
+    if geographic:
+        searchradius = distance2chord(searchradius)
 
-        # use the elevation of the mesh cell that contains the dam as an elevation threshold
-        elev = zdams[idam]
+    indptr,i_DependentCells = findDependentCells(meshTree,meshTree.data,zmesh,inmask,
+        list(Dams['i_DownstreamCells']),zdams,searchradius)
 
-        # gather downstream cells for this dam. these are the query points for the kdtree, which finds all cells within rxy distance of these points 
-        iquery = Dams['i_DownstreamCells'].iloc[idam]
-        MeshQuery = Mesh.iloc[iquery]
+    # return a uniform-sized padded array, or the ragged/csr form
+    return _dependencyOutput(indptr,i_DependentCells,globalID,len(xymesh),output)
 
-        # find all cells within rxy distance of each cell in MeshQuery
-        inearby = []
-        for icell,thiscell in MeshQuery.iterrows():
-            xyquery = (thiscell['X'], thiscell['Y'])
-            idx = meshTree.query_ball_point(xyquery,searchradius)
-            inearby.extend(idx)
+    # If adding to the gdf:
+    # Dams['ID_DependentCells'] = du.ragged2list(*_dependencyOutput(indptr,i_DependentCells,globalID,len(xymesh),'ragged'))
+    # ID_DependentCells = du.padarray(Dams['ID_DependentCells'])
+    # ID_DependentCells = pd.DataFrame(list(Dams['ID_DependentCells'])).fillna(np.nan).values # if du not available
+    # return ID_DependentCells
 
-        # keep unique indices that are below elev and in bounds, and convert to globalID
-        inearby = np.unique(inearby)
-        inearby = globalID.iloc[inearby[np.where(zmesh[inearby] < elev)[0]]]
-        inearby = np.intersect1d(inearby,inmask)
-        
-        # save the cells for this dam
-        ID_DependentCells.append(inearby)
 
-        # this puts the Dependent Cells into the data frame (note: use iat to set one element of the gdf not iloc, otherwise we get the slice error)
-        # Dams['ID_DependentCells'].iat[idam] = inearby
+def _meshIndex(Mesh,Mask,cachedir=None,geographic=False):
+    # mesh cell centroids, the kdtree built on them (on the unit sphere if geographic), and the cells inside the basin boundary. these depend only on the mesh and the mask, not on the dams, so they can be cached on disk (see meshcache)
+    import inpoly.inpoly2 as inpoly
+    from scipy.spatial import KDTree
+    from pyfunclib.libspatial import geoutils as gu
+    from pyfunclib.libe3sm import meshcache
+
+    xymask = gu.gdfcoordinatelist(Mask,flatten=False)[0] # boundary
 
-        # for testing: du.list2file(list(inearby),'test.txt')
+    cached = None
+    if cachedir is not None:
+        key = meshcache.meshIndexKey(Mesh,xymask,geographic)
+        cached = meshcache.loadMeshIndex(key,cachedir)
 
-    # return a uniform-sized padded array
-    return du.padarray(ID_DependentCells)
+    if cached is None:
+        # build a kdtree for the mesh
+        xymesh = np.column_stack((Mesh.centroid.x, Mesh.centroid.y)) # mesh cell centroids
+        meshTree = KDTree(_treecoords(xymesh,geographic))
 
-    # If adding to the gdf:
-    # ID_DependentCells = du.padarray(Dams['ID_DependentCells'])
-    # ID_DependentCells = pd.DataFrame(list(Dams['ID_DependentCells'])).fillna(np.nan).values # if du not available
-    # return ID_DependentCells
+        # find mesh cells in the basin boundary
+        inmask = inpoly(xymesh,xymask)[0] # boolean
+
+        if cachedir is not None:
+            meshcache.saveMeshIndex(key,xymesh,meshTree,inmask,cachedir)
+    else:
+        xymesh,meshTree,inmask = cached
+
+    # add x/y centroid values to Mesh
+    Mesh['X'] = xymesh[:,0]
+    Mesh['Y'] = xymesh[:,1]
+
+    return xymesh,meshTree,inmask
+
+
+def _dependencyOutput(indptr,i_DependentCells,globalID,ncells,output):
+    # convert the ragged dependent cell indices from findDependentCells to the output format of makeDamDependency
+    from pyfunclib.libdata import datautils as du
+
+    if output == 'csr':
+        return du.ragged2csr(indptr,i_DependentCells,ncells)
+
+    # convert to global ID (sorted for each dam)
+    globalID = np.asarray(globalID)
+    ID_DependentCells = du.sortragged(indptr,globalID[i_DependentCells].astype(_inttype(np.max(globalID,initial=0))))
+
+    if output == 'ragged':
+        return indptr,ID_DependentCells
+    elif output == 'padded':
+        return du.ragged2padded(indptr,ID_DependentCells)
+    else:
+        raise ValueError(f"output must be 'padded', 'ragged' or 'csr', got '{output}'")
+
+
+# -----------------------------------------------------
+# -----------------------------------------------------
+def findDependentCells(meshTree,xymesh,zmesh,inmask,i_downstream,zdams,searchradius,maxpairs=2**22,workers=-1):
+
+    """
+    find dependent cell indices for each dam, batched over all dams
+
+    The kdtree is queried once for the unique set of downstream cells of all dams (in parallel), so cells shared by the downstream paths of many dams are only searched once. The per-dam elevation and in-mask filters are vectorized, and duplicates are removed per dam by sorting (dam, cell) pairs.
+
+    Parameters
+    ----------
+    meshTree : scipy.spatial.KDTree
+        kdtree built on the mesh cell centroids xymesh
+    xymesh : float (array)
+        ncells x ndim array of the mesh cell coordinates the kdtree was built on (meshTree.data)
+    zmesh : float (array)
+        elevation of each mesh cell
+    inmask : logical (array)
+        true for mesh cells inside the basin boundary
+    i_downstream : int (list) | (int (array), int (array))
+        list of integers (sublists) representing the indices of all cells downstream of each dam, as returned by findDownstreamCells, or the ragged (indptr, indices) tuple returned by FlowNetwork.downstream
+    zdams : float (array)
+        elevation threshold for each dam (elevation of the mesh cell that contains the dam)
+    searchradius : int (scalar)
+        horizontal search radius for the kdtree query
+    maxpairs : int (scalar)
+        number of (dam, cell) pairs expanded at once. dams are taken in chunks whose pairs fit within it (a dam with more pairs is expanded alone), which bounds the memory used by the pairs whatever the mesh resolution and search radius. default: 2**22
+    workers : int (scalar)
+        number of workers for the kdtree query. default: -1 (all cores)
+
+    Returns
+    -------
+    indptr : int (array)
+        row pointer into i_DependentCells, length ndams+1
+    i_DependentCells : int (array)
+        mesh cell indices of the dependent cells of all dams, where the (sorted) cells of dam i are i_DependentCells[indptr[i]:indptr[i+1]]
+    """
 
+    ndams = len(i_downstream)
+    zdams = np.asarray(zdams)
 
-def findCellsOnVectorFlowline(Line,Mesh,meshTree):
-    # find mesh cells that contain flowline vertices by finding the nearest mesh cell to each vertex of each line. this won't be necessary if an attribute in Mesh or Line indicates the mapping between them. note: for this query, we need iterrows() b/c each row of Line is a LineString with multiple vertices. 
-    imeshline = []
-    for iline,thisline in Line.iterrows():
-        dist,idx = meshTree.query(thisline.geometry.coords)
-        imeshline.append(idx)
+    # flatten the downstream cells of all dams, then find the unique cells. these are the query points
+    if isinstance(i_downstream, tuple):
+        ndams = len(i_downstream[0]) - 1
+        nquery = np.diff(i_downstream[0])
+        iquery = np.asarray(i_downstream[1], dtype=np.int64)
+    else:
+        nquery = np.fromiter(map(len, i_downstream), dtype=np.int64, count=ndams)
+        iquery = np.fromiter(itertools.chain.from_iterable(i_downstream), dtype=np.int64, count=nquery.sum())
+    iunique, iquery = np.unique(iquery, return_inverse=True)
+    qptr = np.concatenate(([0], np.cumsum(nquery)))
+
+    # find all cells within rxy distance of every query point in one parallel query, and drop the cells outside the mask since they never depend on any dam
+    inearby = meshTree.query_ball_point(xymesh[iunique], searchradius, workers=workers)
+    nnearby = np.fromiter(map(len, inearby), dtype=np.int64, count=len(inearby))
+    inearby = np.fromiter(itertools.chain.from_iterable(inearby), dtype=np.int64, count=nnearby.sum())
+    keep = inmask[inearby]
+    irow = np.repeat(np.arange(len(iunique)), nnearby)
+    nnearby = np.bincount(irow[keep], minlength=len(iunique))
+    inearby = inearby[keep]
+    nptr = np.concatenate(([0], np.cumsum(nnearby)))
+
+    # cumulative number of (dam, cell) pairs before each dam, to chunk the dams by their pairs
+    pairptr = np.concatenate(([0], np.cumsum(nnearby[iquery])))[qptr]
+
+    ndependent = np.zeros(ndams, dtype=np.int64)
+    i_DependentCells = []
+    i1 = 0
+    while i1 < ndams:
+        i2 = max(i1 + 1, np.searchsorted(pairptr, pairptr[i1] + maxpairs, side='right') - 1)
+
+        # gather the nearby cells of each query point of each dam in this chunk
+        iq = iquery[qptr[i1]:qptr[i2]]
+        idam = np.repeat(np.arange(i2 - i1), nquery[i1:i2])
+        ncells = nnearby[iq]
+        idam = np.repeat(idam, ncells)
+        icell = np.repeat(nptr[iq] - np.cumsum(ncells) + ncells, ncells) + np.arange(ncells.sum())
+        icell = inearby[icell]
+
+        # keep cells below the dam elevation
+        keep = zmesh[icell] < zdams[i1:i2][idam]
+        idam, icell = idam[keep], icell[keep]
+
+        # keep the unique cells for each dam. sorting the (dam, cell) pairs puts each dam's cells in one sorted segment
+        isort = np.lexsort((icell, idam))
+        idam, icell = idam[isort], icell[isort]
+        unique = np.ones(len(icell), dtype=bool)
+        unique[1:] = (icell[1:] != icell[:-1]) | (idam[1:] != idam[:-1])
+        idam, icell = idam[unique], icell[unique]
+
+        ndependent[i1:i2] = np.bincount(idam, minlength=i2 - i1)
+        i_DependentCells.append(icell.astype(_inttype(len(xymesh))))
+        i1 = i2
+
+    indptr = np.concatenate(([0], np.cumsum(ndependent)))
+    i_DependentCells = np.concatenate(i_DependentCells) if ndams else np.empty(0, dtype=np.int32)
+
+    return indptr,i_DependentCells
+
+
+
+class DamDependencyIndex:
+
+    """
+    stateful dam dependency search for scenarios that change a few dams at a time
+
+    The mesh kdtree, mask membership and flow network are built once, and the downstream and dependent cells are stored per dam, so add_dams, update_dams and remove_dams only recompute the dams they touch. The dependency of one dam does not depend on the other dams, so the results are the same as calling makeDamDependency on the current set of dams.
+
+    Parameters
+    ----------
+    Mesh : GeoDataFrame
+        Polygons representing mesh created by pyhexwatershed, with ID, dnID and Elevation fields.
+    searchradius : int (scalar)
+        horizontal search radius for KDTree algorithm (distance from flowline for dependent cell search)
+    globalID : int (list)
+        list of cell IDs (assumes they begin at 1, not 0)
+    Mask: GeoDataFrame
+        LineString (should work if Polygon) representing basin boundary, used to omit mesh cells from dependent cell search
+    FlowLine : GeoDataFrame
+        Vector flowline. If given, dams are placed in the nearest mesh cell that contains a flowline vertex, as in makeDamDependency with useflowline=True. default: None
+    cachedir : str
+        on-disk cache for the mesh index, see makeDamDependency. default: None (no cache)
+    geographic : bool
+        build the kdtree on the unit sphere for lat/lon meshes, with searchradius in metres, see makeDamDependency. default: False
+
+    Example
+    -------
+    index = DamDependencyIndex(Mesh,searchradius,globalID,Mask)
+    index.add_dams(Dams)                # dams are keyed by Dams.index
+    index.update_dams(MovedDams)        # same keys, new locations
+    index.remove_dams([12, 37])
+    ID_DependentCells = index.dependency()
+    """
+
+    def __init__(self,Mesh,searchradius,globalID,Mask,FlowLine=None,cachedir=None,geographic=False):
+        from scipy.spatial import KDTree
+
+        self.xymesh,self.meshTree,self.inmask = _meshIndex(Mesh,Mask,cachedir,geographic)
+        self.zmesh = np.array(Mesh[['Elevation']]).flatten()
+        self.network = FlowNetwork(np.array(Mesh['ID']),np.array(Mesh['dnID']))
+        self.globalID = np.asarray(globalID)
+        self.geographic = geographic
+        self.searchradius = distance2chord(searchradius) if geographic else searchradius
+
+        # mesh cells on the flowline, and a kdtree to place the dams on them
+        self.iMeshLine = None
+        if FlowLine is not None:
+            self.iMeshLine = findCellsOnVectorFlowline(FlowLine,self.meshTree,geographic=geographic)[1]
+            self.lineTree = KDTree(self.meshTree.data[self.iMeshLine])
+
+        # per-dam results: key -> (iMesh, i_DownstreamCells, i_DependentCells)
+        self._dams = {}
+
+    def __len__(self):
+        return len(self._dams)
+
+    def __contains__(self,key):
+        return key in self._dams
+
+    @property
+    def keys(self):
+        """ dam keys, in the order of the rows returned by dependency """
+        return list(self._dams)
+
+    def add_dams(self,Dams):
+        """ add new dams (GeoDataFrame of points, keyed by Dams.index) """
+        existing = [key for key in Dams.index if key in self._dams]
+        if existing:
+            raise KeyError(f'dams already in the index, use update_dams: {existing}')
+        self._update(Dams)
+
+    def update_dams(self,Dams):
+        """ recompute dams that moved (GeoDataFrame of points, keyed by Dams.index) """
+        missing = [key for key in Dams.index if key not in self._dams]
+        if missing:
+            raise KeyError(f'dams not in the index, use add_dams: {missing}')
+        self._update(Dams)
+
+    def remove_dams(self,keys):
+        """ remove dams by key """
+        missing = [key for key in keys if key not in self._dams]
+        if missing:
+            raise KeyError(f'dams not in the index: {missing}')
+        for key in keys:
+            del self._dams[key]
+
+    def iMesh(self,keys=None):
+        """ index of the mesh cell that contains each dam """
+        keys = self.keys if keys is None else keys
+        return np.array([self._dams[key][0] for key in keys], dtype=np.int64)
+
+    def downstream(self,keys=None):
+        """ ragged (indptr, indices) of the mesh cells downstream of each dam, see FlowNetwork.downstream """
+        return self._ragged(1,keys)
+
+    def dependency(self,keys=None,output='padded'):
+        """ dependent cells of each dam, in the output format of makeDamDependency """
+        indptr,i_DependentCells = self._ragged(2,keys)
+        return _dependencyOutput(indptr,i_DependentCells,self.globalID,len(self.xymesh),output)
+
+    def query(self,xydams):
+
+        """
+        find the mesh cells, downstream cells and dependent cells of dams at the given locations, without adding them to the index
+
+        Parameters
+        ----------
+        xydams : float (array)
+            ndams x 2 array of dam coordinates (lon/lat if geographic)
+
+        Returns
+        -------
+        imeshdams : int (array)
+            index of the mesh cell that contains each dam
+        downstream : (int (array), int (array))
+            ragged (indptr, indices) of the mesh cells downstream of each dam
+        dependent : (int (array), int (array))
+            ragged (indptr, indices) of the dependent mesh cells of each dam (indices, not IDs)
+        """
+
+        xydams = _treecoords(np.asarray(xydams, dtype=np.float64).reshape(-1, 2),self.geographic)
+        if self.iMeshLine is None:
+            imeshdams = self.meshTree.query(xydams)[1]
+        else:
+            imeshdams = self.iMeshLine[self.lineTree.query(xydams)[1]]
+        downstream = self.network.downstream(imeshdams)
+        dependent = findDependentCells(self.meshTree,self.meshTree.data,self.zmesh,
+            self.inmask,downstream,self.zmesh[imeshdams],self.searchradius)
+        return imeshdams,downstream,dependent
+
+    def _update(self,Dams):
+        # find the mesh cells that contain the dams, walk down the network, and search for the dependent cells of these dams only
+        if len(Dams) == 0:
+            return
+        imeshdams,(downptr,i_downstream),(indptr,i_dependent) = self.query(
+            np.column_stack((np.asarray(Dams.geometry.x), np.asarray(Dams.geometry.y))))
+
+        for n,key in enumerate(Dams.index):
+            self._dams[key] = (imeshdams[n],
+                i_downstream[downptr[n]:downptr[n+1]], i_dependent[indptr[n]:indptr[n+1]])
+
+    def _ragged(self,field,keys):
+        keys = self.keys if keys is None else keys
+        values = [self._dams[key][field] for key in keys]
+        lengths = np.fromiter(map(len, values), dtype=np.int64, count=len(values))
+        indptr = np.concatenate(([0], np.cumsum(lengths)))
+        values = np.concatenate(values) if values else np.empty(0, dtype=np.int64)
+        return indptr,values
+
+
+def findCellsOnVectorFlowline(Line,meshTree,workers=-1,geographic=False):
+
+    """
+    find mesh cells that contain flowline vertices by finding the nearest mesh cell to each vertex of each line
+
+    All vertices of all lines are extracted in one step and queried against the mesh kdtree in one parallel query, instead of one query per LineString.
+
+    Parameters
+    ----------
+    Line : GeoDataFrame
+        Vector flowline (LineString or MultiLineString).
+    meshTree : scipy.spatial.KDTree
+        kdtree built on the mesh cell centroids
+    workers : int (scalar)
+        number of workers for the kdtree query. default: -1 (all cores)
+    geographic : bool
+        set True if meshTree is built on unit-sphere coordinates (lat/lon mesh), see makeDamDependency. default: False
+
+    Returns
+    -------
+    iLine : (int (array), int (array))
+        ragged (indptr, indices) pair, where the mesh cell indices of the vertices of line i are indices[indptr[i]:indptr[i+1]]
+    iMeshLine : int (array)
+        sorted unique indices of the mesh cells that contain a flowline vertex
+    """
 
-    # add the indices to the Line gdf, the flatten the indices and subset the Mesh cells that contain a line segment
-    Line['iMesh'] = imeshline
-    imeshline = [idx for sublist in imeshline for idx in sublist]
+    import shapely
 
-    return Mesh.iloc[imeshline]
+    # this won't be necessary if an attribute in Mesh or Line indicates the mapping between them.
+    xyline,iline = shapely.get_coordinates(np.asarray(Line.geometry), return_index=True)
+    indptr = np.concatenate(([0], np.cumsum(np.bincount(iline, minlength=len(Line)))))
+    imeshline = meshTree.query(_treecoords(xyline,geographic), workers=workers)[1]
 
-    # # for reference, in one line (still needs to be flattened later):
-    # # imeshline = [meshTree.query(thisline.geometry.coords)[1] for iline,thisline in Line.iterrows()]
+    return (indptr,imeshline),np.unique(imeshline)
 
     # Note: this shouldn't be necessary. it is only here because the iSegment field in the hexwatershed.json file i used to prototype this code doesn't match the conceptual flowline file (possibly due to my mistake, but I wasn't able to piece it together. we might also keep this if we want the option to build a gdf (called MeshLine below) that represents the Mesh cells that contain a flowline, and build a kdtree from that rather than the entire mesh (or an option to identify the flowline from the mesh independently of the iSegment field)
 
@@ -0,0 +1,164 @@
+"""
+mosartparams.py
+Desc: lazy reader for MOSART parameter files
+
+Only the requested variables are read, in chunks of rows, and converted to typed NumPy arrays, so the ID/dnID/area of a global parameter file can be read without loading the file. netCDF3 (classic/64-bit offset) files are memory-mapped with scipy, netCDF4 files are read with netCDF4 (optional dependency). Gridded variables (lat x lon) are flattened in C order, so every variable is aligned with the flattened ID.
+"""
+
+import numpy as np
+
+# default number of array elements read at a time
+CHUNKSIZE = 2**22
+
+# type of the variables returned by readMosartNetwork. other variables are float64
+NETWORKTYPES = {'ID': np.int64, 'dnID': np.int64}
+
+
+class MosartParameters:
+
+    """
+    open MOSART parameter file, read variables on request
+
+    Parameters
+    ----------
+    filename : str
+        MOSART parameter file (netCDF3 or netCDF4)
+    chunksize : int (scalar)
+        number of array elements read at a time. default: 2**22
+
+    Example
+    -------
+    with MosartParameters('MOSART_global_half.nc') as params:
+        network = params.network()
+        area = params.read('area')
+    """
+
+    def __init__(self,filename,chunksize=CHUNKSIZE):
+        self.filename = filename
+        self.chunksize = chunksize
+
+        with open(filename, 'rb') as f:
+            magic = f.read(3)
+        if magic == b'CDF':
+            # classic files store each variable contiguously, so it can be mapped directly
+            from scipy.io import netcdf_file
+            self._nc = netcdf_file(filename, 'r', mmap=True, maskandscale=False)
+            self.mmap = True
+        else:
+            import netCDF4
+            self._nc = netCDF4.Dataset(filename)
+            self._nc.set_auto_mask(False)
+            self.mmap = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self,*args):
+        self.close()
+
+    def close(self):
+        self._nc.close()
+
+    @property
+    def variables(self):
+        """ names of the variables in the file """
+        return list(self._nc.variables)
+
+    def shape(self,name):
+        """ shape of a variable in the file """
+        return tuple(self._nc.variables[name].shape)
+
+    def iterchunks(self,name,dtype=None):
+
+        """
+        iterate over a variable in chunks of whole rows, flattened in C order
+
+        Parameters
+        ----------
+        name : str
+            variable name
+        dtype : numpy dtype
+            type of the chunks. float values are rounded when converted to integers. default: None (type in the file)
+
+        Returns
+        -------
+        chunks : generator of 1d arrays
+        """
+
+        var = self._nc.variables[name]
+        shape = self.shape(name)
+        if len(shape) == 0:
+            yield _cast(np.asarray(var[...]).reshape(-1),dtype)
+            return
+        rowsize = int(np.prod(shape[1:]))
+        nrows = max(1, self.chunksize // max(rowsize, 1))
+        for i in range(0, shape[0], nrows):
+            yield _cast(np.asarray(var[i:i + nrows]).reshape(-1),dtype)
+
+    def read(self,name,dtype=None):
+
+        """
+        read a variable as a flat typed array, one chunk at a time
+
+        Parameters
+        ----------
+        name : str
+            variable name
+        dtype : numpy dtype
+            type of the returned array. float values are rounded when converted to integers. default: None (type in the file)
+
+        Returns
+        -------
+        values : array
+            flattened variable
+        """
+
+        values = None
+        n = 0
+        for chunk in self.iterchunks(name,dtype):
+            if values is None:
+                values = np.empty(int(np.prod(self.shape(name))), dtype=chunk.dtype)
+            values[n:n + len(chunk)] = chunk
+            n += len(chunk)
+        if values is None:
+            # a zero-length leading dimension gives no chunks, so read an empty slice for the type
+            values = _cast(np.asarray(self._nc.variables[name][0:0]).reshape(-1),dtype)
+        return values
+
+    def network(self,ID='ID',dnID='dnID'):
+        """ FlowNetwork of the ID/dnID variables, see flownetwork.FlowNetwork """
+        from pyfunclib.libe3sm.flownetwork import FlowNetwork
+        return FlowNetwork(self.read(ID,np.int64),self.read(dnID,np.int64),'mosart')
+
+
+def readMosartNetwork(filename,variables=('ID','dnID','area'),chunksize=CHUNKSIZE):
+
+    """
+    read the network variables of a MOSART parameter file
+
+    Parameters
+    ----------
+    filename : str
+        MOSART parameter file (netCDF3 or netCDF4)
+    variables : str (list)
+        variables to read. default: ('ID', 'dnID', 'area')
+    chunksize : int (scalar)
+        number of array elements read at a time
+
+    Returns
+    -------
+    values : dict
+        flat array for each variable. ID and dnID are int64, the other variables float64, e.g. FlowNetwork(values['ID'],values['dnID']) or findDownstreamCells(values['ID'],values['dnID'],ipoints)
+    """
+
+    with MosartParameters(filename,chunksize) as params:
+        return {name: params.read(name,NETWORKTYPES.get(name, np.float64)) for name in variables}
+
+
+def _cast(values,dtype):
+    if dtype is None:
+        return values.astype(values.dtype.newbyteorder('='), copy=False)
+    dtype = np.dtype(dtype)
+    if dtype.kind in 'iu' and values.dtype.kind == 'f':
+        values = np.rint(values)
+    return values.astype(dtype)
@@ -0,0 +1,167 @@
+"""
+networkmetrics.py
+Desc: stream order and flow path metrics for mesh river networks, for dam screening
+
+All functions take a FlowNetwork and return arrays aligned with its ID. They visit the cells level by level in topological order (see FlowNetwork.levels), so there is no recursion and each level is one set of NumPy operations.
+"""
+
+import time
+import numpy as np
+
+from pyfunclib.libe3sm.flownetwork import FlowNetwork, syntheticNetwork
+
+
+def strahlerOrder(network):
+
+    """
+    Strahler stream order of each cell
+
+    Headwater cells are order 1. A cell's order is the highest order of its upstream cells, plus one if two or more upstream cells share that highest order.
+    """
+
+    # highest upstream order, and the number of upstream cells with that order, gathered as each level is finished
+    maxup = np.zeros(network.ncells, dtype=np.int64)
+    nmax = np.zeros(network.ncells, dtype=np.int64)
+    order = np.zeros(network.ncells, dtype=np.int64)
+
+    # the routes of each level, keyed by level (levels with only outlets have none)
+    routes = {network.levels[route[0][0]]: route for route in network.levelroutes()}
+
+    levelorder,levelptr = network.order
+    for level,(i1,i2) in enumerate(zip(levelptr[:-1], levelptr[1:])):
+        icells = levelorder[i1:i2]
+        order[icells] = np.where(maxup[icells] == 0, 1, maxup[icells] + (nmax[icells] >= 2))
+
+        # push this level's orders to the cells below it
+        if level not in routes:
+            continue
+        isrc,idst,istart = routes[level]
+        osrc = order[isrc]
+        omax = np.maximum.reduceat(osrc, istart)
+        cmax = np.add.reduceat(osrc == np.repeat(omax, np.diff(np.append(istart, len(isrc)))), istart)
+        higher = omax > maxup[idst]
+        equal = omax == maxup[idst]
+        nmax[idst] = np.where(higher, cmax, np.where(equal, nmax[idst] + cmax, nmax[idst]))
+        maxup[idst] = np.maximum(maxup[idst], omax)
+
+    return order
+
+
+def shreveOrder(network):
+
+    """
+    Shreve stream magnitude of each cell: the number of headwater cells upstream of it (1 for headwater cells)
+    """
+
+    headwater = np.bincount(network.idown[network.idown >= 0], minlength=network.ncells) == 0
+    return np.rint(network.accumulate(headwater.astype(np.float64))).astype(np.int64)
+
+
+def upstreamCount(network):
+
+    """
+    number of cells upstream of each cell, not counting the cell itself
+    """
+
+    return np.rint(network.accumulate(np.ones(network.ncells))).astype(np.int64) - 1
+
+
+def flowLength(network,xy):
+
+    """
+    distance from each cell centroid to the centroid of its downstream cell (0 for outlets)
+
+    Parameters
+    ----------
+    network : FlowNetwork
+    xy : float (array)
+        ncells x 2 array of cell centroids
+    """
+
+    xy = np.asarray(xy, dtype=np.float64)
+    idn = np.where(network.idown >= 0, network.idown, np.arange(network.ncells))
+    return np.hypot(*(xy[idn] - xy).T)
+
+
+def longestFlowPath(network,length=None):
+
+    """
+    length of the longest flow path from any headwater cell to each cell
+
+    Parameters
+    ----------
+    network : FlowNetwork
+    length : float (array)
+        flow length of each cell to its downstream cell, e.g. from flowLength. default: None (1 per cell, so the path length is in cells)
+    """
+
+    length = np.ones(network.ncells) if length is None else np.asarray(length, dtype=np.float64)
+    longest = np.zeros(network.ncells)
+    for isrc,idst,istart in network.levelroutes():
+        longest[idst] = np.maximum(longest[idst], np.maximum.reduceat(longest[isrc] + length[isrc], istart))
+    return longest
+
+
+def distanceToOutlet(network,length=None):
+
+    """
+    flow distance from each cell to its outlet
+
+    Parameters
+    ----------
+    network : FlowNetwork
+    length : float (array)
+        flow length of each cell to its downstream cell, e.g. from flowLength. default: None (1 per cell, so the distance is in cells)
+    """
+
+    length = np.ones(network.ncells) if length is None else np.asarray(length, dtype=np.float64)
+    distance = np.zeros(network.ncells)
+
+    # walk the levels from the top down, so the downstream cell's distance is always known
+    order,levelptr = network.order
+    for i1,i2 in zip(levelptr[-2::-1], levelptr[:0:-1]):
+        icells = order[i1:i2]
+        icells = icells[network.idown[icells] >= 0]
+        distance[icells] = length[icells] + distance[network.idown[icells]]
+    return distance
+
+
+def benchmark(ncells=(10**4,10**5,10**6),seed=0):
+
+    """
+    time each metric on synthetic river networks (see syntheticNetwork)
+
+    Returns
+    -------
+    results : dict (list)
+        one dict per network size and metric with ncells, nlevels, metric and seconds. the 'network' metric is the FlowNetwork construction plus the topological sort, which the other metrics share
+    """
+
+    metrics = {
+        'strahlerOrder': strahlerOrder,
+        'shreveOrder': shreveOrder,
+        'upstreamCount': upstreamCount,
+        'longestFlowPath': longestFlowPath,
+        'distanceToOutlet': distanceToOutlet,
+    }
+
+    results = []
+    for n in ncells:
+        ID,dnID = syntheticNetwork(n, seed=seed)
+        t0 = time.perf_counter()
+        network = FlowNetwork(ID, dnID)
+        network.levels
+        network.levelroutes()
+        seconds = time.perf_counter() - t0
+        nlevels = int(network.levels.max()) + 1
+        results.append(dict(ncells=n, nlevels=nlevels, metric='network', seconds=seconds))
+        for name,metric in metrics.items():
+            t0 = time.perf_counter()
+            metric(network)
+            results.append(dict(ncells=n, nlevels=nlevels, metric=name, seconds=time.perf_counter() - t0))
+    return results
+
+
+if __name__ == '__main__':
+    for result in benchmark():
+        print(result)
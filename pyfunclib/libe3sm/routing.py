@@ -0,0 +1,232 @@
+"""
+routing.py
+Desc: vectorized channel routing (Muskingum or kinematic wave) on a mesh river network, for MOSART-like sanity checks on hexwatershed meshes
+"""
+
+import time
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+from pyfunclib.libe3sm.flownetwork import FlowNetwork, syntheticNetwork
+
+
+def muskingumCoefficients(K,X,dt):
+
+    """
+    Muskingum routing coefficients, O[t+1] = C0*I[t+1] + C1*I[t] + C2*O[t]
+
+    Parameters
+    ----------
+    K : float (scalar or array)
+        travel time through the reach (cell), same units as dt
+    X : float (scalar or array)
+        weighting factor, 0 <= X <= 0.5
+    dt : float (scalar)
+        time step
+
+    Returns
+    -------
+    C0, C1, C2 : float (scalar or array)
+        coefficients, which sum to 1. all are non-negative if 2*K*X <= dt <= 2*K*(1-X)
+    """
+
+    denom = 2.0 * K * (1.0 - X) + dt
+    C0 = (dt - 2.0 * K * X) / denom
+    C1 = (dt + 2.0 * K * X) / denom
+    C2 = (2.0 * K * (1.0 - X) - dt) / denom
+    return C0,C1,C2
+
+
+def route(network,lateral,dt,method='muskingum',K=None,X=0.2,alpha=None,beta=0.6,Q0=None,nthreads=1):
+
+    """
+    route lateral inflow through the network
+
+    Each time step visits the cells level by level in topological order (see FlowNetwork.levels), so all cells of a level, and all ensemble members, are updated together with NumPy. The inflow of a cell is its lateral inflow plus the outflow of its upstream cells in the same time step.
+
+    Parameters
+    ----------
+    network : FlowNetwork
+        river network, see FlowNetwork
+    lateral : float (array)
+        lateral inflow to each cell [volume/time], shape (ntime, ncells) or (ntime, nmembers, ncells) for an ensemble
+    dt : float (scalar)
+        time step
+    method : str
+        'muskingum' for linear Muskingum routing with travel time K and weight X. 'kinematic' for a lumped kinematic-wave (nonlinear storage) reservoir per cell, with storage S = alpha*Q**beta, solved implicitly with Newton iterations. default: 'muskingum'
+    K : float (scalar or array)
+        Muskingum travel time of each cell, same units as dt
+    X : float (scalar or array)
+        Muskingum weighting factor. default: 0.2
+    alpha : float (scalar or array)
+        kinematic-wave storage coefficient of each cell
+    beta : float (scalar or array)
+        kinematic-wave storage exponent. default: 0.6 (Manning)
+    Q0 : float (array)
+        initial outflow of each cell, shape (ncells,). the initial inflow is set to the same value (steady state). default: 0
+    nthreads : int (scalar)
+        number of threads. independent sub-basins (see FlowNetwork.basins) are split into nthreads groups of similar size which are routed concurrently. default: 1
+
+    Returns
+    -------
+    Q : float (array)
+        outflow of each cell, same shape as lateral
+    """
+
+    lateral = np.asarray(lateral, dtype=np.float64)
+    if lateral.shape[-1] != network.ncells:
+        raise ValueError(f'lateral must have ncells={network.ncells} on the last axis, got shape {lateral.shape}')
+    shape = lateral.shape
+    ntime = shape[0]
+    nmembers = int(np.prod(shape[1:-1]))
+    ncells = network.ncells
+
+    # per-cell parameters as (ncells, 1) columns, so they broadcast over the members
+    def column(a):
+        return np.broadcast_to(np.asarray(a, dtype=np.float64).reshape(-1, 1), (ncells, 1))
+
+    if method == 'muskingum':
+        if K is None:
+            raise ValueError("method='muskingum' requires K")
+        params = tuple(map(column, muskingumCoefficients(np.asarray(K), np.asarray(X), dt)))
+    elif method == 'kinematic':
+        if alpha is None:
+            raise ValueError("method='kinematic' requires alpha")
+        params = (column(alpha), column(beta))
+    else:
+        raise ValueError(f"method must be 'muskingum' or 'kinematic', got '{method}'")
+
+    # lateral inflow and outflow with cells first: (ntime, ncells, nmembers)
+    lateral = np.moveaxis(lateral.reshape(ntime, nmembers, ncells), 2, 1)
+    Q = np.empty((ntime, ncells, nmembers))
+
+    Qold = np.zeros((ncells, nmembers)) if Q0 is None else np.repeat(column(Q0), nmembers, axis=1)
+    Iold = Qold.copy()
+
+    groups = _basinGroups(network,nthreads)
+    schedules = [_schedule(network,icells) for icells in groups]
+
+    def run(schedule):
+        _routeGroup(schedule,method,params,lateral,dt,Qold.copy(),Iold.copy(),Q)
+
+    if len(schedules) == 1:
+        run(schedules[0])
+    else:
+        with ThreadPoolExecutor(max_workers=len(schedules)) as pool:
+            list(pool.map(run, schedules))
+
+    return np.moveaxis(Q, 1, 2).reshape(shape)
+
+
+def _routeGroup(schedule,method,params,lateral,dt,Qold,Iold,Q):
+    # time loop for one group of sub-basins. the groups touch disjoint cells, so they can share Q
+    icells = np.concatenate([level[0] for level in schedule])
+    Qnew = np.empty_like(Qold)
+    for t in range(lateral.shape[0]):
+        Inew = lateral[t].copy()
+        for ilevel,isrc,idst,istart in schedule:
+            if method == 'muskingum':
+                C0,C1,C2 = (p[ilevel] for p in params)
+                Qnew[ilevel] = C0 * Inew[ilevel] + C1 * Iold[ilevel] + C2 * Qold[ilevel]
+            else:
+                alpha,beta = (p[ilevel] for p in params)
+                Qnew[ilevel] = _kinematicStep(Inew[ilevel],Qold[ilevel],alpha,beta,dt)
+            # pass this level's outflow to the inflow of the cells below it
+            if len(isrc):
+                Inew[idst] += np.add.reduceat(Qnew[isrc], istart, axis=0)
+        Q[t,icells] = Qnew[icells]
+        Qold,Qnew = Qnew,Qold
+        Iold = Inew
+
+
+def _kinematicStep(Inew,Qold,alpha,beta,dt,maxiter=20,tol=1e-10):
+    # implicit step of dS/dt = I - Q with S = alpha*Q**beta: solve alpha*Q**beta + dt*Q = alpha*Qold**beta + dt*Inew for Q >= 0. the left side increases with Q, so Newton converges from the old outflow
+    rhs = alpha * Qold**beta + dt * Inew
+    Q = np.maximum(Qold, 1e-12)
+    for _ in range(maxiter):
+        f = alpha * Q**beta + dt * Q - rhs
+        dQ = f / (alpha * beta * Q**(beta - 1.0) + dt)
+        Q = np.maximum(Q - dQ, 1e-12)
+        if np.all(np.abs(dQ) <= tol * np.maximum(Q, 1.0)):
+            break
+    return np.where(rhs > 0, Q, 0.0)
+
+
+def _basinGroups(network,ngroups):
+    # split the independent sub-basins into ngroups sets of cells with similar total size (largest basins first, each to the smallest group)
+    if ngroups <= 1:
+        return [np.arange(network.ncells)]
+    outlets,ibasin,nbasin = np.unique(network.basins, return_inverse=True, return_counts=True)
+    igroup = np.empty(len(outlets), dtype=np.int64)
+    load = np.zeros(ngroups, dtype=np.int64)
+    for b in np.argsort(-nbasin, kind='stable'):
+        g = np.argmin(load)
+        igroup[b] = g
+        load[g] += nbasin[b]
+    cellgroup = igroup[ibasin]
+    return [np.flatnonzero(cellgroup == g) for g in range(ngroups) if load[g] > 0]
+
+
+def _schedule(network,icells):
+    # for each level of the given cells: the cells, and the cells that drain to a lower cell sorted by their downstream cell, the unique downstream cells and the segment starts for np.add.reduceat
+    ingroup = np.zeros(network.ncells, dtype=bool)
+    ingroup[icells] = True
+    order,levelptr = network.order
+    schedule = []
+    for i1,i2 in zip(levelptr[:-1], levelptr[1:]):
+        ilevel = order[i1:i2]
+        ilevel = ilevel[ingroup[ilevel]]
+        if len(ilevel) == 0:
+            continue
+        isrc = ilevel[network.idown[ilevel] >= 0]
+        isrc = isrc[np.argsort(network.idown[isrc], kind='stable')]
+        idst,istart = np.unique(network.idown[isrc], return_index=True)
+        schedule.append((ilevel,isrc,idst,istart))
+    return schedule
+
+
+def benchmark(ncells=(10**3,10**4,10**5),ntime=100,nmembers=(1,16),nthreads=(1,4),method='muskingum',seed=0):
+
+    """
+    time route on synthetic river networks (see syntheticNetwork)
+
+    Parameters
+    ----------
+    ncells : int (list)
+        network sizes. each network has one outlet per 1000 cells, so there are independent sub-basins for the threads
+    ntime : int (scalar)
+        number of time steps
+    nmembers : int (list)
+        ensemble sizes
+    nthreads : int (list)
+        thread counts
+    method : str
+        routing method, see route
+    seed : int (scalar)
+        random seed
+
+    Returns
+    -------
+    results : dict (list)
+        one dict per run with ncells, nlevels, nmembers, nthreads, seconds and cellsteps_per_second (cells x time steps x members per second)
+    """
+
+    rng = np.random.default_rng(seed)
+    results = []
+    for n in ncells:
+        network = FlowNetwork(*syntheticNetwork(n, noutlets=max(1, n // 1000), seed=seed))
+        nlevels = int(network.levels.max()) + 1
+        for m in nmembers:
+            lateral = rng.random((ntime, m, n))
+            for th in nthreads:
+                t0 = time.perf_counter()
+                route(network, lateral, dt=1.0, method=method, K=2.0, X=0.2, alpha=1.0, nthreads=th)
+                seconds = time.perf_counter() - t0
+                results.append(dict(ncells=n, nlevels=nlevels, nmembers=m, nthreads=th,
+                    seconds=seconds, cellsteps_per_second=n * ntime * m / seconds))
+    return results
+
+
+if __name__ == '__main__':
+    for result in benchmark():
+        print(result)
@@ -0,0 +1,44 @@
+import numpy as np
+import pytest
+
+gpd = pytest.importorskip('geopandas')
+
+from pyfunclib.libe3sm import damcli, damio
+from pyfunclib.libe3sm.flownetwork import FlowNetwork
+from pyfunclib.libe3sm.meshbench import syntheticHexMesh
+from pyfunclib.libe3sm.meshutils import makeDamDependency
+
+
+def test_runbasins_matches_makedamdependency(tmp_path):
+    Mesh,Dams,Mask,globalID = syntheticHexMesh(400, ndams=5, seed=0)
+    Mesh['GID'] = globalID
+    Mesh.to_file(tmp_path / 'mesh.gpkg')
+    Dams.to_file(tmp_path / 'dams.gpkg')
+    Mask.to_file(tmp_path / 'mask.gpkg')
+    (tmp_path / 'manifest.yaml').write_text(
+        'output: results\n'
+        'searchradius: 3.0\n'
+        'globalid: GID\n'
+        'basins:\n'
+        '  - name: synthetic\n'
+        '    mesh: mesh.gpkg\n'
+        '    dams: dams.gpkg\n'
+        '    mask: mask.gpkg\n')
+
+    timings = damcli.runBasins(str(tmp_path / 'manifest.yaml'), workers=1)
+    assert [timing['status'] for timing in timings] == ['done']
+    result = damio.readDamDependency(tmp_path / 'results' / 'synthetic.npz')
+
+    Mesh = gpd.read_file(tmp_path / 'mesh.gpkg')
+    Dams = gpd.read_file(tmp_path / 'dams.gpkg')
+    Mask = gpd.read_file(tmp_path / 'mask.gpkg')
+    indptr,ids = makeDamDependency(Dams, Mesh, 3.0, globalID, Mask, output='ragged')
+    np.testing.assert_array_equal(result['dependent'][0], indptr)
+    np.testing.assert_array_equal(result['dependent'][1], ids)
+
+    # cells below each dam down to the outlet, in the global IDs of the dependent cells
+    network = FlowNetwork(Mesh['ID'].values, Mesh['dnID'].values)
+    indptr,idx = network.downstream(Dams['iMesh'].values)
+    np.testing.assert_array_equal(result['downstream'][0], indptr)
+    np.testing.assert_array_equal(result['downstream'][1], globalID[idx])
+    assert result['downstream'][1].dtype == result['dependent'][1].dtype
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from pyfunclib.libe3sm import damio
+
+
+def _results():
+    damID = np.array([10, 20, 30, 40])
+    dependent = (np.array([0, 2, 2, 5, 6]), np.array([7, 8, 1, 2, 3, 9]))
+    downstream = (np.array([0, 1, 3, 3, 4]), np.array([4, 5, 6, 2]))
+    return damID,dependent,downstream
+
+
+def _check(results,damID,dependent,downstream):
+    np.testing.assert_array_equal(results['damID'], damID)
+    for name,expected in (('dependent', dependent), ('downstream', downstream)):
+        np.testing.assert_array_equal(results[name][0], expected[0])
+        np.testing.assert_array_equal(results[name][1], expected[1])
+
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_npz_roundtrip(tmp_path,mmap):
+    damID,dependent,downstream = _results()
+    filename = tmp_path / 'dams.npz'
+    damio.writeDamDependency(filename,damID,dependent,downstream,chunksize=2)
+    _check(damio.readDamDependency(filename,mmap=mmap),damID,dependent,downstream)
+
+
+def test_npz_without_downstream(tmp_path):
+    damID,dependent,_ = _results()
+    filename = tmp_path / 'dams.npz'
+    damio.writeDamDependency(filename,damID,dependent)
+    results = damio.readDamDependency(filename)
+    assert 'downstream' not in results
+    np.testing.assert_array_equal(results['dependent'][1], dependent[1])
+
+
+def test_npz_newer_version(tmp_path):
+    filename = tmp_path / 'dams.npz'
+    damio._writenpz(filename,{'damID': np.arange(2), 'format_version': np.array(damio.FORMAT_VERSION + 1)},damio.CHUNKSIZE)
+    with pytest.raises(ValueError, match='format version'):
+        damio.readDamDependency(filename)
+
+
+def test_nc_roundtrip(tmp_path):
+    pytest.importorskip('netCDF4')
+    damID,dependent,downstream = _results()
+    filename = tmp_path / 'dams.nc'
+    damio.writeDamDependency(filename,damID,dependent,downstream,chunksize=2)
+    _check(damio.readDamDependency(filename),damID,dependent,downstream)
+
+
+def test_nc_newer_version(tmp_path):
+    netCDF4 = pytest.importorskip('netCDF4')
+    damID,dependent,_ = _results()
+    filename = tmp_path / 'dams.nc'
+    damio.writeDamDependency(filename,damID,dependent)
+    with netCDF4.Dataset(filename, 'a') as nc:
+        nc.format_version = damio.FORMAT_VERSION + 1
+    with pytest.raises(ValueError, match='format version'):
+        damio.readDamDependency(filename)
@@ -0,0 +1,17 @@
+import numpy as np
+
+from pyfunclib.libe3sm import networkmetrics
+from pyfunclib.libe3sm.flownetwork import FlowNetwork
+
+
+def test_levelroutes():
+    # 1 and 2 drain to 3, 3 and 4 drain to 5, the outlet
+    network = FlowNetwork(np.array([1, 2, 3, 4, 5]), np.array([3, 3, 5, 5, -9999]))
+    routes = network.levelroutes()
+    assert routes is network.levelroutes()
+    acc = np.ones(network.ncells)
+    for isrc,idst,istart in routes:
+        assert np.all(network.idown[isrc] == np.repeat(idst, np.diff(np.append(istart, len(isrc)))))
+        acc[idst] += np.add.reduceat(acc[isrc], istart)
+    np.testing.assert_array_equal(acc, [1, 1, 3, 1, 5])
+    np.testing.assert_array_equal(networkmetrics.longestFlowPath(network), [0, 0, 1, 0, 2])
@@ -0,0 +1,24 @@
+import numpy as np
+import pytest
+
+from pyfunclib.libdata import gof, gofgrouped, gofrolling
+
+
+@pytest.mark.parametrize('skipna', [False, True])
+def test_log_nse_per_window_and_group(skipna):
+    rng = np.random.default_rng(0)
+    actual = rng.gamma(2, size=200)
+    predicted = np.stack([actual + rng.gamma(2, size=200) * 0.3, actual * 1.1], axis=1)
+    if skipna:
+        actual[rng.random(200) < 0.1] = np.nan
+
+    window = 30
+    values = gofrolling.rolling(actual, predicted, window, metrics=('log_nse',), skipna=skipna)['log_nse']
+    expected = [[gof.log_nse(actual[t - window + 1:t + 1], predicted[t - window + 1:t + 1, m], skipna=skipna) for m in range(2)]
+                for t in range(window - 1, 200)]
+    np.testing.assert_allclose(values[window - 1:], expected, rtol=1e-12)
+
+    groups = np.arange(200) % 7
+    frame = gofgrouped.evaluate_grouped(actual, predicted, groups, metrics=('log_nse',), skipna=skipna)
+    expected = [gof.log_nse(actual[groups == k], predicted[groups == k, m], skipna=skipna) for k in range(7) for m in range(2)]
+    np.testing.assert_allclose(frame['log_nse'], expected, rtol=1e-12)
@@ -0,0 +1,56 @@
+import asyncio
+import threading
+import time
+
+import numpy as np
+import pytest
+
+pytest.importorskip('geopandas')
+
+from pyfunclib.libe3sm import meshserver
+from pyfunclib.libe3sm.meshbench import syntheticHexMesh
+from pyfunclib.libe3sm.meshutils import DamDependencyIndex, makeDamDependency
+
+
+@pytest.fixture(scope='module')
+def served(tmp_path_factory):
+    Mesh,Dams,Mask,globalID = syntheticHexMesh(400, ndams=5, seed=0)
+    index = DamDependencyIndex(Mesh, 3.0, globalID, Mask)
+    path = str(tmp_path_factory.mktemp('server') / 'mesh.sock')
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_until_complete, args=(meshserver.MeshServer(index).serve(path),), daemon=True)
+    thread.start()
+    for _ in range(100):
+        try:
+            client = meshserver.MeshClient(path=path)
+            break
+        except (FileNotFoundError, ConnectionRefusedError):
+            time.sleep(0.05)
+    with client:
+        yield client,Mesh,Dams,Mask,globalID
+
+
+def test_dependency(served):
+    client,Mesh,Dams,Mask,globalID = served
+    xydams = np.column_stack((Dams.geometry.x, Dams.geometry.y))
+    indptr,ids = client.dependency(xydams)
+    expected = makeDamDependency(Dams.copy(), Mesh.copy(), 3.0, globalID, Mask, output='ragged')
+    np.testing.assert_array_equal(indptr, expected[0])
+    np.testing.assert_array_equal(ids, expected[1])
+
+
+def test_dependency_no_dams(served):
+    client = served[0]
+    indptr,ids = client.dependency(np.empty((0, 2)))
+    np.testing.assert_array_equal(indptr, [0])
+    assert len(ids) == 0
+    # the connection is still open
+    assert client.ping() == len(served[1])
+
+
+def test_network_no_points(served):
+    client = served[0]
+    for query in (client.downstream, client.upstream):
+        indptr,indices = query(np.empty(0, dtype=np.int64))
+        np.testing.assert_array_equal(indptr, [0])
+        assert len(indices) == 0
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from scipy.spatial import KDTree
+
+from pyfunclib.libe3sm import meshutils
+from pyfunclib.libe3sm.flownetwork import FlowNetwork
+from pyfunclib.libe3sm.meshbench import writeMeshJSON
+
+
+def test_meshjson_dnid(tmp_path):
+    # cell IDs out of order, two outlets
+    ID = np.array([5, 2, 9, 7, 1])
+    dnID = np.array([2, -9999, 2, 5, -9999])
+    writeMeshJSON(tmp_path / 'mesh.json', ID, dnID)
+    rowID,rowdnID = meshutils.meshjson_dnID(tmp_path / 'mesh.json')
+    np.testing.assert_array_equal(rowID, [1, 2, 3, 4, 5])
+    np.testing.assert_array_equal(rowdnID, [2, -9999, 2, 1, -9999])
+
+
+def test_meshjson_dnid_missing(tmp_path):
+    writeMeshJSON(tmp_path / 'mesh.json', np.array([1, 2]), np.array([3, -9999]))
+    with pytest.raises(ValueError):
+        meshutils.meshjson_dnID(tmp_path / 'mesh.json')
+
+
+@pytest.mark.parametrize('maxpairs', [1, 100, 2**22])
+def test_finddependentcells_maxpairs(maxpairs):
+    pytest.importorskip('geopandas')
+    from pyfunclib.libe3sm.meshbench import syntheticHexMesh
+
+    Mesh,Dams,Mask,globalID = syntheticHexMesh(400, ndams=20, seed=1)
+    xymesh = np.column_stack((Mesh.centroid.x, Mesh.centroid.y))
+    zmesh = np.asarray(Mesh['Elevation'])
+    imeshdams = np.asarray(Dams['iMesh'])
+    inmask = np.ones(len(Mesh), dtype=bool)
+    downstream = FlowNetwork(np.asarray(Mesh['ID']), np.asarray(Mesh['dnID'])).downstream(imeshdams)
+    tree = KDTree(xymesh)
+
+    indptr,icells = meshutils.findDependentCells(tree, xymesh, zmesh, inmask, downstream, zmesh[imeshdams], 3.0, maxpairs=maxpairs)
+    for i in range(len(imeshdams)):
+        idown = downstream[1][downstream[0][i]:downstream[0][i + 1]]
+        expected = set()
+        for nearby in tree.query_ball_point(xymesh[idown], 3.0):
+            expected.update(j for j in nearby if zmesh[j] < zmesh[imeshdams[i]])
+        np.testing.assert_array_equal(icells[indptr[i]:indptr[i + 1]], sorted(expected))
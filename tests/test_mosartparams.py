@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+from pyfunclib.libe3sm.mosartparams import MosartParameters
+
+
+def _writeparams(filename, ncells, format='NETCDF4'):
+    netCDF4 = pytest.importorskip('netCDF4')
+    with netCDF4.Dataset(filename, 'w', format=format) as nc:
+        nc.createDimension('gridcell', ncells)
+        nc.createDimension('nt', 3)
+        nc.createVariable('ID', 'i4', ('gridcell',))[:] = np.arange(1, ncells + 1)
+        nc.createVariable('area', 'f8', ('gridcell',))[:] = np.arange(ncells) + 0.6
+        nc.createVariable('table', 'f4', ('gridcell', 'nt'))[:] = np.arange(3 * ncells).reshape(ncells, 3)
+
+
+@pytest.mark.parametrize('format', ['NETCDF4', 'NETCDF3_64BIT_OFFSET'])
+def test_read(tmp_path, format):
+    filename = tmp_path / 'params.nc'
+    _writeparams(filename, 10, format)
+    with MosartParameters(filename, chunksize=4) as params:
+        np.testing.assert_array_equal(params.read('ID'), np.arange(1, 11))
+        np.testing.assert_array_equal(params.read('area', np.int64), np.rint(np.arange(10) + 0.6))
+        np.testing.assert_array_equal(params.read('table'), np.arange(30))
+
+
+@pytest.mark.parametrize('format', ['NETCDF4', 'NETCDF3_64BIT_OFFSET'])
+def test_read_empty(tmp_path, format):
+    filename = tmp_path / 'params.nc'
+    _writeparams(filename, 0, format)
+    with MosartParameters(filename) as params:
+        for name,dtype,expected in [('ID', None, np.int32), ('area', np.int64, np.int64), ('table', None, np.float32)]:
+            values = params.read(name, dtype)
+            assert values.shape == (0,)
+            assert values.dtype == expected